@@ -0,0 +1,307 @@
+import time
+from database import query_db, query_in, begin_immediate
+from utils import generate_uuid, encode_cursor, decode_cursor
+from records_service import RECORD_TYPES
+
+LEASE_SECONDS = 900        # An admin holds claimed requests this long before they return to the queue
+MAX_CLAIM = 50             # Requests one claim call may take
+PAGE_SIZE = 25
+MAX_PAGE_SIZE = 200
+BULK_CHUNK_SIZE = 500      # Requests completed per write transaction in a bulk upload
+
+
+class QueueConflict(Exception):
+    """The request is completed, missing, or leased to another admin."""
+
+    def __init__(self, message, status_code=409):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# A pending request an admin may take: no lease, an expired lease, or already theirs
+_AVAILABLE = "(lease_expires_at IS NULL OR lease_expires_at <= ? OR claimed_by = ?)"
+
+
+def claim_next(conn, admin_id, count=1, lease_seconds=LEASE_SECONDS, now=None):
+    """
+    Atomically lease the `count` oldest free requests to `admin_id`.
+    Requests the admin already holds are not returned again. Expired leases
+    are cleared on the way, so they no longer show the admin who let them lapse.
+    Returns the claimed request ids, oldest first.
+    """
+    now = now if now is not None else time.time()
+    count = max(1, min(int(count), MAX_CLAIM))
+    with begin_immediate(conn):
+        _release_expired(conn, now)
+        ids = [r['id'] for r in conn.execute("""
+            SELECT id FROM pending_medical_data_requests
+            WHERE status = 'pending' AND (lease_expires_at IS NULL OR lease_expires_at <= ?)
+            ORDER BY created_at, id
+            LIMIT ?
+        """, (now, count)).fetchall()]
+        if ids:
+            conn.executemany("""
+                UPDATE pending_medical_data_requests SET claimed_by = ?, lease_expires_at = ?
+                WHERE id = ?
+            """, [(admin_id, now + lease_seconds, i) for i in ids])
+    return ids
+
+
+def claim(conn, request_id, admin_id, lease_seconds=LEASE_SECONDS, now=None):
+    """Lease (or renew) one specific request. Raises QueueConflict if it isn't available."""
+    now = now if now is not None else time.time()
+    with begin_immediate(conn):
+        updated = conn.execute(f"""
+            UPDATE pending_medical_data_requests SET claimed_by = ?, lease_expires_at = ?
+            WHERE id = ? AND status = 'pending' AND {_AVAILABLE}
+        """, (admin_id, now + lease_seconds, request_id, now, admin_id)).rowcount
+        if not updated:
+            _raise_conflict(conn, request_id, now)
+
+
+def release(conn, admin_id, request_ids=None):
+    """Give back this admin's leases (all of them if `request_ids` is None). Returns the count."""
+    with begin_immediate(conn):
+        if request_ids is None:
+            return conn.execute("""
+                UPDATE pending_medical_data_requests SET claimed_by = NULL, lease_expires_at = NULL
+                WHERE status = 'pending' AND claimed_by = ?
+            """, (admin_id,)).rowcount
+        cur = conn.executemany("""
+            UPDATE pending_medical_data_requests SET claimed_by = NULL, lease_expires_at = NULL
+            WHERE id = ? AND status = 'pending' AND claimed_by = ?
+        """, [(i, admin_id) for i in request_ids])
+        return cur.rowcount
+
+
+def _release_expired(conn, now):
+    """Clear lapsed leases (inside the caller's transaction). Returns the count."""
+    return conn.execute("""
+        UPDATE pending_medical_data_requests SET claimed_by = NULL, lease_expires_at = NULL
+        WHERE status = 'pending' AND lease_expires_at <= ?
+    """, (now,)).rowcount
+
+
+def validate_entry(title, description, record_type='text'):
+    """Stripped (title, description, record_type) for one completion. Raises ValueError."""
+    title = str(title or '').strip()
+    description = str(description or '').strip()
+    record_type = str(record_type or 'text').strip()
+    if not title or not description:
+        raise ValueError("title and description are required")
+    if record_type not in RECORD_TYPES:
+        raise ValueError(f"record_type must be one of: {', '.join(RECORD_TYPES)}")
+    return title, description, record_type
+
+
+def complete(conn, request_id, admin_id, title, description, record_type='text', now=None):
+    """
+    Add the admin's medical record and mark the request completed, in one
+    transaction. The status change is conditional, so two admins submitting
+    the same request can't both add a record. Returns the new record id.
+    Raises ValueError for a missing title/description or an unknown record_type.
+    """
+    now = now if now is not None else time.time()
+    title, description, record_type = validate_entry(title, description, record_type)
+    with begin_immediate(conn):
+        req = conn.execute(f"""
+            SELECT patient_id FROM pending_medical_data_requests
+            WHERE id = ? AND status = 'pending' AND {_AVAILABLE}
+        """, (request_id, now, admin_id)).fetchone()
+        if req is None:
+            _raise_conflict(conn, request_id, now)
+        conn.execute("""
+            UPDATE pending_medical_data_requests
+            SET status = 'completed', completed_by = ?, completed_at = CURRENT_TIMESTAMP,
+                claimed_by = NULL, lease_expires_at = NULL
+            WHERE id = ?
+        """, (admin_id, request_id))
+        # Admin is not a hospital: hospital_id stays NULL ("Nullable if added by Admin/System")
+        record_id = generate_uuid()
+        conn.execute("""
+            INSERT INTO medical_records (id, patient_id, hospital_id, record_type, title, description)
+            VALUES (?, ?, NULL, ?, ?, ?)
+        """, (record_id, req['patient_id'], record_type, title, description))
+    return record_id
+
+
+def _validate_bulk_rows(rows):
+    """Per-row field checks and in-file duplicate detection. Returns (valid, errors)."""
+    valid, errors, seen = [], [], set()
+    for row_no, row in enumerate(rows, 1):
+        if not isinstance(row, dict) or '_error' in row:
+            errors.append({'row': row_no, 'error': row.get('_error') if isinstance(row, dict) else 'Row must be an object'})
+            continue
+        request_id = str(row.get('request_id') or '').strip()
+        title = str(row.get('title') or '').strip()
+        description = str(row.get('description') or '').strip()
+        record_type = str(row.get('record_type') or 'text').strip()
+        if not request_id or not title or not description:
+            errors.append({'row': row_no, 'request_id': request_id or None,
+                           'error': 'request_id, title and description are required'})
+            continue
+        if record_type not in RECORD_TYPES:
+            errors.append({'row': row_no, 'request_id': request_id,
+                           'error': f"record_type must be one of: {', '.join(RECORD_TYPES)}"})
+            continue
+        if request_id in seen:
+            errors.append({'row': row_no, 'request_id': request_id, 'error': 'Duplicate request_id in upload'})
+            continue
+        seen.add(request_id)
+        valid.append({'row': row_no, 'request_id': request_id, 'title': title,
+                      'description': description, 'record_type': record_type})
+    return valid, errors
+
+
+def _request_states(conn, request_ids, admin_id, now):
+    """request id -> (patient_id, error or None), one set-based query."""
+    states = {}
+    for r in query_in("""
+        SELECT id, patient_id, status, claimed_by, lease_expires_at
+        FROM pending_medical_data_requests WHERE id IN {in}
+    """, request_ids, conn=conn):
+        if r['status'] != 'pending':
+            error = f"Request already {r['status']}"
+        elif r['lease_expires_at'] is not None and r['lease_expires_at'] > now and r['claimed_by'] != admin_id:
+            error = 'Request is claimed by another admin'
+        else:
+            error = None
+        states[r['id']] = (r['patient_id'], error)
+    return states
+
+
+def bulk_complete(conn, admin_id, rows, chunk_size=BULK_CHUNK_SIZE, now=None):
+    """
+    Complete many pending requests from uploaded rows
+    (request_id, title, description, optional record_type).
+    Every request id is checked with one set-based query up front; rows are
+    then written with executemany in chunked transactions. Each chunk
+    re-checks its requests under the write lock, so a request another admin
+    completed or claimed in the meantime is reported instead of completed twice.
+    Returns a per-row report.
+    """
+    start = time.perf_counter()
+    now = now if now is not None else time.time()
+    valid, errors = _validate_bulk_rows(rows)
+
+    states = _request_states(conn, [v['request_id'] for v in valid], admin_id, now)
+    items = []
+    for v in valid:
+        patient_id, error = states.get(v['request_id'], (None, 'Request not found'))
+        if error:
+            errors.append({'row': v['row'], 'request_id': v['request_id'], 'error': error})
+            continue
+        items.append(v)
+
+    completed = 0
+    for c in range(0, len(items), chunk_size):
+        chunk = items[c:c + chunk_size]
+        with begin_immediate(conn):
+            states = _request_states(conn, [i['request_id'] for i in chunk], admin_id, now)
+            ready = []
+            for i in chunk:
+                patient_id, error = states.get(i['request_id'], (None, 'Request not found'))
+                if error:
+                    errors.append({'row': i['row'], 'request_id': i['request_id'], 'error': error})
+                else:
+                    ready.append((i, patient_id))
+            conn.executemany("""
+                UPDATE pending_medical_data_requests
+                SET status = 'completed', completed_by = ?, completed_at = CURRENT_TIMESTAMP,
+                    claimed_by = NULL, lease_expires_at = NULL
+                WHERE id = ?
+            """, [(admin_id, i['request_id']) for i, _ in ready])
+            conn.executemany("""
+                INSERT INTO medical_records (id, patient_id, hospital_id, record_type, title, description)
+                VALUES (?, ?, NULL, ?, ?, ?)
+            """, [(generate_uuid(), pid, i['record_type'], i['title'], i['description']) for i, pid in ready])
+        completed += len(ready)
+
+    elapsed = time.perf_counter() - start
+    errors.sort(key=lambda e: e['row'])
+    return {
+        'total': len(rows),
+        'completed': completed,
+        'failed': len(errors),
+        'errors': errors,
+        'elapsed_seconds': round(elapsed, 3),
+        'rows_per_second': round(completed / elapsed, 1) if elapsed else None,
+    }
+
+
+def _raise_conflict(conn, request_id, now):
+    row = conn.execute("SELECT status, claimed_by, lease_expires_at FROM pending_medical_data_requests WHERE id = ?",
+                       (request_id,)).fetchone()
+    if row is None:
+        raise QueueConflict("Request not found", 404)
+    if row['status'] != 'pending':
+        raise QueueConflict(f"Request already {row['status']}")
+    raise QueueConflict(f"Request is claimed by another admin for {int(row['lease_expires_at'] - now)}s")
+
+
+def get_queue_page(admin_id=None, mine=False, cursor=None, limit=PAGE_SIZE, now=None):
+    """
+    Pending requests oldest first (keyset on created_at, id), with lease state.
+    `mine` limits the page to requests currently leased to `admin_id`.
+    """
+    now = now if now is not None else time.time()
+    sql = """
+        SELECT r.id, r.status, r.created_at, r.patient_id, r.claimed_by, r.lease_expires_at,
+               p.full_name as patient_name, pol.policy_number
+        FROM pending_medical_data_requests r
+        JOIN patients p ON r.patient_id = p.id
+        JOIN policies pol ON r.policy_id = pol.id
+        WHERE r.status = 'pending'
+    """
+    args = []
+    if mine:
+        sql += " AND r.claimed_by = ? AND r.lease_expires_at > ?"
+        args.extend([admin_id, now])
+    if cursor:
+        sql += " AND (r.created_at, r.id) > (?, ?)"
+        args.extend(decode_cursor(cursor))
+    sql += " ORDER BY r.created_at, r.id LIMIT ?"
+    args.append(limit + 1)
+
+    rows = query_db(sql, args)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+
+    page = []
+    for r in rows:
+        item = dict(r)
+        leased = r['lease_expires_at'] is not None and r['lease_expires_at'] > now
+        item['lease'] = ('mine' if r['claimed_by'] == admin_id else 'other') if leased else 'free'
+        item['lease_seconds_left'] = int(r['lease_expires_at'] - now) if leased else None
+        page.append(item)
+    return page, next_cursor
+
+
+def queue_stats(now=None):
+    """Queue depth (free / leased) and completions over the last hour and day."""
+    now = now if now is not None else time.time()
+    depth = query_db("""
+        SELECT COUNT(*) AS pending,
+               COALESCE(SUM(lease_expires_at > ?), 0) AS leased
+        FROM pending_medical_data_requests WHERE status = 'pending'
+    """, (now,), one=True)
+    done = query_db("""
+        SELECT COALESCE(SUM(completed_at >= datetime('now', '-1 hour')), 0) AS last_hour,
+               COUNT(*) AS last_day
+        FROM pending_medical_data_requests WHERE completed_at >= datetime('now', '-1 day')
+    """, one=True)
+    oldest = query_db("""
+        SELECT created_at FROM pending_medical_data_requests
+        WHERE status = 'pending' ORDER BY created_at, id LIMIT 1
+    """, one=True)
+    return {
+        'pending': depth['pending'],
+        'leased': depth['leased'],
+        'available': depth['pending'] - depth['leased'],
+        'oldest_pending_at': oldest['created_at'] if oldest else None,
+        'completed_last_hour': done['last_hour'],
+        'completed_last_day': done['last_day'],
+        'per_hour_last_day': round(done['last_day'] / 24, 2),
+    }
@@ -1,6 +1,12 @@
-from flask import Blueprint, request, jsonify, session, g
-from database import query_db, execute_db
-from utils import hash_password, verify_password, generate_uuid
+from flask import Blueprint, request, jsonify, session, g, Response, stream_with_context, current_app
+from database import query_db, execute_db, transaction, get_db
+import sync_outbox
+from patient_cache import get_patient_cache
+from patient_summary import get_summary
+from search_service import parse_search_args, search_records
+from utils import hash_password, generate_uuid, decode_cursor, parse_limit, read_upload
+from records_service import (parse_fields, iter_records, get_records_page, stream_records_json,
+                             DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
 import datetime
 
 bp = Blueprint('api', __name__, url_prefix='/api')
@@ -25,7 +31,7 @@ def register():
 
     try:
         new_id = generate_uuid()
-        hashed_pw = hash_password(password)
+        hashed_pw = hash_password(password, current_app.config.get('PASSWORD_HASH_METHOD'))
         
         execute_db(
             "INSERT INTO hospitals (id, name, council_id, email, password_hash) VALUES (?, ?, ?, ?, ?)",
@@ -47,24 +53,19 @@ def login():
     if not identifier or not password:
         return jsonify({'error': 'Missing Council ID, License Number, or Password'}), 400
 
-    # Try finding in Hospitals
-    user = query_db("SELECT * FROM hospitals WHERE council_id = ?", (identifier,), one=True)
-    role = 'hospital'
-    
-    if not user:
-        # Try Insurance
-        user = query_db("SELECT * FROM insurance_companies WHERE license_number = ?", (identifier,), one=True)
-        role = 'insurance'
-    
-    if not user:
-        # Try Admin
-        user = query_db("SELECT * FROM admins WHERE username = ?", (identifier,), one=True)
-        role = 'admin'
+    from auth_service import authenticate, LoginBusy
+    try:
+        user = authenticate(current_app, identifier, password)
+    except LoginBusy as e:
+        resp = jsonify({'error': str(e)})
+        resp.headers['Retry-After'] = '1'
+        return resp, 503
 
-    if user and verify_password(user['password_hash'], password):
+    if user:
+        role = user['role']
         session.clear()
-        session['user_id'] = user['id']
-        session['user_name'] = user['name'] if role != 'admin' else user['username']
+        session['user_id'] = user['principal_id']
+        session['user_name'] = user['name']
         session['role'] = role
         
         redirect_url = '/dashboard'
@@ -85,95 +86,236 @@ def scan_patient():
 
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized: Please login first'}), 401
-        
+
+    from scan_service import resolve_scan, resolve_tag, ScanError
+
+    # NFC fast path: raw tag UID + MAC from the reader, no decryption
+    if data.get('tag_id'):
+        try:
+            return jsonify(resolve_tag(data['tag_id'], data.get('mac'))), 200
+        except ScanError as e:
+            return jsonify({'error': str(e)}), e.status_code
+
     if not encrypted_payload:
         return jsonify({'error': 'No data provided'}), 400
-        
-    try:
-        from utils import decrypt_data
-        import json
-        
-        # 1. Try to decrypt (for legacy/NFC encrypted tags)
-        decrypted = decrypt_data(encrypted_payload)
-        
-        # 2. Determine raw data to parse
-        raw_data = decrypted if decrypted else encrypted_payload
-        patient_id = None
-        patient_name = "New Patient"
-        patient_dob = "2000-01-01"
-        
-        # 3. Try parsing as JSON (New system uses raw JSON QR)
-        try:
-            payload = json.loads(raw_data)
-            if isinstance(payload, dict):
-                # Check for various ID keys
-                patient_id = payload.get('patient_id') or payload.get('id') or payload.get('pid')
-                patient_name = payload.get('name') or payload.get('full_name') or "New Patient"
-                patient_dob = payload.get('dob') or "2000-01-01"
-        except:
-            # Not JSON, treat as raw ID
-            patient_id = raw_data
-
-        if not patient_id:
-            return jsonify({'error': 'Invalid payload: No patient ID found'}), 400
-
-        # 4. Verify/Sync patient in local SQLite
-        patient = query_db("SELECT * FROM patients WHERE id = ?", (patient_id,), one=True)
-        
-        if not patient:
-            # Auto-Sync: Add to local database if it came from the trusted system
-            print(f"Auto-syncing patient: {patient_id}")
-            try:
-                execute_db(
-                    "INSERT INTO patients (id, full_name, dob, email) VALUES (?, ?, ?, ?)",
-                    (patient_id, patient_name, patient_dob, f"sync_{patient_id[:8]}@example.com")
-                )
-                patient = query_db("SELECT * FROM patients WHERE id = ?", (patient_id,), one=True)
-            except Exception as e:
-                print(f"Auto-sync error: {e}")
-
-        if patient:
-            return jsonify({
-                'patient_id': patient['id'], 
-                'redirect': f'/patient/{patient["id"]}/view'
-            }), 200
-        else:
-             return jsonify({'error': 'Patient not found and could not be synced'}), 404
 
+    try:
+        return jsonify(resolve_scan(current_app, encrypted_payload)), 200
+    except ScanError as e:
+        return jsonify({'error': str(e)}), e.status_code
     except Exception as e:
         print(f"Scan Error: {e}")
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/patient/scan/batch', methods=['POST'])
+def scan_patients_batch():
+    """Resolve many scanned payloads at once: {"payloads": [...]} -> per-item results in input order."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized: Please login first'}), 401
+
+    from scan_service import resolve_scans, MAX_BATCH
+    payloads = (request.get_json(silent=True) or {}).get('payloads')
+    if not isinstance(payloads, list) or not payloads:
+        return jsonify({'error': 'Expected a non-empty "payloads" list'}), 400
+    if len(payloads) > MAX_BATCH:
+        return jsonify({'error': f'At most {MAX_BATCH} payloads per batch'}), 400
+
+    try:
+        return jsonify({'results': resolve_scans(current_app, payloads)}), 200
+    except Exception as e:
+        print(f"Batch Scan Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/patient/scan/stats', methods=['GET'])
+def scan_cache_stats():
+    """Hit/miss counters for this process's scan-resolution cache."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    from scan_service import get_scan_cache
+    return jsonify(get_scan_cache(current_app).stats()), 200
+
+@bp.route('/nfc/<tag_id>/revoke', methods=['POST'])
+def revoke_nfc_tag(tag_id):
+    if session.get('role') not in ('admin', 'insurance'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    from scan_service import revoke_tag
+    revoked = revoke_tag(current_app, tag_id)
+    if not revoked:
+        return jsonify({'error': 'No active tag with that id'}), 404
+    return jsonify({'message': 'Tag revoked', 'revoked': revoked}), 200
+
+@bp.route('/nfc/<tag_id>/replace', methods=['POST'])
+def replace_nfc_tag(tag_id):
+    """Issue a replacement tag; returns what to write onto it (tag_id, mac, payload)."""
+    if session.get('role') not in ('admin', 'insurance'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    from scan_service import replace_tag
+    provisioning = replace_tag(current_app, tag_id)
+    if provisioning is None:
+        return jsonify({'error': 'No active tag with that id'}), 404
+    return jsonify(provisioning), 201
+
+@bp.route('/nfc/<tag_id>/provision', methods=['GET'])
+def provision_nfc_tag(tag_id):
+    """Data to write onto an issued tag so readers can use the tag_id fast path."""
+    if session.get('role') not in ('admin', 'insurance'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    from scan_service import get_tag_provisioning
+    provisioning = get_tag_provisioning(tag_id)
+    if provisioning is None:
+        return jsonify({'error': 'No active tag with that id'}), 404
+    return jsonify(provisioning), 200
+
+@bp.route('/admin/patients/merge', methods=['POST'])
+def merge_patient_records():
+    """Merge a duplicate patient into the surviving one: {source_id, target_id}."""
+    if session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    data = request.get_json() or {}
+    from scan_service import merge_patients
+    try:
+        merge_patients(current_app, data.get('source_id'), data.get('target_id'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'message': 'Patients merged', 'patient_id': data.get('target_id')}), 200
+
+# --- Admin pending-data queue (claim/lease, see admin_queue.py) ---
+
+@bp.route('/admin/queue', methods=['GET'])
+def admin_queue_page():
+    """Pending requests oldest first: ?mine=1 for your leases, ?limit=&cursor= to page."""
+    if session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    import admin_queue
+    try:
+        cursor = request.args.get('cursor') or None
+        if cursor:
+            decode_cursor(cursor)
+        limit = parse_limit(request.args.get('limit'), admin_queue.PAGE_SIZE, admin_queue.MAX_PAGE_SIZE)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    requests_page, next_cursor = admin_queue.get_queue_page(
+        session['user_id'], mine=request.args.get('mine') in ('1', 'true'), cursor=cursor, limit=limit)
+    return jsonify({'requests': requests_page, 'next_cursor': next_cursor, 'limit': limit}), 200
+
+@bp.route('/admin/queue/claim', methods=['POST'])
+def admin_queue_claim():
+    """Lease the next {count} free requests (default 1) to the calling admin."""
+    if session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    import admin_queue
+    data = request.get_json(silent=True) or {}
+    try:
+        count = int(data.get('count', 1))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'count must be an integer'}), 400
+    lease = current_app.config['ADMIN_LEASE_SECONDS']
+    ids = admin_queue.claim_next(get_db(), session['user_id'], count, lease)
+    return jsonify({'claimed': ids, 'lease_seconds': lease}), 200
+
+@bp.route('/admin/queue/release', methods=['POST'])
+def admin_queue_release():
+    """Give back leases: {request_ids: [...]} or all of the caller's leases."""
+    if session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    import admin_queue
+    data = request.get_json(silent=True) or {}
+    released = admin_queue.release(get_db(), session['user_id'], data.get('request_ids'))
+    return jsonify({'released': released}), 200
+
+@bp.route('/admin/queue/<request_id>/complete', methods=['POST'])
+def admin_queue_complete(request_id):
+    """Add the medical record for a request and close it: {title, description, record_type?}."""
+    if session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    import admin_queue
+    data = request.get_json(silent=True) or {}
+    try:
+        record_id = admin_queue.complete(get_db(), request_id, session['user_id'],
+                                         data.get('title'), data.get('description'), data.get('record_type'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except admin_queue.QueueConflict as e:
+        return jsonify({'error': str(e)}), e.status_code
+    return jsonify({'message': 'Request completed', 'record_id': record_id}), 200
+
+@bp.route('/admin/queue/complete', methods=['POST'])
+def admin_queue_bulk_complete():
+    """
+    Complete many requests at once: CSV/JSONL upload, JSON array or
+    {"requests": [...]} of {request_id, title, description, record_type?}.
+    Returns a per-row report.
+    """
+    if session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    import admin_queue
+    try:
+        rows = read_upload(request, 'requests')
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        report = admin_queue.bulk_complete(get_db(), session['user_id'], rows,
+                                           chunk_size=current_app.config['ADMIN_BULK_CHUNK_SIZE'])
+        return jsonify(report), 200
+    except Exception as e:
+        print(f"Bulk Completion Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/admin/queue/stats', methods=['GET'])
+def admin_queue_stats():
+    if session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    import admin_queue
+    return jsonify(admin_queue.queue_stats()), 200
+
 @bp.route('/patient/<patient_id>/records', methods=['GET'])
 def get_records(patient_id):
+    """
+    Records newest first.
+      ?fields=id,summary,...   only return these fields (skip data_payload when listing)
+      ?limit=N&cursor=...      keyset page: {'records': [...], 'next_cursor': ...}
+      ?stream=1                stream the JSON array as rows are read
+    Without limit/cursor/stream the full history is returned as a plain array.
+    """
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
-    
+
     try:
-        records = query_db("""
-            SELECT m.*, h.name as hospital_name 
-            FROM medical_records m 
-            LEFT JOIN hospitals h ON m.hospital_id = h.id 
-            WHERE m.patient_id = ? 
-            ORDER BY m.created_at DESC
-        """, (patient_id,))
-        
-        # Convert to list of dicts for JSON serialization
-        results = []
-        for r in records:
-            results.append({
-                'id': r['id'],
-                'record_type': r['record_type'],
-                'data_payload': r['description'],
-                'summary': r['title'],
-                'created_at': r['created_at'],
-                'hospital_name': r['hospital_name'] or 'Unknown/Admin'
-            })
-            
+        fields = parse_fields(request.args.get('fields'))
+        cursor = request.args.get('cursor') or None
+        if cursor:
+            decode_cursor(cursor)
+        paginate = cursor is not None or 'limit' in request.args
+        limit = parse_limit(request.args.get('limit'), DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE) if paginate else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        if request.args.get('stream') in ('1', 'true'):
+            return Response(stream_with_context(stream_records_json(patient_id, fields, cursor, limit)),
+                            mimetype='application/json')
+
+        cache = get_patient_cache(current_app)
+        if paginate:
+            records, next_cursor = cache.get_or_load(
+                'records', patient_id, [fields, cursor, limit],
+                lambda: get_records_page(patient_id, fields, cursor, limit))
+            return jsonify({'records': records, 'next_cursor': next_cursor, 'limit': limit}), 200
+
+        results = cache.get_or_load('records', patient_id, [fields, None, None],
+                                    lambda: [rec for rec, _, _ in iter_records(patient_id, fields)])
         return jsonify(results), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/patient/<patient_id>/summary', methods=['GET'])
+def patient_summary(patient_id):
+    """Record count, latest record, active policies and pending data requests (one row read)."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify(get_summary(patient_id)), 200
+
 @bp.route('/patient/<patient_id>/add', methods=['POST'])
 def add_record(patient_id):
     if 'user_id' not in session:
@@ -193,50 +335,107 @@ def add_record(patient_id):
         new_id = generate_uuid()
         
         # 1. Save to Local SQLite (for offline/performance)
-        execute_db("""
-            INSERT INTO medical_records (id, patient_id, hospital_id, record_type, title, description)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (new_id, patient_id, hospital_id, record_type, summary, payload))
-
-        # 2. Sync to Supabase (Global Visibility)
-        import os
-        import requests
-        
-        supabase_url = os.environ.get('SUPABASE_URL')
-        supabase_service_key = os.environ.get('SUPABASE_SERVICE_ROLE_KEY')
-        
-        if supabase_url and supabase_service_key:
-            try:
-                # We use the Service Role key to bypass RLS and ensure the write succeeds
-                sync_url = f"{supabase_url}/rest/v1/medical_records"
-                headers = {
-                    "apikey": supabase_service_key,
-                    "Authorization": f"Bearer {supabase_service_key}",
-                    "Content-Type": "application/json",
-                    "Prefer": "return=minimal"
-                }
-                
-                # Check if hospital_id exists in Supabase. 
-                # If not (e.g. legacy local ID), we might need to use a fallback or skip.
-                # But our current ID ccfb... should be valid if it was synced.
-                
-                payload_supabase = {
+        # 2. Queue the Supabase sync (Global Visibility) in the same transaction;
+        #    the background worker pushes it, so Supabase latency/outages never block this request.
+        with transaction() as db:
+            db.execute("""
+                INSERT INTO medical_records (id, patient_id, hospital_id, record_type, title, description)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (new_id, patient_id, hospital_id, record_type, summary, payload))
+
+            if sync_outbox.sync_enabled(current_app):
+                sync_outbox.enqueue(db, 'medical_records', {
                     "id": new_id,
                     "patient_id": patient_id,
                     "hospital_id": hospital_id,
                     "record_type": record_type,
                     "title": summary,
                     "description": payload
-                }
-                
-                resp = requests.post(sync_url, headers=headers, json=payload_supabase)
-                if not resp.ok:
-                    print(f"Supabase Sync Warning: {resp.text}")
-            except Exception as se:
-                print(f"Supabase Sync Error: {se}")
+                })
+        sync_outbox.notify()
 
         return jsonify({'message': 'Record saved and synced.', 'redirect': '/'}), 201
     except Exception as e:
         print(f"Add Record Error: {e}")
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/records/search', methods=['GET'])
+def search():
+    """
+    Full-text search over record titles and descriptions, best match first.
+      ?q=penicillin allergy   all words must match; "quoted phrase", prefix*
+      ?patient_id=&record_type=&from=YYYY-MM-DD&to=YYYY-MM-DD
+      ?limit=N&cursor=...     keyset page: {'results': [...], 'next_cursor': ...}
+    Insurers only see records of their own policyholders.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    try:
+        params = parse_search_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if session.get('role') == 'insurance':
+        params['provider_id'] = session['user_id']
+
+    try:
+        results, next_cursor = search_records(**params)
+        return jsonify({'results': results, 'next_cursor': next_cursor, 'limit': params['limit']}), 200
+    except Exception as e:
+        print(f"Search Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+# --- Insurance ---
+
+@bp.route('/insurance/policies', methods=['GET'])
+def list_policies():
+    """Keyset-paginated policies for the logged-in provider (same filters as /insurance/policies)."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    from insurance_service import get_policies_page, parse_policy_filters
+    try:
+        filters = parse_policy_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        policies, next_cursor = get_policies_page(session['user_id'], **filters)
+        return jsonify({'policies': policies, 'next_cursor': next_cursor, 'limit': filters['limit']}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/insurance/policies/import', methods=['POST'])
+def import_policies():
+    """Bulk policy import (CSV/JSONL upload or JSON array). Returns a per-row report."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    from insurance_service import import_policies as run_import, read_policy_upload
+    try:
+        rows = read_policy_upload(request)
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        report = run_import(session['user_id'], rows,
+                            chunk_size=current_app.config.get('POLICY_IMPORT_CHUNK_SIZE', 1000))
+        return jsonify(report), 200
+    except Exception as e:
+        print(f"Policy Import Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/qr/<qr_id>/status', methods=['GET'])
+def qr_status(qr_id):
+    """Render status of a QR image, for the UI to poll after creating a policy."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    import qr_service
+    from database import get_read_db
+    row = qr_service.ensure_rendered(current_app, get_read_db(), qr_id)
+    if row is None:
+        return jsonify({'error': 'QR not found'}), 404
+    image_url = qr_service.image_src(row['image_path']) if row['status'] == 'ready' else None
+    return jsonify({'id': row['id'], 'status': row['status'], 'image_url': image_url}), 200
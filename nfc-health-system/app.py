@@ -1,20 +1,113 @@
-from flask import Flask, render_template, g, request, redirect, url_for, session
+from flask import Flask, render_template, g, request, redirect, url_for, session, Response
 from dotenv import load_dotenv
 import api
 import os
-from database import query_db, close_connection
+import sync_outbox
+import qr_service
+import scan_service
+import auth_service
+import patient_cache
+import admin_queue
+import metrics
+import slow_query_log
+import asgi
+from patient_summary import get_summary
+from database import query_db, get_db, close_connection, DATABASE, DB_DEFAULTS
+from utils import decode_cursor, read_upload
+from records_service import RECORD_TYPES
 
 load_dotenv()
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'default-dev-key')
 
+# SQLite connection pool & pragmas (defaults live in database.DB_DEFAULTS)
+app.config['DATABASE'] = os.environ.get('DATABASE', DATABASE)
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', DB_DEFAULTS['DB_POOL_SIZE']))
+app.config['DB_READ_POOL_SIZE'] = int(os.environ.get('DB_READ_POOL_SIZE', DB_DEFAULTS['DB_READ_POOL_SIZE']))
+app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', DB_DEFAULTS['DB_POOL_TIMEOUT']))
+app.config['DB_JOURNAL_MODE'] = os.environ.get('DB_JOURNAL_MODE', DB_DEFAULTS['DB_JOURNAL_MODE'])
+app.config['DB_SYNCHRONOUS'] = os.environ.get('DB_SYNCHRONOUS', DB_DEFAULTS['DB_SYNCHRONOUS'])
+app.config['DB_CACHE_SIZE'] = int(os.environ.get('DB_CACHE_SIZE', DB_DEFAULTS['DB_CACHE_SIZE']))
+app.config['DB_MMAP_SIZE'] = int(os.environ.get('DB_MMAP_SIZE', DB_DEFAULTS['DB_MMAP_SIZE']))
+app.config['DB_BUSY_TIMEOUT'] = int(os.environ.get('DB_BUSY_TIMEOUT', DB_DEFAULTS['DB_BUSY_TIMEOUT']))
+app.config['DB_FOREIGN_KEYS'] = DB_DEFAULTS['DB_FOREIGN_KEYS']
+app.config['DB_AUTO_MIGRATE'] = os.environ.get('DB_AUTO_MIGRATE', '1') == '1'
+
+# Supabase sync (outbox drained by a background worker, see sync_outbox.py)
+app.config['SUPABASE_URL'] = os.environ.get('SUPABASE_URL')
+app.config['SUPABASE_SERVICE_ROLE_KEY'] = os.environ.get('SUPABASE_SERVICE_ROLE_KEY')
+app.config['SYNC_WORKER_ENABLED'] = os.environ.get('SYNC_WORKER_ENABLED', '1') == '1'
+app.config['SYNC_BATCH_SIZE'] = int(os.environ.get('SYNC_BATCH_SIZE', sync_outbox.BATCH_SIZE))
+app.config['SYNC_INTERVAL'] = float(os.environ.get('SYNC_INTERVAL', sync_outbox.POLL_INTERVAL))
+
+# Bulk policy import: rows per write transaction
+app.config['POLICY_IMPORT_CHUNK_SIZE'] = int(os.environ.get('POLICY_IMPORT_CHUNK_SIZE', 1000))
+
+# QR images are rendered after commit by a process pool (0 = inline, see qr_service.py)
+app.config['QR_RENDER_WORKERS'] = int(os.environ.get('QR_RENDER_WORKERS', qr_service.RENDER_WORKERS))
+# /qr/<qr_id> image cache: bounded in memory and on disk
+app.config['QR_CACHE_DIR'] = os.environ.get('QR_CACHE_DIR', qr_service.CACHE_DIR)
+app.config['QR_CACHE_MEMORY_BYTES'] = int(os.environ.get('QR_CACHE_MEMORY_BYTES', qr_service.CACHE_MEMORY_BYTES))
+app.config['QR_CACHE_DISK_FILES'] = int(os.environ.get('QR_CACHE_DISK_FILES', qr_service.CACHE_DISK_FILES))
+app.config['QR_CACHE_MAX_AGE'] = int(os.environ.get('QR_CACHE_MAX_AGE', 86400))
+
+# /api/patient/scan resolution cache (per process, LRU + TTL)
+app.config['SCAN_CACHE_SIZE'] = int(os.environ.get('SCAN_CACHE_SIZE', scan_service.CACHE_SIZE))
+app.config['SCAN_CACHE_TTL'] = float(os.environ.get('SCAN_CACHE_TTL', scan_service.CACHE_TTL))
+
+# Password hashing: werkzeug method spec (e.g. 'scrypt:32768:8:1', 'pbkdf2:sha256:600000').
+# Changing it upgrades each user's hash on their next login.
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD') or None
+app.config['LOGIN_CONCURRENCY'] = int(os.environ.get('LOGIN_CONCURRENCY', auth_service.LOGIN_CONCURRENCY))
+app.config['LOGIN_QUEUE_TIMEOUT'] = float(os.environ.get('LOGIN_QUEUE_TIMEOUT', auth_service.LOGIN_QUEUE_TIMEOUT))
+
+# Patient view / record listing cache, keyed by patient data version
+app.config['PATIENT_CACHE_BACKEND'] = os.environ.get('PATIENT_CACHE_BACKEND', patient_cache.CACHE_BACKEND)
+app.config['PATIENT_CACHE_SIZE'] = int(os.environ.get('PATIENT_CACHE_SIZE', patient_cache.CACHE_SIZE))
+app.config['PATIENT_CACHE_MEMORY_BYTES'] = int(os.environ.get('PATIENT_CACHE_MEMORY_BYTES', patient_cache.CACHE_MEMORY_BYTES))
+app.config['PATIENT_CACHE_PATH'] = os.environ.get('PATIENT_CACHE_PATH', patient_cache.CACHE_PATH)
+
+# Admin pending-data queue: seconds a claimed request stays leased to one admin
+app.config['ADMIN_LEASE_SECONDS'] = int(os.environ.get('ADMIN_LEASE_SECONDS', admin_queue.LEASE_SECONDS))
+app.config['ADMIN_CLAIM_BATCH'] = int(os.environ.get('ADMIN_CLAIM_BATCH', 10))
+# Bulk completion uploads: requests completed per write transaction
+app.config['ADMIN_BULK_CHUNK_SIZE'] = int(os.environ.get('ADMIN_BULK_CHUNK_SIZE', admin_queue.BULK_CHUNK_SIZE))
+
+# Per-route and per-statement latency histograms, served at /metrics (Prometheus text format)
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'
+
+# Slow-query log: statements at or over SLOW_QUERY_MS (negative disables) are written as
+# JSON lines with their query plan to SLOW_QUERY_LOG (default stderr), once per
+# statement per SLOW_QUERY_LOG_INTERVAL seconds
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', slow_query_log.THRESHOLD_MS))
+app.config['SLOW_QUERY_LOG'] = os.environ.get('SLOW_QUERY_LOG') or None
+app.config['SLOW_QUERY_LOG_INTERVAL'] = float(os.environ.get('SLOW_QUERY_LOG_INTERVAL', slow_query_log.LOG_INTERVAL))
+
+# Asyncio serving mode for /api (`uvicorn asgi:application`): views running at
+# once per process (default: the write pool size, so admitted requests never
+# wait on a connection), and how long a queued request waits for a slot before a 503
+app.config['API_CONCURRENCY'] = int(os.environ.get('API_CONCURRENCY', app.config['DB_POOL_SIZE']))
+app.config['API_QUEUE_TIMEOUT'] = float(os.environ.get('API_QUEUE_TIMEOUT', asgi.API_QUEUE_TIMEOUT))
+# Largest request body accepted (413 beyond it), in either serving mode
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', asgi.API_MAX_BODY))
+
 # Register Database Teardown
 app.teardown_appcontext(close_connection)
 
 # Register API Blueprint
 app.register_blueprint(api.bp)
 
+app.add_template_filter(qr_service.image_src, 'qr_src')
+
+metrics.init_app(app)
+slow_query_log.init_app(app)
+
+@app.before_request
+def start_sync_worker():
+    # Started lazily so every (possibly forked) worker process gets its own thread
+    sync_outbox.ensure_worker(app)
+
 # UI Routes
 @app.route('/')
 def index():
@@ -44,6 +137,12 @@ def patient_access():
         return redirect(url_for('index'))
     return render_template('patient_access.html')
 
+def load_patient(patient_id):
+    patient_row = query_db("SELECT * FROM patients WHERE id = ?", (patient_id,), one=True)
+    if patient_row:
+        return dict(patient_row) # Convert Row to dict
+    return {'id': patient_id, 'full_name': 'Unknown (Recommended: Register Patient)'}
+
 @app.route('/patient/<uuid:patient_id>/view')
 def patient_view(patient_id):
     """View patient records."""
@@ -52,19 +151,17 @@ def patient_view(patient_id):
     
     try:
         patient_id_str = str(patient_id)
-        # Fetch Patient Details from SQLite
-        patient_row = query_db("SELECT * FROM patients WHERE id = ?", (patient_id_str,), one=True)
-        
-        if patient_row:
-            patient = dict(patient_row) # Convert Row to dict
-        else:
-            patient = {'id': patient_id_str, 'full_name': 'Unknown (Recommended: Register Patient)'}
+        # Fetch Patient Details from SQLite (cached until the patient's data version changes)
+        patient = patient_cache.get_patient_cache(app).get_or_load(
+            'patient', patient_id_str, None, lambda: load_patient(patient_id_str))
             
     except Exception as e:
         print(f"Error fetching patient: {e}")
         patient = {'id': str(patient_id), 'full_name': 'Error loading'}
 
-    return render_template('patient_view.html', patient=patient)
+    # Not cached with the patient: policy changes don't bump the data version
+    summary = get_summary(str(patient_id))
+    return render_template('patient_view.html', patient=patient, summary=summary)
 
 @app.route('/patient/<uuid:patient_id>/add')
 def add_medical_data(patient_id):
@@ -90,14 +187,19 @@ def insurance_policies():
     
     provider_id = session.get('user_id')
     
+    from insurance_service import get_policies_page, parse_policy_filters
     try:
-        from insurance_service import get_all_policies
-        policies = get_all_policies(provider_id)
+        filters = parse_policy_filters(request.args)
+    except ValueError as e:
+        return f"Input Error: {e}", 400
+
+    try:
+        policies, next_cursor = get_policies_page(provider_id, **filters)
     except Exception as e:
         print(f"Error fetching policies: {e}")
-        policies = []
+        policies, next_cursor = [], None
         
-    return render_template('policies.html', policies=policies)
+    return render_template('policies.html', policies=policies, next_cursor=next_cursor, filters=filters)
 
 @app.route('/insurance/policies/create', methods=['POST'])
 def create_policy_route():
@@ -128,6 +230,54 @@ def create_policy_route():
              return "Error: This Policy Number already exists.", 400
         return f"Error creating policy: {e}", 500
 
+@app.route('/insurance/policies/import', methods=['POST'])
+def import_policies_route():
+    if 'user_id' not in session:
+        return redirect(url_for('index'))
+
+    from insurance_service import import_policies, read_policy_upload
+    try:
+        rows = read_policy_upload(request)
+    except (ValueError, UnicodeDecodeError) as e:
+        return f"Input Error: {e}", 400
+
+    try:
+        report = import_policies(session.get('user_id'), rows,
+                                 chunk_size=app.config['POLICY_IMPORT_CHUNK_SIZE'])
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return f"Error importing policies: {e}", 500
+    return render_template('policy_import_report.html', report=report)
+
+@app.route('/qr/<qr_id>')
+def qr_image(qr_id):
+    """QR image rendered on demand from qr_records (?format=png|svg&size=&border=)."""
+    if 'user_id' not in session:
+        return "Unauthorized", 401
+
+    try:
+        fmt, box_size, border = qr_service.parse_image_params(request.args)
+    except ValueError as e:
+        return f"Input Error: {e}", 400
+
+    row = query_db("SELECT encrypted_payload FROM qr_records WHERE id = ?", (qr_id,), one=True)
+    if row is None:
+        return "QR not found", 404
+
+    # The ETag is the content hash, so a revalidation never needs a render
+    etag = qr_service.cache_key(row['encrypted_payload'], fmt, box_size, border)
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        data, _ = qr_service.get_cache(app).get_or_render(row['encrypted_payload'], fmt, box_size, border)
+        resp = Response(data, mimetype=qr_service.FORMATS[fmt])
+    resp.set_etag(etag)
+    # A patient's access code: browsers may keep it, shared caches may not
+    resp.cache_control.private = True
+    resp.cache_control.max_age = app.config['QR_CACHE_MAX_AGE']
+    return resp
+
 @app.route('/scan')
 def scan_qr():
     if 'user_id' not in session:
@@ -141,57 +291,77 @@ if __name__ == '__main__':
 def admin_dashboard():
     if 'user_id' not in session or session.get('role') != 'admin':
         return redirect(url_for('index'))
-    
-    # Fetch pending requests
-    requests = query_db("""
-        SELECT r.id, r.status, r.created_at, p.full_name as patient_name, pol.policy_number
-        FROM pending_medical_data_requests r
-        JOIN patients p ON r.patient_id = p.id
-        JOIN policies pol ON r.policy_id = pol.id
-        WHERE r.status = 'pending'
-        ORDER BY r.created_at DESC
-    """)
-    return render_template('admin_dashboard.html', requests=requests)
+
+    # One keyset page of the queue (?mine=1: only requests leased to you)
+    mine = request.args.get('mine') == '1'
+    cursor = request.args.get('cursor') or None
+    try:
+        if cursor:
+            decode_cursor(cursor)
+    except ValueError as e:
+        return f"Input Error: {e}", 400
+    requests, next_cursor = admin_queue.get_queue_page(session['user_id'], mine=mine, cursor=cursor)
+    return render_template('admin_dashboard.html', requests=requests, next_cursor=next_cursor, mine=mine,
+                           stats=admin_queue.queue_stats(), claim_batch=app.config['ADMIN_CLAIM_BATCH'])
+
+@app.route('/admin/queue/claim', methods=['POST'])
+def admin_claim():
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return redirect(url_for('index'))
+    try:
+        count = int(request.form.get('count') or app.config['ADMIN_CLAIM_BATCH'])
+    except ValueError:
+        return "Input Error: count must be an integer", 400
+    admin_queue.claim_next(get_db(), session['user_id'], count, app.config['ADMIN_LEASE_SECONDS'])
+    return redirect(url_for('admin_dashboard', mine=1))
+
+@app.route('/admin/queue/release', methods=['POST'])
+def admin_release():
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return redirect(url_for('index'))
+    admin_queue.release(get_db(), session['user_id'])
+    return redirect(url_for('admin_dashboard'))
+
+@app.route('/admin/queue/complete', methods=['POST'])
+def admin_bulk_complete():
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return redirect(url_for('index'))
+    try:
+        rows = read_upload(request, 'requests')
+    except (ValueError, UnicodeDecodeError) as e:
+        return f"Input Error: {e}", 400
+
+    try:
+        report = admin_queue.bulk_complete(get_db(), session['user_id'], rows,
+                                           chunk_size=app.config['ADMIN_BULK_CHUNK_SIZE'])
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return f"Error completing requests: {e}", 500
+    return render_template('admin_bulk_report.html', report=report)
 
 @app.route('/admin/medical-entry/<request_id>', methods=['GET', 'POST'])
 def admin_medical_entry(request_id):
     if 'user_id' not in session or session.get('role') != 'admin':
         return redirect(url_for('index'))
 
-    req = query_db("SELECT * FROM pending_medical_data_requests WHERE id = ?", (request_id,), one=True)
-    if not req:
-        return "Request not found", 404
-
-    if request.method == 'POST':
-        title = request.form.get('title')
-        description = request.form.get('description')
-        
-        try:
-             # Create separate connection for transaction
-            conn = get_db()
-            cursor = conn.cursor()
-            
-            # 1. Create Medical Record
-            import uuid
-            new_id = str(uuid.uuid4())
-            # Admin is the "hospital" or source here? Or leave hospital_id NULL?
-            # Schema says hospital_id references hospitals table. Admin is not a hospital.
-            # So leave it NULL or add an "Admin" hospital entry?
-            # Schema comment: "-- Nullable if added by Admin/System" -> So NULL is fine.
-            
-            cursor.execute("""
-                INSERT INTO medical_records (id, patient_id, hospital_id, record_type, title, description)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (new_id, req['patient_id'], None, 'text', title, description))
-            
-            # 2. Update Request Status
-            cursor.execute("UPDATE pending_medical_data_requests SET status = 'completed' WHERE id = ?", (request_id,))
-            
-            conn.commit()
-            return redirect(url_for('admin_dashboard'))
-            
-        except Exception as e:
-            conn.rollback()
-            return f"Error: {e}", 500
+    admin_id = session['user_id']
+    error = None
+    try:
+        if request.method == 'POST':
+            # Conditional on still holding (or being free to take) the request
+            admin_queue.complete(get_db(), request_id, admin_id, request.form.get('title'),
+                                 request.form.get('description'), request.form.get('record_type'))
+            return redirect(url_for('admin_dashboard', mine=1))
+        # Opening a request leases it, so a second admin can't work on it too
+        admin_queue.claim(get_db(), request_id, admin_id, app.config['ADMIN_LEASE_SECONDS'])
+    except admin_queue.QueueConflict as e:
+        return str(e), e.status_code
+    except ValueError as e:
+        error = str(e)   # Still leased to this admin: show the form again with what they typed
+    except Exception as e:
+        return f"Error: {e}", 500
 
-    return render_template('admin_medical_entry.html', req=req)
+    req = query_db("SELECT * FROM pending_medical_data_requests WHERE id = ?", (request_id,), one=True)
+    return render_template('admin_medical_entry.html', req=req, error=error, form=request.form,
+                           record_types=RECORD_TYPES), 400 if error else 200
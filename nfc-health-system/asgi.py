@@ -0,0 +1,215 @@
+import json
+import asyncio
+import logging
+import threading
+
+from a2wsgi import WSGIMiddleware
+
+from database import DB_DEFAULTS
+
+# Asyncio serving mode for the JSON API: the same Flask app behind an ASGI
+# event loop, for the /api routes only (pages stay on the WSGI server).
+#
+#   uvicorn asgi:application            (or hypercorn, daphne, ...)
+#
+# This is not an async API: views, and so responses, are the sync ones, each
+# run on a worker thread. What it buys is that a request waiting for a slot
+# costs a coroutine on one event loop instead of a thread. Only `concurrency`
+# requests run a view at a time, each with its pooled SQLite connection, so a
+# burst of hundreds of scans queues in the loop (and gets a 503 past the queue
+# timeout) rather than exhausting threads and the connection pool.
+# Running the WSGI app (worker threads, environ, streaming the response back)
+# is a2wsgi's; this adds the admission limit, a request body limit, skipping
+# the view for a client that hung up before sending its body, and a properly
+# ended response when a view fails.
+
+# Views running at once per process. No more than the write pool: an admitted
+# write must get a connection, not queue on the pool and fail after
+# DB_POOL_TIMEOUT where waiting for a slot would have given a clean 503.
+API_CONCURRENCY = DB_DEFAULTS['DB_POOL_SIZE']
+API_PREFIX = '/api'                # Paths served in this mode
+API_QUEUE_TIMEOUT = 10.0           # Seconds a request waits for a slot before 503
+API_MAX_BODY = 16 * 1024 * 1024    # Bytes; the app's MAX_CONTENT_LENGTH
+STREAM_BUFFER = 8                  # Response chunks buffered ahead of a slow client
+
+
+class AsyncAPI:
+    """ASGI callable running a WSGI app with bounded concurrency."""
+
+    def __init__(self, wsgi_app, concurrency=API_CONCURRENCY, queue_timeout=API_QUEUE_TIMEOUT, max_body=API_MAX_BODY,
+                 prefix=API_PREFIX):
+        self.wsgi_app = wsgi_app
+        self.prefix = prefix
+        self.concurrency = concurrency
+        self.queue_timeout = queue_timeout
+        self.max_body = max_body
+        self.logger = getattr(wsgi_app, 'logger', None) or logging.getLogger(__name__)
+        self._wsgi = WSGIMiddleware(self._call_app, workers=concurrency, send_queue_size=STREAM_BUFFER)
+        self._slots = None   # asyncio.Semaphore, created on the serving loop
+        self._lock = threading.Lock()
+        self.active = self.waiting = self.admitted = self.rejected = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError(f"Unsupported ASGI scope type {scope['type']!r}")
+        path = scope.get('path', '')
+        if path != self.prefix and not path.startswith(self.prefix + '/'):
+            return await _send_error(send, 404, f'Only {self.prefix} routes are served here')
+
+        length = _content_length(scope)
+        if length is not None and length > self.max_body:
+            return await _send_error(send, 413, 'Request body too large')
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        self._count('waiting', 1)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._count('rejected', 1)
+            return await _send_error(send, 503, 'Server busy, please retry', [(b'retry-after', b'1')])
+        finally:
+            self._count('waiting', -1)
+        self._count('admitted', 1)
+        self._count('active', 1)
+        try:
+            # Read under the slot, so slow uploads can't pile up bodies in memory
+            try:
+                body = await _read_body(receive, self.max_body)
+            except ValueError:
+                return await _send_error(send, 413, 'Request body too large')
+            if body is None:
+                return   # Client went away before sending its body; no view to run
+            await self._run(scope, body, send)
+        finally:
+            self._count('active', -1)
+            self._slots.release()
+
+    async def _run(self, scope, body, send):
+        cancelled = threading.Event()
+        response = {'started': False, 'ended': False, 'error': None}
+        # The body is complete, so it goes to the app with its real length
+        headers = [(k, v) for k, v in scope.get('headers', []) if k not in (b'content-length', b'transfer-encoding')]
+        scope = {'http_version': '1.1', 'query_string': b'', 'root_path': '', **scope,   # Optional in ASGI
+                 'headers': headers + [(b'content-length', str(len(body)).encode())], 'asyncapi.cancelled': cancelled}
+        pending = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+        async def replay():
+            return pending.pop() if pending else {'type': 'http.disconnect'}
+
+        async def forward(message):
+            if response['error'] is not None:
+                return   # Client gone: drop what the worker still produces until it notices
+            try:
+                await send(message)
+            except Exception as e:
+                # Raising here would stop a2wsgi's sender with the worker blocked on its queue
+                response['error'] = e
+                cancelled.set()
+                return
+            if message['type'] == 'http.response.start':
+                response['started'] = True
+            elif not message.get('more_body'):
+                response['ended'] = True
+
+        try:
+            await self._wsgi(scope, replay, forward)
+        except Exception:
+            self.logger.exception("ASGI view error: %s %s", scope.get('method'), scope.get('path'))
+            if response['error'] is None and not response['ended']:
+                if response['started']:
+                    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+                else:
+                    await _send_error(send, 500, 'Internal Server Error')
+        if response['error'] is not None:
+            raise response['error']
+
+    def _call_app(self, environ, start_response):
+        # On a worker thread: stop iterating the response once the client is gone
+        body = self.wsgi_app(environ, start_response)
+        return _until(body, environ['asgi.scope']['asyncapi.cancelled'])
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self._wsgi.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _count(self, name, delta):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + delta)
+
+    def stats(self):
+        with self._lock:
+            return {'concurrency': self.concurrency, 'active': self.active, 'waiting': self.waiting,
+                    'admitted': self.admitted, 'rejected': self.rejected}
+
+
+def _until(body, cancelled):
+    try:
+        for chunk in body:
+            if cancelled.is_set():
+                break
+            yield chunk
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+
+
+def _content_length(scope):
+    for name, value in scope.get('headers', []):
+        if name == b'content-length':
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+async def _read_body(receive, limit):
+    """Whole request body; None if the client disconnected first. ValueError past `limit` bytes."""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            raise ValueError(f"Request body over {limit} bytes")
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def _send_error(send, status, message, headers=()):
+    body = json.dumps({'error': message}).encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+                            *headers]})
+    await send({'type': 'http.response.body', 'body': body, 'more_body': False})
+
+
+def create_app(flask_app):
+    """AsyncAPI for `flask_app`, sized from its API_CONCURRENCY (default: DB_POOL_SIZE) / API_QUEUE_TIMEOUT / MAX_CONTENT_LENGTH."""
+    return AsyncAPI(flask_app,
+                    flask_app.config.get('API_CONCURRENCY') or flask_app.config.get('DB_POOL_SIZE', API_CONCURRENCY),
+                    flask_app.config.get('API_QUEUE_TIMEOUT', API_QUEUE_TIMEOUT),
+                    flask_app.config.get('MAX_CONTENT_LENGTH') or API_MAX_BODY)
+
+
+def __getattr__(name):
+    # `uvicorn asgi:application` builds it on first access, so importing this
+    # module on its own doesn't import (and configure) the app
+    if name == 'application':
+        from app import app
+        globals()['application'] = create_app(app)
+        return globals()['application']
+    raise AttributeError(name)
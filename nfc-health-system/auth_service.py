@@ -0,0 +1,96 @@
+import os
+import threading
+from contextlib import contextmanager
+from database import query_db, execute_db
+from utils import hash_password, verify_password, needs_rehash
+
+LOGIN_CONCURRENCY = max(1, (os.cpu_count() or 2) // 2)   # Password hashes computed at once per process
+LOGIN_QUEUE_TIMEOUT = 2.0                                 # Seconds a login waits for a slot before 503
+
+# principals.role -> table holding the credentials
+ROLE_TABLES = {'hospital': 'hospitals', 'insurance': 'insurance_companies', 'admin': 'admins'}
+
+
+class LoginBusy(Exception):
+    pass
+
+
+class LoginLimiter:
+    """
+    Caps concurrent password hashing so a burst of logins (shift change)
+    can't take every CPU away from clinical endpoints. Excess logins wait
+    up to `timeout` seconds, then are turned away.
+    """
+
+    def __init__(self, concurrency=LOGIN_CONCURRENCY, timeout=LOGIN_QUEUE_TIMEOUT):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self.active = self.admitted = self.rejected = 0
+
+    @contextmanager
+    def slot(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.rejected += 1
+            raise LoginBusy("Too many logins in progress, please retry")
+        with self._lock:
+            self.active += 1
+            self.admitted += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {'concurrency': self.concurrency, 'active': self.active,
+                    'admitted': self.admitted, 'rejected': self.rejected}
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_login_limiter(app):
+    """This process's limiter, sized from LOGIN_CONCURRENCY / LOGIN_QUEUE_TIMEOUT."""
+    global _limiter
+    concurrency = app.config.get('LOGIN_CONCURRENCY', LOGIN_CONCURRENCY)
+    timeout = app.config.get('LOGIN_QUEUE_TIMEOUT', LOGIN_QUEUE_TIMEOUT)
+    limiter = _limiter
+    if limiter is None or (limiter.concurrency, limiter.timeout) != (concurrency, timeout):
+        with _limiter_lock:
+            if _limiter is None or (_limiter.concurrency, _limiter.timeout) != (concurrency, timeout):
+                _limiter = LoginLimiter(concurrency, timeout)
+            limiter = _limiter
+    return limiter
+
+
+def find_principal(identifier):
+    """Hospital council ID, insurer license number or admin username -> principals row (one probe)."""
+    return query_db("SELECT * FROM principals WHERE identifier = ? ORDER BY priority LIMIT 1",
+                    (identifier,), one=True)
+
+
+def authenticate(app, identifier, password):
+    """
+    Principal dict on success, None on bad credentials. Raises LoginBusy when
+    no hashing slot frees up in time. A hash made with outdated parameters is
+    upgraded to PASSWORD_HASH_METHOD while the plaintext is at hand.
+    """
+    principal = find_principal(identifier)
+    if principal is None:
+        return None
+
+    method = app.config.get('PASSWORD_HASH_METHOD')
+    with get_login_limiter(app).slot():
+        if not verify_password(principal['password_hash'], password):
+            return None
+        if needs_rehash(principal['password_hash'], method):
+            # Compare-and-set: a concurrent password change wins; triggers update principals
+            execute_db(f"UPDATE {ROLE_TABLES[principal['role']]} SET password_hash = ? WHERE id = ? AND password_hash = ?",
+                       (hash_password(password, method), principal['principal_id'], principal['password_hash']))
+    return dict(principal)
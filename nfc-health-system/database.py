@@ -1,39 +1,372 @@
 import sqlite3
 import os
+import time
+import queue
+import threading
+from contextlib import contextmanager
 from flask import g, current_app
 
+import metrics
+import slow_query_log
+
 DATABASE = 'health_system.db'
 
+# Connection pool / pragma settings. Each key can be overridden in app.config
+# (see app.py); these values are used outside an app context.
+DB_DEFAULTS = {
+    'DB_POOL_SIZE': 8,              # Max pooled write connections per process
+    'DB_READ_POOL_SIZE': 16,        # Max pooled read-only connections per process
+    'DB_POOL_TIMEOUT': 10.0,        # Seconds to wait for a free connection
+    'DB_JOURNAL_MODE': 'WAL',       # Readers don't block the writer (and vice versa)
+    'DB_SYNCHRONOUS': 'NORMAL',     # Safe with WAL, avoids an fsync per commit
+    'DB_CACHE_SIZE': -20000,        # Negative = KiB, so ~20MB page cache per connection
+    'DB_MMAP_SIZE': 268435456,      # 256MB memory-mapped reads
+    'DB_BUSY_TIMEOUT': 5000,        # ms to wait on a locked database before failing
+    'DB_FOREIGN_KEYS': True,
+    'DB_AUTO_MIGRATE': True,        # Apply pending migrations the first time a file is opened
+}
+
+
+def _setting(key):
+    try:
+        return current_app.config.get(key, DB_DEFAULTS[key])
+    except RuntimeError:
+        return DB_DEFAULTS[key]
+
+
+def _db_path():
+    # Use config if available (during app context), else fallback
+    try:
+        return current_app.config.get('DATABASE', DATABASE)
+    except RuntimeError:
+        return DATABASE
+
+
+def _observe(conn, sql, params, seconds, rows, error=None, many=False):
+    metrics.observe_statement(sql, seconds, rows)
+    if seconds >= slow_query_log.threshold:
+        slow_query_log.record(conn, sql, params, seconds, rows, error, many)
+
+
+class MeteredCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        error = None
+        try:
+            return super().execute(sql, parameters)
+        except sqlite3.Error as e:
+            error = e
+            raise
+        finally:
+            _observe(self.connection, sql, parameters, time.perf_counter() - start,
+                     self.rowcount if self.rowcount >= 0 else None, error)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        error = None
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        except sqlite3.Error as e:
+            error = e
+            raise
+        finally:
+            # A list can be inspected afterwards (first row's shapes); an iterator is spent
+            first = seq_of_parameters[0] if isinstance(seq_of_parameters, (list, tuple)) and seq_of_parameters else None
+            _observe(self.connection, sql, first, time.perf_counter() - start,
+                     self.rowcount if self.rowcount >= 0 else None, error, many=True)
+
+
+class MeteredConnection(sqlite3.Connection):
+    """
+    Pooled connection that times every statement for /metrics and the
+    slow-query log. Writes report rows changed; reads report rows returned
+    only through query_db/query_in, which time the fetch as well.
+    """
+
+    def cursor(self, factory=MeteredCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def _fetchall(conn, sql, args=()):
+    """Execute and fetch every row, timed as one statement with its row count."""
+    start = time.perf_counter()
+    cur = sqlite3.Cursor(conn)   # Unmetered cursor: the whole call is recorded once below
+    cur.row_factory = conn.row_factory
+    try:
+        rows = cur.execute(sql, args).fetchall()
+    except sqlite3.Error as e:
+        _observe(conn, sql, args, time.perf_counter() - start, None, e)
+        raise
+    finally:
+        cur.close()
+    _observe(conn, sql, args, time.perf_counter() - start, len(rows))
+    return rows
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of SQLite connections for a single database file.
+    Pragmas are applied once when a connection is created, not per request.
+    """
+
+    def __init__(self, path, size=None, timeout=None, settings=None, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self.settings = dict(DB_DEFAULTS, **(settings or {}))
+        self.size = size or self.settings['DB_POOL_SIZE']
+        self.timeout = timeout if timeout is not None else self.settings['DB_POOL_TIMEOUT']
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._pid = os.getpid()
+
+    def _connect(self):
+        s = self.settings
+        conn = sqlite3.connect(
+            self.path,
+            timeout=s['DB_BUSY_TIMEOUT'] / 1000.0,
+            check_same_thread=False,  # Connections move between request threads
+            factory=MeteredConnection,
+        )
+        conn.row_factory = sqlite3.Row  # Access columns by name
+        conn.execute(f"PRAGMA journal_mode = {s['DB_JOURNAL_MODE']}")
+        conn.execute(f"PRAGMA synchronous = {s['DB_SYNCHRONOUS']}")
+        conn.execute(f"PRAGMA cache_size = {int(s['DB_CACHE_SIZE'])}")
+        conn.execute(f"PRAGMA mmap_size = {int(s['DB_MMAP_SIZE'])}")
+        conn.execute(f"PRAGMA busy_timeout = {int(s['DB_BUSY_TIMEOUT'])}")
+        conn.execute(f"PRAGMA foreign_keys = {'ON' if s['DB_FOREIGN_KEYS'] else 'OFF'}")
+        if self.readonly:
+            # Any write through this connection raises instead of taking the write lock
+            conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def _check_fork(self):
+        # Connections must not be shared across processes (gunicorn/uwsgi
+        # preforking). Drop anything inherited from the parent.
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._idle = queue.LifoQueue()
+                    self._created = 0
+                    self._pid = os.getpid()
+
+    def acquire(self):
+        self._check_fork()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(
+                f"Connection pool exhausted ({self.size} connections to {self.path})")
+
+    def release(self, conn, discard=False):
+        if self._pid != os.getpid():
+            return
+        if not discard:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                discard = True
+
+        if discard:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            with self._lock:
+                self._created -= 1
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection outside the request cycle (scripts, workers)."""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            with self._lock:
+                self._created -= 1
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_migrated = set()
+
+
+def get_pool(path=None, readonly=False):
+    """Return the process-wide pool for `path` (defaults to the configured DATABASE)."""
+    path = path or _db_path()
+    pool = _pools.get((path, readonly))
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get((path, readonly))
+            if pool is None:
+                settings = {key: _setting(key) for key in DB_DEFAULTS}
+                size = settings['DB_READ_POOL_SIZE'] if readonly else settings['DB_POOL_SIZE']
+                pool = ConnectionPool(path, size=size, settings=settings, readonly=readonly)
+                if settings['DB_AUTO_MIGRATE'] and path not in _migrated:
+                    _auto_migrate(path, settings)
+                _pools[(path, readonly)] = pool
+    return pool
+
+
+def _auto_migrate(path, settings):
+    import migrations
+    conn = ConnectionPool(path, settings=settings)._connect()
+    try:
+        migrations.migrate(conn)
+    finally:
+        conn.close()
+    _migrated.add(path)
+
+
+def close_pools():
+    """Close every idle pooled connection (tests, shutdown)."""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+        _migrated.clear()
+
+
 def get_db():
+    """Write connection for the current context. Prefer transaction() for writes."""
     db = getattr(g, '_database', None)
     if db is None:
-        # Use config if available (during app context), else fallback
-        try:
-            db_path = current_app.config.get('DATABASE', DATABASE)
-        except RuntimeError:
-            db_path = DATABASE
-            
-        db = g._database = sqlite3.connect(db_path)
-        db.row_factory = sqlite3.Row  # Access columns by name
+        pool = get_pool()
+        db = g._database = pool.acquire()
+        g._database_pool = pool
+    return db
+
+
+def get_read_db():
+    """Read-only (query_only) connection for the current context."""
+    db = getattr(g, '_read_database', None)
+    if db is None:
+        pool = get_pool(readonly=True)
+        db = g._read_database = pool.acquire()
+        g._read_database_pool = pool
     return db
 
+
 def close_connection(exception):
-    db = getattr(g, '_database', None)
-    if db is not None:
-        db.close()
+    for attr in ('_database', '_read_database'):
+        db = g.pop(attr, None)
+        pool = g.pop(attr + '_pool', None)
+        if db is not None:
+            pool.release(db)
+    g.pop('_tx_depth', None)
+
+
+@contextmanager
+def begin_immediate(conn):
+    """BEGIN IMMEDIATE ... COMMIT on any connection (workers/scripts outside a request)."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+@contextmanager
+def transaction():
+    """
+    Explicit write transaction on the context's write connection.
+    Takes the write lock up front (BEGIN IMMEDIATE) so concurrent writers
+    queue on busy_timeout instead of failing mid-transaction. Nested blocks
+    join the outermost transaction.
+    """
+    db = get_db()
+    depth = g.get('_tx_depth', 0)
+    if depth:
+        g._tx_depth = depth + 1
+        try:
+            yield db
+        finally:
+            g._tx_depth = depth
+        return
+
+    g._tx_depth = 1
+    try:
+        with begin_immediate(db):
+            yield db
+    finally:
+        g._tx_depth = 0
+
 
 def query_db(query, args=(), one=False):
-    """Helper for executing queries cleanly."""
-    cur = get_db().execute(query, args)
-    rv = cur.fetchall()
-    cur.close()
-    get_db().commit() # Auto-commit for simplicity in this helper, though usually we might want manual commit
+    """Read helper: runs on a read-only connection and never commits."""
+    # Inside a write transaction, read through it so uncommitted rows are visible
+    db = get_db() if g.get('_tx_depth') else get_read_db()
+    rv = _fetchall(db, query, args)
     return (rv[0] if rv else None) if one else rv
 
+
+# Stay well under SQLITE_MAX_VARIABLE_NUMBER for IN (...) lists
+IN_CHUNK_SIZE = 500
+
+
+def query_in(query, values, args=(), conn=None):
+    """
+    Set-based lookup: `query` contains one `{in}` placeholder that becomes
+    IN (?, ?, ...) over `values`, run in chunks. `args` are bound before the
+    IN list. Uses `conn` if given, else the same connection query_db would.
+    """
+    values = list(dict.fromkeys(values))  # De-duplicate, keep order
+    rows = []
+    for i in range(0, len(values), IN_CHUNK_SIZE):
+        chunk = values[i:i + IN_CHUNK_SIZE]
+        sql = query.format(**{'in': f"({', '.join('?' * len(chunk))})"})
+        if conn is not None:
+            rows.extend(_fetchall(conn, sql, (*args, *chunk)))
+        else:
+            rows.extend(query_db(sql, (*args, *chunk)))
+    return rows
+
+
 def execute_db(query, args=()):
     """Helper for insert/update/delete."""
-    db = get_db()
-    cur = db.execute(query, args)
-    db.commit()
+    with transaction() as db:
+        cur = db.execute(query, args)
     return cur.lastrowid
-
@@ -0,0 +1,349 @@
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import itertools
+import collections
+
+from migrations import migrate, current_version, BASELINE_VERSION
+from qr_service import image_path
+from utils import encrypt_data, hash_password
+
+# Synthetic production-size databases for reproducing performance problems.
+# Rows are bulk-loaded into the baseline schema (schema.sql: no indexes or
+# triggers yet), then the migrations run once over the loaded data, so every
+# index and trigger-maintained table (principals, patient_versions,
+# patient_summary, medical_records_fts) is built in one pass instead of
+# row by row.
+
+PRESETS = {
+    'small': {'hospitals': 20, 'insurers': 5, 'patients': 1000, 'records': 10000,
+              'policies': 1200, 'pending': 300},
+    'medium': {'hospitals': 100, 'insurers': 10, 'patients': 50000, 'records': 500000,
+               'policies': 60000, 'pending': 10000},
+    'large': {'hospitals': 500, 'insurers': 20, 'patients': 1000000, 'records': 8000000,
+              'policies': 1200000, 'pending': 100000},
+}
+ADMINS = 3
+SKEW = 1.5                # Pareto shape for records per patient; lower = longer tail (bigger histories)
+OPEN_FRACTION = 0.25      # Share of pending_medical_data_requests still 'pending'
+YEARS = 5                 # Records, policies and requests are spread over this many years
+BATCH_SIZE = 50000        # Rows per executemany call
+DEFAULT_PASSWORD = 'password123'
+
+# Only safe because the file is new: a crash mid-load means starting over
+FAST_LOAD_PRAGMAS = (
+    "PRAGMA journal_mode = OFF",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA locking_mode = EXCLUSIVE",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -524288",   # 512 MiB, for index builds
+    "PRAGMA foreign_keys = OFF",
+)
+
+RECORD_TYPE_WEIGHTS = {'text': 40, 'lab_result': 25, 'prescription': 20, 'scan': 10, 'image': 3, 'pdf': 2}
+RECORD_TEMPLATES = {
+    'text': [('Routine checkup', 'BP {a}/{b}, pulse {c}. No acute complaints.'),
+             ('Follow-up visit', 'Symptoms improving after {c} days. Continue current plan.'),
+             ('Emergency visit', 'Presented with chest pain, troponin negative. Observed {c} hours.')],
+    'lab_result': [('Lipid panel', 'LDL {a} mg/dL, HDL {b} mg/dL, triglycerides {c} mg/dL.'),
+                   ('Complete blood count', 'Hemoglobin {b} g/L, WBC {c} x10^9/L.'),
+                   ('HbA1c', 'HbA1c {b} mmol/mol, fasting glucose {c} mg/dL.')],
+    'prescription': [('Amoxicillin', 'Amoxicillin 500 mg three times daily for {c} days.'),
+                     ('Metformin', 'Metformin {a} mg twice daily with meals.'),
+                     ('Atorvastatin', 'Atorvastatin {b} mg once daily at night.')],
+    'scan': [('Chest X-ray', 'No consolidation or effusion. Heart size normal.'),
+             ('MRI left knee', 'Partial tear of the medial meniscus, grade {c}.'),
+             ('Abdominal ultrasound', 'Liver {b} mm, no focal lesion. Gallbladder normal.')],
+    'image': [('Dermatology photo', 'Lesion {c} mm on left forearm, regular borders.')],
+    'pdf': [('Discharge summary', 'Admitted {c} days. Discharged in stable condition.')],
+}
+FIRST_NAMES = ('Aarav', 'Ananya', 'Diego', 'Fatima', 'Hiro', 'Ingrid', 'James', 'Kavya', 'Liam', 'Mei',
+               'Noah', 'Olivia', 'Priya', 'Rahul', 'Sara', 'Tomas', 'Uma', 'Wei', 'Yusuf', 'Zara')
+LAST_NAMES = ('Sharma', 'Garcia', 'Khan', 'Tanaka', 'Larsen', 'Smith', 'Iyer', 'Chen', 'Murphy', 'Rossi',
+              'Patel', 'Nakamura', 'Silva', 'Novak', 'Okafor', 'Haddad', 'Kim', 'Singh', 'Brown', 'Müller')
+BLOOD_GROUPS = ('O+', 'A+', 'B+', 'AB+', 'O-', 'A-', 'B-', 'AB-')
+BLOOD_GROUP_WEIGHTS = (37, 28, 20, 5, 4, 3, 2, 1)
+ALLERGIES = ('Penicillin', 'Peanuts', 'Latex', 'Sulfa drugs', 'Shellfish')
+CONDITIONS = ('Hypertension', 'Type 2 diabetes', 'Asthma', 'Hypothyroidism', 'COPD')
+
+
+def _uuid(rng):
+    # uuid.UUID(int=...) costs more than the rest of a record row; same text format
+    h = '%032x' % rng.getrandbits(128)
+    return f'{h[:8]}-{h[8:12]}-4{h[13:16]}-{h[16:20]}-{h[20:]}'
+
+
+def _timestamp(rng, years=YEARS, now=None):
+    """Random 'YYYY-MM-DD HH:MM:SS' (UTC, like CURRENT_TIMESTAMP) within the last `years`."""
+    now = now or time.time()
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now - rng.random() * years * 365 * 86400))
+
+
+def skewed_counts(total, n, rng, skew=SKEW):
+    """
+    Split `total` over `n` owners with a Pareto (power-law) shape: most get a
+    few, a handful get thousands. Counts sum to exactly `total`.
+    """
+    if n <= 0:
+        return []
+    weights = [rng.paretovariate(skew) for _ in range(n)]
+    scale = total / sum(weights)
+    counts = [int(w * scale) for w in weights]
+    for i in rng.sample(range(n), total - sum(counts)):
+        counts[i] += 1
+    return counts
+
+
+def record_texts(rng, variants=64):
+    """record_type -> [(title, description)], templates pre-filled with random values."""
+    return {record_type: [(title, text.format(a=rng.randint(90, 180), b=rng.randint(40, 120), c=rng.randint(1, 30)))
+                          for title, text in templates for _ in range(variants)]
+            for record_type, templates in RECORD_TEMPLATES.items()}
+
+
+def zipf_cum_weights(n, s=1.0):
+    """Cumulative weights for rng.choices: a few big hospitals/insurers, a long tail of small ones."""
+    return list(itertools.accumulate(1.0 / (rank + 1) ** s for rank in range(n)))
+
+
+def _load(conn, table, columns, rows, batch_size=BATCH_SIZE, log=print):
+    """executemany `rows` (any iterable) into `table` in one transaction. Returns the row count."""
+    start = time.perf_counter()
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    rows = iter(rows)
+    count = 0
+    conn.execute("BEGIN")
+    try:
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            conn.executemany(sql, batch)
+            count += len(batch)
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+    elapsed = time.perf_counter() - start
+    log(f"  {table:<32} {count:>10,} rows  {elapsed:7.1f}s  {count / elapsed if elapsed else 0:>10,.0f} rows/s")
+    return count
+
+
+def generate(path, hospitals, insurers, patients, records, policies, pending,
+             qr_codes=None, nfc_tags=None, admins=ADMINS, skew=SKEW, open_fraction=OPEN_FRACTION,
+             years=YEARS, seed=0, password=DEFAULT_PASSWORD, hash_method=None,
+             batch_size=BATCH_SIZE, now=None, log=print):
+    """
+    Build a new database at `path` (must not exist) and return {table: rows}.
+    QR codes and NFC tags default to one per patient. Every account shares
+    `password`. The same `seed` and `now` give the same ids, names, timestamps
+    and distributions (encrypted payloads differ: Fernet tokens are randomized).
+    """
+    if os.path.exists(path):
+        raise FileExistsError(f"{path} already exists")
+    qr_codes = patients if qr_codes is None else min(qr_codes, patients)
+    nfc_tags = patients if nfc_tags is None else min(nfc_tags, patients)
+    rng = random.Random(seed)
+    now = now if now is not None else time.time()
+    password_hash = hash_password(password, hash_method)
+    counts = {}
+    start = time.perf_counter()
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        for pragma in FAST_LOAD_PRAGMAS:
+            conn.execute(pragma)
+        migrate(conn, target=BASELINE_VERSION)
+
+        # --- Accounts ---
+        admin_ids = [_uuid(rng) for _ in range(admins)]
+        counts['admins'] = _load(conn, 'admins', ('id', 'username', 'password_hash'),
+                                 ((a, f'admin{n + 1}', password_hash) for n, a in enumerate(admin_ids)),
+                                 batch_size, log)
+        hospital_ids = [_uuid(rng) for _ in range(hospitals)]
+        counts['hospitals'] = _load(conn, 'hospitals',
+                                    ('id', 'name', 'council_id', 'email', 'password_hash', 'verified'),
+                                    ((h, f'{rng.choice(LAST_NAMES)} General Hospital {n + 1}', f'HOSP{n + 1:05d}',
+                                      f'hospital{n + 1}@example.com', password_hash, 1)
+                                     for n, h in enumerate(hospital_ids)), batch_size, log)
+        insurer_ids = [_uuid(rng) for _ in range(insurers)]
+        counts['insurance_companies'] = _load(conn, 'insurance_companies',
+                                              ('id', 'name', 'license_number', 'email', 'password_hash'),
+                                              ((i, f'{rng.choice(LAST_NAMES)} Health Insurance {n + 1}',
+                                                f'INS{n + 1:05d}', f'insurer{n + 1}@example.com', password_hash)
+                                               for n, i in enumerate(insurer_ids)), batch_size, log)
+
+        # --- Patients, with their NFC tag columns filled in up front (no UPDATE pass) ---
+        patient_ids = [_uuid(rng) for _ in range(patients)]
+        tag_owners = rng.sample(range(patients), nfc_tags)
+        tag_ids = [f'{t:08X}' for t in rng.sample(range(1 << 32), nfc_tags)]
+        nfc_payloads = {}
+        for n, tag in zip(tag_owners, tag_ids):
+            nfc_payloads[n] = (tag, encrypt_data({"pid": patient_ids[n], "type": "nfc_access"}))
+        qr_ids = {n: _uuid(rng) for n in rng.sample(range(patients), qr_codes)}
+
+        def patient_rows():
+            for n, pid in enumerate(patient_ids):
+                tag, nfc_payload = nfc_payloads.get(n, (None, None))
+                allergies = json.dumps(rng.sample(ALLERGIES, rng.choice((0, 0, 0, 1, 2))))
+                conditions = json.dumps(rng.sample(CONDITIONS, rng.choice((0, 0, 1, 1, 2))))
+                yield (pid, f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                       f'{rng.randint(1930, 2020)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+                       f'patient{n + 1}@example.com', f'+1555{n:07d}',
+                       rng.choices(BLOOD_GROUPS, BLOOD_GROUP_WEIGHTS)[0], allergies, conditions,
+                       tag, nfc_payload, image_path(qr_ids[n]) if n in qr_ids else None,
+                       _timestamp(rng, years, now))
+
+        counts['patients'] = _load(conn, 'patients',
+                                   ('id', 'full_name', 'dob', 'email', 'phone', 'blood_group', 'allergies',
+                                    'chronic_conditions', 'nfc_id', 'generated_nfc_id', 'qr_code', 'created_at'),
+                                   patient_rows(), batch_size, log)
+
+        # --- Medical records: power-law histories, big hospitals see most patients ---
+        hospital_weights = zipf_cum_weights(hospitals)
+        types = list(RECORD_TYPE_WEIGHTS)
+        type_weights = list(itertools.accumulate(RECORD_TYPE_WEIGHTS.values()))
+        per_patient = skewed_counts(records, patients, rng, skew)
+        texts = record_texts(rng)
+
+        def record_rows():
+            for pid, count in zip(patient_ids, per_patient):
+                if not count:
+                    continue
+                for hospital, record_type in zip(rng.choices(hospital_ids, cum_weights=hospital_weights, k=count),
+                                                 rng.choices(types, cum_weights=type_weights, k=count)):
+                    title, description = rng.choice(texts[record_type])
+                    yield (_uuid(rng), pid, hospital, record_type, title, description, _timestamp(rng, years, now))
+
+        counts['medical_records'] = _load(conn, 'medical_records',
+                                          ('id', 'patient_id', 'hospital_id', 'record_type', 'title',
+                                           'description', 'created_at'),
+                                          record_rows(), batch_size, log)
+        del per_patient
+
+        # --- Policies: a few big insurers; most patients hold at most one ---
+        insurer_weights = zipf_cum_weights(insurers)
+        # Policies that get a medical-data request (loaded after the migrations, see below)
+        requested = collections.Counter(rng.choices(range(policies), k=pending) if policies else ())
+        request_refs = []   # (policy_id, patient_id, created_at)
+
+        def policy_rows():
+            for n in range(policies):
+                policy_id, pid, created = _uuid(rng), rng.choice(patient_ids), _timestamp(rng, years, now)
+                request_refs.extend([(policy_id, pid, created)] * requested.get(n, 0))
+                status = rng.choices(('active', 'expired', 'cancelled'), (90, 7, 3))[0]
+                yield (policy_id, pid, rng.choices(insurer_ids, cum_weights=insurer_weights)[0],
+                       f'POL-{n + 1:09d}', rng.choice((100000, 250000, 500000, 1000000, 2500000)), status,
+                       f'{rng.randint(2025, 2035)}-12-31', created)
+
+        counts['policies'] = _load(conn, 'policies',
+                                   ('id', 'patient_id', 'provider_id', 'policy_number', 'coverage_amount',
+                                    'status', 'valid_until', 'created_at'),
+                                   policy_rows(), batch_size, log)
+
+        # --- QR and NFC artifacts (the encrypted payloads scans resolve) ---
+        counts['qr_records'] = _load(conn, 'qr_records',
+                                     ('id', 'patient_id', 'encrypted_payload', 'image_path', 'created_at'),
+                                     ((qr_id, patient_ids[n], encrypt_data(patient_ids[n]), image_path(qr_id),
+                                       _timestamp(rng, years, now)) for n, qr_id in qr_ids.items()),
+                                     batch_size, log)
+        counts['nfc_records'] = _load(conn, 'nfc_records',
+                                      ('id', 'patient_id', 'tag_id', 'encrypted_payload', 'created_at'),
+                                      ((_uuid(rng), patient_ids[n], tag, payload, _timestamp(rng, years, now))
+                                       for n, (tag, payload) in nfc_payloads.items()), batch_size, log)
+        del nfc_payloads, qr_ids
+
+        load_seconds = time.perf_counter() - start
+        log(f"Loaded {sum(counts.values()):,} rows in {load_seconds:.1f}s; building indexes and derived tables...")
+
+        # --- Indexes, triggers and trigger-maintained tables, each built once over the full data ---
+        migrate_start = time.perf_counter()
+        migrate(conn)
+        log(f"Migrated to version {current_version(conn)} in {time.perf_counter() - migrate_start:.1f}s")
+
+        # Data requests go in after the migrations: the 0010 patient_summary
+        # backfill predates the per-patient index on this table and would scan
+        # it once per patient. The live triggers keep the summary in step instead.
+        rng.shuffle(request_refs)
+
+        def request_rows():
+            for policy_id, pid, created in request_refs:
+                status = 'pending' if rng.random() < open_fraction else rng.choices(('completed', 'skipped'), (95, 5))[0]
+                yield (_uuid(rng), policy_id, pid, status, created)
+
+        counts['pending_medical_data_requests'] = _load(conn, 'pending_medical_data_requests',
+                                                        ('id', 'policy_id', 'patient_id', 'status', 'created_at'),
+                                                        request_rows(), batch_size, log)
+        del request_refs
+        conn.execute("BEGIN")
+        conn.execute("""
+            UPDATE pending_medical_data_requests
+            SET completed_by = ?, completed_at = datetime(created_at, '+' || (abs(random()) % 14) || ' days')
+            WHERE status = 'completed'
+        """, (admin_ids[0] if admin_ids else None,))
+        conn.commit()
+        conn.execute("ANALYZE")
+
+        # Back to the settings the app expects
+        conn.execute("PRAGMA locking_mode = NORMAL")
+        conn.execute("PRAGMA journal_mode = WAL")
+    except BaseException:
+        conn.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        raise
+    conn.close()
+    log(f"Done: {sum(counts.values()):,} rows in {time.perf_counter() - start:.1f}s, "
+        f"{os.path.getsize(path) / 1024 / 1024:,.0f} MiB")
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate a production-size database with skewed, realistic data.",
+        epilog="Start from --preset and override individual counts, e.g. --preset large --records 20000000.")
+    parser.add_argument('--db', default=os.environ.get('DATABASE', 'health_system.db'))
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='small')
+    parser.add_argument('--force', action='store_true', help="Replace --db if it exists")
+    for name in ('hospitals', 'insurers', 'patients', 'records', 'policies', 'pending'):
+        parser.add_argument(f'--{name}', type=int, help=f"Number of {name} (default: from --preset)")
+    parser.add_argument('--qr-codes', type=int, help="Patients with a QR code (default: all)")
+    parser.add_argument('--nfc-tags', type=int, help="Patients with an NFC tag (default: all)")
+    parser.add_argument('--admins', type=int, default=ADMINS)
+    parser.add_argument('--skew', type=float, default=SKEW,
+                        help=f"Pareto shape of records per patient, lower = bigger histories (default {SKEW})")
+    parser.add_argument('--open-fraction', type=float, default=OPEN_FRACTION,
+                        help="Share of data requests still pending")
+    parser.add_argument('--years', type=float, default=YEARS, help="Spread timestamps over this many years")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--password', default=DEFAULT_PASSWORD, help="Password for every generated account")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.db):
+        if not args.force:
+            print(f"{args.db} already exists; use --force to replace it")
+            return 1
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+
+    sizes = dict(PRESETS[args.preset])
+    for name in sizes:
+        if getattr(args, name) is not None:
+            sizes[name] = getattr(args, name)
+    print(f"Generating {args.db}: " + ', '.join(f'{v:,} {k}' for k, v in sizes.items()))
+    generate(args.db, qr_codes=args.qr_codes, nfc_tags=args.nfc_tags, admins=args.admins, skew=args.skew,
+             open_fraction=args.open_fraction, years=args.years, seed=args.seed, password=args.password,
+             hash_method=os.environ.get('PASSWORD_HASH_METHOD') or None, batch_size=args.batch_size, **sizes)
+    print(f"Log in with HOSP00001 / INS00001 / admin1 and password '{args.password}'")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
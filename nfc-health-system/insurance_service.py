@@ -1,32 +1,47 @@
 import os
-import json
+import time
+import sqlite3
 import datetime
-import qrcode
-from database import get_db, execute_db, query_db
-from utils import generate_uuid, encrypt_data
+from flask import current_app
+from database import transaction, query_db, query_in
+from qr_service import image_path, get_renderer
+from patient_summary import has_medical_data, patients_with_medical_data
+from utils import (generate_uuid, encrypt_data, encrypt_many, encode_cursor, decode_cursor, parse_limit,
+                   parse_upload, read_upload)
 
-QR_FOLDER = os.path.join('static', 'qrcodes')
-os.makedirs(QR_FOLDER, exist_ok=True)
+def new_tag_id():
+    return os.urandom(4).hex().upper()
+
+def unused_tag_ids(conn, count):
+    """
+    `count` new tag IDs no nfc_records row has used, checked on `conn` inside
+    the caller's write transaction (32 random bits collide at scale, and a
+    tap resolves by tag ID alone).
+    """
+    tags = set()
+    while len(tags) < count:
+        candidates = {new_tag_id() for _ in range(count - len(tags))} - tags
+        taken = {r[0] for r in query_in("SELECT tag_id FROM nfc_records WHERE tag_id IN {in}", candidates, conn=conn)}
+        tags |= candidates - taken
+    return list(tags)
 
 def generate_policy(provider_id, patient_identifier, policy_number, coverage_amount, valid_until):
     """
     Atomic creation of Policy + Medical Record (if missing) + QR + NFC.
     """
-    # 0. Resolve Patient
-    # Try by Email or ID
-    patient = query_db("SELECT id, email, full_name FROM patients WHERE email = ? OR id = ?", (patient_identifier, patient_identifier), one=True)
-    
-    conn = get_db()
-    cursor = conn.cursor()
+    with transaction() as conn:
+        cursor = conn.cursor()
+
+        # 0. Resolve Patient
+        # Try by Email or ID (inside the transaction so a concurrent auto-register can't race us)
+        cursor.execute("SELECT id, email, full_name FROM patients WHERE email = ? OR id = ?", (patient_identifier, patient_identifier))
+        patient = cursor.fetchone()
 
-    try:
         if not patient:
             # Auto-register logic
             if '@' in patient_identifier:
                 patient_id = generate_uuid()
-                # Use cursor here to be part of transaction if possible, but patient creation might need to be committed 
-                # for foreign keys to work if we weren't in a transaction already? 
-                # Actually, if we use the same connection/cursor, it's fine.
+                # Same connection/transaction, so the policy's foreign key sees this row.
                 cursor.execute("INSERT INTO patients (id, email, full_name, dob) VALUES (?, ?, ?, ?)", 
                            (patient_id, patient_identifier, "New Patient", "2000-01-01"))
             else:
@@ -42,17 +57,16 @@ def generate_policy(provider_id, patient_identifier, policy_number, coverage_amo
         """, (policy_id, patient_id, provider_id, policy_number, coverage_amount, valid_until, 'active'))
 
         # 2. Check/Create Medical Record
-        # "If patient does NOT already have a medical dataset"
-        cursor.execute("SELECT id FROM medical_records WHERE patient_id = ?", (patient_id,))
-        has_medical_data = cursor.fetchone()
-        
-        if not has_medical_data:
+        # "If patient does NOT already have a medical dataset" (one patient_summary row read)
+        if not has_medical_data(conn, patient_id):
             # Create a placeholder medical dataset entry
+            # hospital_id stays NULL (system-created): the provider is not a hospital,
+            # and foreign keys are enforced on pooled connections.
             med_id = generate_uuid()
             cursor.execute("""
                 INSERT INTO medical_records (id, patient_id, hospital_id, record_type, title, description)
                 VALUES (?, ?, ?, ?, ?, ?)
-            """, (med_id, patient_id, provider_id, 'text', 'Initial Medical Dataset', 'Created automatically with Insurance Policy.'))
+            """, (med_id, patient_id, None, 'text', 'Initial Medical Dataset', 'Created automatically with Insurance Policy.'))
 
             # NEW: Create pending_medical_data_requests entry
             req_id = generate_uuid()
@@ -62,55 +76,263 @@ def generate_policy(provider_id, patient_identifier, policy_number, coverage_amo
             """, (req_id, policy_id, patient_id, 'pending'))
 
         # 3. Generate QR Record
+        # Only the encrypted payload is written here; the image is rendered
+        # after commit (qr_service) so PIL and disk I/O never hold the write lock.
         encrypted_pid = encrypt_data(patient_id)
-        
         qr_id = generate_uuid()
-        qr_filename = f"{qr_id}.png"
-        qr_path_abs = os.path.join(QR_FOLDER, qr_filename)
-        qr_path_rel = f"qrcodes/{qr_filename}"
-        
-        # Generate Image
-        qr = qrcode.QRCode(version=1, box_size=10, border=4)
-        qr.add_data(encrypted_pid)
-        qr.make(fit=True)
-        img = qr.make_image(fill_color="black", back_color="white")
-        img.save(qr_path_abs)
-        
         cursor.execute("""
-            INSERT INTO qr_records (id, patient_id, encrypted_payload, image_path)
-            VALUES (?, ?, ?, ?)
-        """, (qr_id, patient_id, encrypted_pid, qr_path_rel))
-        
-        cursor.execute("UPDATE patients SET qr_code = ? WHERE id = ?", (qr_path_rel, patient_id))
+            INSERT INTO qr_records (id, patient_id, encrypted_payload, image_path, status)
+            VALUES (?, ?, ?, NULL, 'pending')
+        """, (qr_id, patient_id, encrypted_pid))
 
         # 4. Generate NFC Record
         nfc_id = generate_uuid()
-        physical_tag_id = os.urandom(4).hex().upper() 
+        physical_tag_id = unused_tag_ids(conn, 1)[0]
         encrypted_nfc_payload = encrypt_data({"pid": patient_id, "type": "nfc_access"})
-        
+    
         cursor.execute("""
             INSERT INTO nfc_records (id, patient_id, tag_id, encrypted_payload)
             VALUES (?, ?, ?, ?)
         """, (nfc_id, patient_id, physical_tag_id, encrypted_nfc_payload))
-        
+    
         cursor.execute("UPDATE patients SET nfc_id = ?, generated_nfc_id = ? WHERE id = ?", (physical_tag_id, encrypted_nfc_payload, patient_id))
 
-        conn.commit()
-        return policy_id
+    # Committed: render the image off the request's write path
+    get_renderer(current_app).submit(qr_id, encrypted_pid)
+    return policy_id
+
+IMPORT_CHUNK_SIZE = 1000
+
+def parse_policy_upload(text, fmt='csv'):
+    """
+    CSV (with header row) or JSONL -> list of row dicts.
+    Columns: patient_email (or patient_id), policy_number, coverage_amount, valid_until.
+    """
+    return parse_upload(text, fmt)
+
+def _validate_import_rows(rows):
+    """Per-row field checks and in-file duplicate detection. Returns (valid, errors)."""
+    valid, errors, seen = [], [], set()
+    for row_no, row in enumerate(rows, 1):
+        if not isinstance(row, dict) or '_error' in row:
+            errors.append({'row': row_no, 'error': row.get('_error') if isinstance(row, dict) else 'Row must be an object'})
+            continue
+        identifier = str(row.get('patient_email') or row.get('patient_id') or '').strip()
+        number = str(row.get('policy_number') or '').strip()
+        if not identifier or not number:
+            errors.append({'row': row_no, 'policy_number': number or None, 'error': 'patient_email and policy_number are required'})
+            continue
+        try:
+            coverage = float(row.get('coverage_amount'))
+        except (TypeError, ValueError):
+            errors.append({'row': row_no, 'policy_number': number, 'error': 'coverage_amount must be a number'})
+            continue
+        if number in seen:
+            errors.append({'row': row_no, 'policy_number': number, 'error': 'Duplicate policy_number in upload'})
+            continue
+        seen.add(number)
+        valid.append({'row': row_no, 'identifier': identifier, 'policy_number': number,
+                      'coverage_amount': coverage, 'valid_until': (row.get('valid_until') or None)})
+    return valid, errors
+
+def _insert_import_chunk(conn, provider_id, items, new_patients, patients_with_data):
+    """executemany inserts for one chunk. Returns (patients created, patients given placeholder data)."""
+    created = {i['patient_id'] for i in items if i['patient_id'] in new_patients}
+    needs_data = {}
+    for i in items:
+        if i['patient_id'] not in patients_with_data and i['patient_id'] not in needs_data:
+            needs_data[i['patient_id']] = i
+
+    for i, tag in zip(items, unused_tag_ids(conn, len(items))):
+        i['tag_id'] = tag
+
+    conn.executemany("INSERT INTO patients (id, email, full_name, dob) VALUES (?, ?, ?, ?)",
+                     [(pid, new_patients[pid], "New Patient", "2000-01-01") for pid in created])
+    conn.executemany("""
+        INSERT INTO policies (id, patient_id, provider_id, policy_number, coverage_amount, valid_until, status)
+        VALUES (?, ?, ?, ?, ?, ?, 'active')
+    """, [(i['policy_id'], i['patient_id'], provider_id, i['policy_number'], i['coverage_amount'], i['valid_until'])
+          for i in items])
+    conn.executemany("""
+        INSERT INTO medical_records (id, patient_id, hospital_id, record_type, title, description)
+        VALUES (?, ?, NULL, 'text', 'Initial Medical Dataset', 'Created automatically with Insurance Policy.')
+    """, [(generate_uuid(), pid) for pid in needs_data])
+    conn.executemany("""
+        INSERT INTO pending_medical_data_requests (id, policy_id, patient_id, status)
+        VALUES (?, ?, ?, 'pending')
+    """, [(generate_uuid(), i['policy_id'], pid) for pid, i in needs_data.items()])
+    # Images render on first fetch of /qr/<id>; pre-rendering a whole upload would only churn the cache
+    conn.executemany("INSERT INTO qr_records (id, patient_id, encrypted_payload, image_path, status) VALUES (?, ?, ?, ?, 'ready')",
+                     [(i['qr_id'], i['patient_id'], i['qr_payload'], image_path(i['qr_id'])) for i in items])
+    conn.executemany("INSERT INTO nfc_records (id, patient_id, tag_id, encrypted_payload) VALUES (?, ?, ?, ?)",
+                     [(generate_uuid(), i['patient_id'], i['tag_id'], i['nfc_payload']) for i in items])
+    # Latest artifact wins, as with generate_policy
+    conn.executemany("UPDATE patients SET qr_code = ?, nfc_id = ?, generated_nfc_id = ? WHERE id = ?",
+                     [(image_path(i['qr_id']), i['tag_id'], i['nfc_payload'], i['patient_id']) for i in items])
+    return created, set(needs_data)
+
+def read_policy_upload(req):
+    """Policy rows from an upload, a JSON array (or {"policies": [...]}) or a raw CSV/JSONL body."""
+    return read_upload(req, 'policies')
+
+def import_policies(provider_id, rows, chunk_size=IMPORT_CHUNK_SIZE, workers=None):
+    """
+    Bulk version of generate_policy for group onboarding.
+    Patients and duplicate policy numbers are resolved with set-based queries,
+    rows are written with executemany in chunked transactions, and artifact
+    encryption runs in parallel. QR images render on first fetch of /qr/<id>.
+    Returns a per-row report.
+    """
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    valid, errors = _validate_import_rows(rows)
+
+    # 1. Policy numbers that already exist
+    existing = {r['policy_number'] for r in query_in(
+        "SELECT policy_number FROM policies WHERE policy_number IN {in}", [v['policy_number'] for v in valid])}
+    items = []
+    for v in valid:
+        if v['policy_number'] in existing:
+            errors.append({'row': v['row'], 'policy_number': v['policy_number'], 'error': 'policy_number already exists'})
+        else:
+            items.append(v)
+
+    # 2. Resolve patients by email or id in bulk; unknown emails are auto-registered
+    identifiers = [i['identifier'] for i in items]
+    resolved = {}
+    for r in query_in("SELECT id, email FROM patients WHERE email IN {in}", identifiers):
+        resolved[r['email']] = r['id']
+    for r in query_in("SELECT id FROM patients WHERE id IN {in}", identifiers):
+        resolved[r['id']] = r['id']
+
+    new_patients = {}   # patient_id -> email
+    pending = []
+    for i in items:
+        pid = resolved.get(i['identifier'])
+        if not pid and '@' in i['identifier']:
+            pid = resolved[i['identifier']] = generate_uuid()
+            new_patients[pid] = i['identifier']
+        if not pid:
+            errors.append({'row': i['row'], 'policy_number': i['policy_number'],
+                           'error': f"Patient not found with identifier '{i['identifier']}'"})
+            continue
+        i['patient_id'] = pid
+        pending.append(i)
+    items = pending
+
+    patients_with_data = patients_with_medical_data(
+        [i['patient_id'] for i in items if i['patient_id'] not in new_patients])
+
+    # 3. Artifacts: Fernet encryption in threads (cryptography releases the GIL)
+    qr_payloads = encrypt_many([i['patient_id'] for i in items], workers)
+    nfc_payloads = encrypt_many([{"pid": i['patient_id'], "type": "nfc_access"} for i in items], workers)
+    for i, qr_payload, nfc_payload in zip(items, qr_payloads, nfc_payloads):
+        i['policy_id'] = generate_uuid()
+        i['qr_id'] = generate_uuid()
+        i['qr_payload'] = qr_payload
+        i['nfc_payload'] = nfc_payload
+    # Tag IDs are drawn inside each chunk's transaction, checked against the table
+
+    # 4. Chunked transactions; a failing chunk is retried row by row for per-row errors
+    written = []
 
-    except Exception as e:
-        conn.rollback()
-        if 'qr_path_abs' in locals() and os.path.exists(qr_path_abs):
-            os.remove(qr_path_abs)
-        raise e
+    def commit(chunk):
+        with transaction() as conn:
+            created, given_data = _insert_import_chunk(conn, provider_id, chunk, new_patients, patients_with_data)
+        # Only after commit: later chunks must not insert these again
+        written.extend(chunk)
+        for pid in created:
+            new_patients.pop(pid, None)
+        patients_with_data.update(given_data)
 
-def get_all_policies(provider_id):
-    # Update query to match new schema
-    return query_db("""
-        SELECT p.*, pt.full_name as patient_name, pt.qr_code as qr_code_path
+    for c in range(0, len(items), chunk_size):
+        chunk = items[c:c + chunk_size]
+        try:
+            commit(chunk)
+        except sqlite3.IntegrityError:
+            # e.g. a policy_number or tag created concurrently since step 1
+            for item in chunk:
+                try:
+                    commit([item])
+                except sqlite3.IntegrityError as e:
+                    errors.append({'row': item['row'], 'policy_number': item['policy_number'], 'error': str(e)})
+
+    elapsed = time.perf_counter() - start
+    errors.sort(key=lambda e: e['row'])
+    return {
+        'total': len(rows),
+        'created': len(written),
+        'failed': len(errors),
+        'errors': errors,
+        'elapsed_seconds': round(elapsed, 3),
+        'rows_per_second': round(len(written) / elapsed, 1) if elapsed else None,
+    }
+
+POLICY_PAGE_SIZE = 50
+MAX_POLICY_PAGE_SIZE = 200
+
+def get_policies_page(provider_id, limit=POLICY_PAGE_SIZE, cursor=None, status=None,
+                      valid_until_from=None, valid_until_to=None, number_prefix=None):
+    """
+    One page of a provider's policies, newest first, plus the cursor for the next page.
+    Keyset pagination on (created_at, id) keeps page N as cheap as page 1.
+    """
+    sql = """
+        SELECT p.*, pt.full_name as patient_name,
+               q.id as qr_id, q.status as qr_status, q.image_path as qr_code_path,
+               s.record_count, s.pending_request_count
         FROM policies p
         LEFT JOIN patients pt ON p.patient_id = pt.id
+        LEFT JOIN patient_summary s ON s.patient_id = p.patient_id
+        LEFT JOIN qr_records q ON q.id = (
+            SELECT id FROM qr_records WHERE patient_id = p.patient_id
+            ORDER BY created_at DESC, rowid DESC LIMIT 1)
         WHERE p.provider_id = ?
-        ORDER BY p.created_at DESC
-    """, (provider_id,))
+    """
+    args = [provider_id]
+
+    if status:
+        sql += " AND p.status = ?"
+        args.append(status)
+    if valid_until_from:
+        sql += " AND p.valid_until >= ?"
+        args.append(valid_until_from)
+    if valid_until_to:
+        sql += " AND p.valid_until <= ?"
+        args.append(valid_until_to)
+    if number_prefix:
+        # Prefix as a range so it stays sargable (no LIKE/GLOB collation issues).
+        # U+10FFFF is the highest code point, so it sorts (as UTF-8) after anything
+        # a printable prefix can be followed by
+        sql += " AND p.policy_number >= ? AND p.policy_number < ?"
+        args.extend([number_prefix, number_prefix + '\U0010ffff'])
+    if cursor:
+        sql += " AND (p.created_at, p.id) < (?, ?)"
+        args.extend(decode_cursor(cursor))
+
+    sql += " ORDER BY p.created_at DESC, p.id DESC LIMIT ?"
+    args.append(limit + 1)
+
+    rows = query_db(sql, args)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+    return [dict(r) for r in rows], next_cursor
 
+def parse_policy_filters(args):
+    """Request args -> kwargs for get_policies_page (raises ValueError on bad input)."""
+    cursor = args.get('cursor') or None
+    if cursor:
+        decode_cursor(cursor)
+    number_prefix = args.get('policy_number') or None
+    if number_prefix and not number_prefix.isprintable():
+        raise ValueError("policy_number must contain only printable characters")
+    return {
+        'limit': parse_limit(args.get('limit'), POLICY_PAGE_SIZE, MAX_POLICY_PAGE_SIZE),
+        'cursor': cursor,
+        'status': args.get('status') or None,
+        'valid_until_from': args.get('valid_until_from') or None,
+        'valid_until_to': args.get('valid_until_to') or None,
+        'number_prefix': number_prefix,
+    }
@@ -0,0 +1,219 @@
+import re
+import time
+import bisect
+import hashlib
+import threading
+
+# In-process request/SQL/sync metrics, exposed in Prometheus text format at
+# /metrics. No client library: an observation is a bisect and a locked list
+# update, cheap enough to leave on. Each worker process keeps its own
+# numbers, so with several workers each scrape sees one process.
+
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+SYNC_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FINGERPRINT_CACHE_SIZE = 4096   # Distinct SQL strings remembered; the cache is cleared when full
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+enabled = True
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label-value tuple."""
+
+    def __init__(self, name, help_text, labelnames, buckets):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}   # label values -> [count per bucket..., count above last bucket, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: list(series) for labels, series in self._series.items()}
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for labels, series in sorted(self.snapshot().items()):
+            total = 0
+            for le, count in zip(self.buckets + (float('inf'),), series):
+                total += count
+                le_label = 'le="' + _number(le) + '"'
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, le_label)} {total}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-1])}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {total}')
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        lines.extend(f'{self.name}{_labels(self.labelnames, labels)} {_number(v)}' for labels, v in values)
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Time to produce a response, by route.',
+                            ('method', 'route', 'status'), REQUEST_BUCKETS)
+SQL_LATENCY = Histogram('sqlite_statement_duration_seconds', 'SQLite statement execution time.',
+                        ('statement', 'op', 'table'), SQL_BUCKETS)
+SQL_ROWS = Histogram('sqlite_statement_rows', 'Rows returned (reads) or changed (writes) per statement.',
+                     ('statement', 'op', 'table'), ROW_BUCKETS)
+SYNC_LATENCY = Histogram('supabase_sync_duration_seconds', 'Supabase REST push latency per batch.',
+                         ('table', 'outcome'), SYNC_BUCKETS)
+SYNC_ROWS = Counter('supabase_sync_rows_total', 'Rows pushed to Supabase.', ('table', 'outcome'))
+SLOW_STATEMENTS = Counter('sqlite_slow_statements_total', 'Statements over the slow-query threshold (see slow_query_log).',
+                          ('statement', 'op', 'table'))
+REGISTRY = [REQUEST_LATENCY, SQL_LATENCY, SQL_ROWS, SYNC_LATENCY, SYNC_ROWS, SLOW_STATEMENTS]
+
+
+# --- SQL fingerprints: literals and IN lists collapsed so one statement is one series ---
+
+_WS = re.compile(r'\s+')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|JOIN)\s+([A-Za-z_][A-Za-z0-9_]*)', re.IGNORECASE)
+
+_fingerprints = {}
+
+
+def normalize_sql(sql):
+    """Statement text with whitespace, literals and (?, ?, ...) lists collapsed."""
+    text = _WS.sub(' ', sql).strip().rstrip(';')
+    text = _STRING.sub('?', text)
+    text = _NUMBER.sub('?', text)
+    return _IN_LIST.sub('(?...)', text)
+
+
+def fingerprint(sql):
+    """SQL -> (statement id, op, first table, normalized text), memoized per SQL string."""
+    fp = _fingerprints.get(sql)
+    if fp is None:
+        normalized = normalize_sql(sql)
+        op = normalized.split(' ', 1)[0].upper() if normalized else ''
+        table = _TABLE.search(normalized)
+        fp = (hashlib.sha1(normalized.encode()).hexdigest()[:12], op, table.group(1) if table else '', normalized)
+        if len(_fingerprints) >= FINGERPRINT_CACHE_SIZE:
+            _fingerprints.clear()
+        _fingerprints[sql] = fp
+    return fp
+
+
+_statements = {}   # statement id -> normalized text, for sqlite_statement_info
+
+
+def observe_statement(sql, seconds, rows=None):
+    """One executed statement; `rows` returned or changed, if known."""
+    if not enabled:
+        return
+    statement, op, table, normalized = fingerprint(sql)
+    if statement not in _statements:
+        _statements[statement] = normalized
+    SQL_LATENCY.observe(seconds, statement, op, table)
+    if rows is not None:
+        SQL_ROWS.observe(rows, statement, op, table)
+
+
+def observe_sync(table, seconds, rows, error=None):
+    if not enabled:
+        return
+    outcome = 'error' if error is not None else 'ok'
+    SYNC_LATENCY.observe(seconds, table, outcome)
+    SYNC_ROWS.inc(rows, table, outcome)
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    lines.append('# HELP sqlite_statement_info Normalized SQL text for each statement id.')
+    lines.append('# TYPE sqlite_statement_info gauge')
+    for statement, text in sorted(_statements.items()):
+        lines.append(f'sqlite_statement_info{_labels(("statement", "sql"), (statement, text))} 1')
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    for metric in REGISTRY:
+        metric.reset()
+    _statements.clear()
+
+
+# --- Flask wiring ---
+
+def _route_label(request):
+    return request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+
+
+def init_app(app):
+    """Time every request and serve /metrics (unless METRICS_ENABLED is off)."""
+    from flask import g, request, Response
+    global enabled
+    enabled = bool(app.config.get('METRICS_ENABLED', True))
+    if not enabled:
+        return
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _metrics_record(response):
+        start = g.pop('_metrics_start', None)
+        if start is not None and enabled:
+            REQUEST_LATENCY.observe(time.perf_counter() - start, request.method, _route_label(request),
+                                    str(response.status_code))
+        return response
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        return Response(render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,257 @@
+import os
+import re
+import sys
+import sqlite3
+import argparse
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SCHEMA_FILE = os.path.join(BASE_DIR, 'schema.sql')
+MIGRATIONS_DIR = os.path.join(BASE_DIR, 'migrations')
+
+# Version 1 is the baseline schema.sql; later versions are migrations/NNNN_name.sql.
+# The applied version is tracked in the database header (PRAGMA user_version).
+BASELINE_VERSION = 1
+
+MIGRATION_FILE_RE = re.compile(r'^(\d{4})_([a-z0-9_]+)\.sql$')
+
+# Queries on the request path that must be served by an index.
+# name -> (sql, sample params)
+HOT_QUERIES = {
+    'records_by_patient': ("""
+        SELECT m.*, h.name as hospital_name
+        FROM medical_records m
+        LEFT JOIN hospitals h ON m.hospital_id = h.id
+        WHERE m.patient_id = ?
+        ORDER BY m.created_at DESC
+    """, ('patient',)),
+    'records_page': ("""
+        SELECT m.id, m.title, m.created_at FROM medical_records m
+        WHERE m.patient_id = ? AND (m.created_at, m.id) < (?, ?)
+        ORDER BY m.created_at DESC, m.id DESC
+        LIMIT ?
+    """, ('patient', '2030-01-01 00:00:00', 'id', 50)),
+    'medical_data_exists': (
+        "SELECT record_count FROM patient_summary WHERE patient_id = ?", ('patient',)),
+    'patient_summary_in': (
+        "SELECT patient_id FROM patient_summary WHERE patient_id IN (?, ?) AND record_count > 0", ('a', 'b')),
+    'policies_page': ("""
+        SELECT p.*, pt.full_name as patient_name,
+               q.id as qr_id, q.status as qr_status, q.image_path as qr_code_path,
+               s.record_count, s.pending_request_count
+        FROM policies p
+        LEFT JOIN patients pt ON p.patient_id = pt.id
+        LEFT JOIN patient_summary s ON s.patient_id = p.patient_id
+        LEFT JOIN qr_records q ON q.id = (
+            SELECT id FROM qr_records WHERE patient_id = p.patient_id
+            ORDER BY created_at DESC, rowid DESC LIMIT 1)
+        WHERE p.provider_id = ? AND (p.created_at, p.id) < (?, ?)
+        ORDER BY p.created_at DESC, p.id DESC LIMIT ?
+    """, ('provider', '2030-01-01 00:00:00', 'id', 51)),
+    'policies_page_by_status': ("""
+        SELECT p.*, pt.full_name as patient_name,
+               q.id as qr_id, q.status as qr_status, q.image_path as qr_code_path,
+               s.record_count, s.pending_request_count
+        FROM policies p
+        LEFT JOIN patients pt ON p.patient_id = pt.id
+        LEFT JOIN patient_summary s ON s.patient_id = p.patient_id
+        LEFT JOIN qr_records q ON q.id = (
+            SELECT id FROM qr_records WHERE patient_id = p.patient_id
+            ORDER BY created_at DESC, rowid DESC LIMIT 1)
+        WHERE p.provider_id = ? AND p.status = ? AND (p.created_at, p.id) < (?, ?)
+        ORDER BY p.created_at DESC, p.id DESC LIMIT ?
+    """, ('provider', 'active', '2030-01-01 00:00:00', 'id', 51)),
+    'pending_requests': ("""
+        SELECT r.id, r.status, r.created_at, r.patient_id, r.claimed_by, r.lease_expires_at,
+               p.full_name as patient_name, pol.policy_number
+        FROM pending_medical_data_requests r
+        JOIN patients p ON r.patient_id = p.id
+        JOIN policies pol ON r.policy_id = pol.id
+        WHERE r.status = 'pending' AND (r.created_at, r.id) > (?, ?)
+        ORDER BY r.created_at, r.id LIMIT ?
+    """, ('2024-01-01 00:00:00', 'id', 26)),
+    'queue_claim': ("""
+        SELECT id FROM pending_medical_data_requests
+        WHERE status = 'pending' AND (lease_expires_at IS NULL OR lease_expires_at <= ?)
+        ORDER BY created_at, id LIMIT ?
+    """, (0, 10)),
+    'queue_throughput': ("""
+        SELECT COUNT(*) FROM pending_medical_data_requests WHERE completed_at >= datetime('now', '-1 day')
+    """, ()),
+    'qr_pending': ("""
+        SELECT id, encrypted_payload FROM qr_records
+        WHERE status = 'pending' AND created_at <= datetime('now', ?)
+    """, ('-30 seconds',)),
+    'patient_version': (
+        "SELECT version FROM patient_versions WHERE patient_id = ?", ('patient',)),
+    'principal_by_identifier': (
+        "SELECT * FROM principals WHERE identifier = ? ORDER BY priority LIMIT 1", ('HOSP001',)),
+    'nfc_by_payload': (
+        "SELECT status FROM nfc_records WHERE encrypted_payload = ?", ('payload',)),
+    'nfc_by_issued_payload': (
+        "SELECT status FROM nfc_records WHERE issued_payload = ?", ('payload',)),
+    'nfc_by_tag': (
+        "SELECT patient_id FROM nfc_records WHERE tag_id = ? AND status = 'active' LIMIT 1", ('tag',)),
+}
+
+
+def load_migrations():
+    """Return [(version, name, sql)] in version order, baseline first."""
+    with open(SCHEMA_FILE, 'r') as f:
+        migrations = [(BASELINE_VERSION, 'baseline_schema', f.read())]
+
+    if os.path.isdir(MIGRATIONS_DIR):
+        for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+            match = MIGRATION_FILE_RE.match(filename)
+            if not match:
+                continue
+            version = int(match.group(1))
+            if version <= BASELINE_VERSION:
+                raise ValueError(f"Migration {filename} must be numbered above {BASELINE_VERSION:04d}")
+            with open(os.path.join(MIGRATIONS_DIR, filename), 'r') as f:
+                migrations.append((version, match.group(2), f.read()))
+
+    versions = [m[0] for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError("Duplicate migration version numbers")
+    return migrations
+
+
+def split_statements(script):
+    """Split a SQL script into complete statements (trigger bodies stay intact)."""
+    statements, buf = [], ''
+    for line in script.splitlines(keepends=True):
+        buf += line
+        if sqlite3.complete_statement(buf):
+            stmt = buf.strip()
+            buf = ''
+            # Drop comment-only chunks
+            if re.sub(r'--[^\n]*', '', stmt).strip(' \n;'):
+                statements.append(stmt)
+    if re.sub(r'--[^\n]*', '', buf).strip():
+        raise ValueError(f"Incomplete SQL statement: {buf.strip()[:80]}")
+    return statements
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def latest_version():
+    return load_migrations()[-1][0]
+
+
+def migrate(conn, target=None, verbose=False):
+    """
+    Bring the database up to `target` (default: latest) in place.
+    Each migration runs in its own BEGIN IMMEDIATE transaction together with
+    the user_version bump, so a failed step leaves the previous version intact
+    and concurrent workers starting up apply each step exactly once.
+    Returns the list of versions applied.
+    """
+    applied = []
+    for version, name, script in load_migrations():
+        if target is not None and version > target:
+            break
+        if version <= current_version(conn):
+            continue
+
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Re-check under the write lock: another process may have won the race
+            if version <= current_version(conn):
+                conn.rollback()
+                continue
+            if verbose:
+                print(f"Applying migration {version:04d}_{name}")
+            for stmt in split_statements(script):
+                # PRAGMA foreign_keys is a no-op inside a transaction; connections set it themselves
+                if re.match(r'(?is)^\s*PRAGMA\s+foreign_keys', stmt):
+                    continue
+                conn.execute(stmt)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+def tag_conflicts(conn):
+    """[(tag_id, nfc_record_id, patient_id)] deactivated by 0017 for sharing an active tag UID."""
+    try:
+        return conn.execute("""
+            SELECT tag_id, nfc_record_id, patient_id FROM nfc_tag_conflicts
+            WHERE kept = 0 ORDER BY tag_id, nfc_record_id
+        """).fetchall()
+    except sqlite3.OperationalError:
+        return []   # Migration not applied yet
+
+
+def explain(conn, sql, params=()):
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+
+
+def check_query_plans(conn, queries=None):
+    """
+    Run EXPLAIN QUERY PLAN for each hot query and report any full table scan
+    or temp b-tree sort. Returns {name: [problem plan lines]} for failures only.
+    """
+    failures = {}
+    for name, (sql, params) in (queries or HOT_QUERIES).items():
+        problems = []
+        try:
+            plan = explain(conn, sql, params)
+        except sqlite3.OperationalError as e:
+            # Query needs a column/table from a migration not applied yet
+            failures[name] = [str(e)]
+            continue
+        for detail in plan:
+            if detail.startswith('SCAN') and 'INDEX' not in detail:
+                problems.append(detail)
+            elif 'USE TEMP B-TREE' in detail:
+                problems.append(detail)
+        if problems:
+            failures[name] = problems
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply schema migrations in place.")
+    parser.add_argument('--db', default=os.environ.get('DATABASE', 'health_system.db'))
+    parser.add_argument('--target', type=int, default=None, help="Stop at this version")
+    parser.add_argument('--status', action='store_true', help="Show current/latest version only")
+    parser.add_argument('--check', action='store_true', help="Verify hot queries use indexes")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.status:
+            print(f"{args.db}: version {current_version(conn)} (latest {latest_version()})")
+            return 0
+
+        applied = migrate(conn, target=args.target, verbose=True)
+        print(f"{args.db}: at version {current_version(conn)} ({len(applied)} migration(s) applied)")
+
+        conflicts = tag_conflicts(conn)
+        if conflicts:
+            print(f"{len(conflicts)} NFC record(s) set to 'conflict' for sharing an active tag UID; issue these patients new tags:")
+            for tag_id, record_id, patient_id in conflicts:
+                print(f"  tag {tag_id}: nfc_records {record_id} (patient {patient_id})")
+
+        if args.check:
+            failures = check_query_plans(conn)
+            for name, problems in failures.items():
+                print(f"FAIL {name}: {'; '.join(problems)}")
+            if failures:
+                return 1
+            print(f"All {len(HOT_QUERIES)} hot queries use an index.")
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
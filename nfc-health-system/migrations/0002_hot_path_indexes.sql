@@ -0,0 +1,33 @@
+-- Secondary indexes for the hot read paths.
+-- Every query these serve is listed in migrations.HOT_QUERIES and checked with
+-- EXPLAIN QUERY PLAN (python migrations.py --check).
+
+-- api.get_records / generate_policy existence check:
+--   medical_records WHERE patient_id = ? ORDER BY created_at DESC
+CREATE INDEX IF NOT EXISTS idx_medical_records_patient_created
+    ON medical_records (patient_id, created_at, id);
+
+-- insurance_service.get_all_policies:
+--   policies WHERE provider_id = ? ORDER BY created_at DESC
+CREATE INDEX IF NOT EXISTS idx_policies_provider_created
+    ON policies (provider_id, created_at, id);
+
+-- Policy lookups per patient (and ON DELETE CASCADE from patients)
+CREATE INDEX IF NOT EXISTS idx_policies_patient
+    ON policies (patient_id);
+
+-- Admin queue: pending_medical_data_requests WHERE status = 'pending' ORDER BY created_at
+-- Covers the columns the dashboard join needs, so the base table is never read.
+CREATE INDEX IF NOT EXISTS idx_pending_requests_status_created
+    ON pending_medical_data_requests (status, created_at, patient_id, policy_id, id);
+
+-- NFC reader lookups by physical tag id
+CREATE INDEX IF NOT EXISTS idx_nfc_records_tag_status
+    ON nfc_records (tag_id, status);
+
+-- Artifact lookups per patient (and ON DELETE CASCADE from patients)
+CREATE INDEX IF NOT EXISTS idx_nfc_records_patient
+    ON nfc_records (patient_id);
+
+CREATE INDEX IF NOT EXISTS idx_qr_records_patient
+    ON qr_records (patient_id);
@@ -0,0 +1,5 @@
+-- Insurer policy listing (insurance_service.get_policies_page).
+-- Status-filtered pages walk this index in (created_at, id) order, so any
+-- page costs one range probe; unfiltered pages use idx_policies_provider_created.
+CREATE INDEX IF NOT EXISTS idx_policies_provider_status_created
+    ON policies (provider_id, status, created_at, id);
@@ -0,0 +1,16 @@
+-- Durable outbox for rows pushed to Supabase (sync_outbox.py).
+-- Rows are written in the same transaction as the local insert and deleted
+-- only after Supabase has accepted them.
+CREATE TABLE IF NOT EXISTS sync_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    target_table TEXT NOT NULL, -- Supabase table, posted to /rest/v1/<target_table>
+    row_id TEXT NOT NULL,
+    payload TEXT NOT NULL, -- JSON object
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0, -- Unix time; also used as a claim lease
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_sync_outbox_due
+    ON sync_outbox (next_attempt_at, id);
@@ -0,0 +1,15 @@
+-- Asynchronous QR rendering (qr_service.py): policy transactions insert
+-- qr_records as 'pending' with image_path NULL; a render worker fills in
+-- image_path and flips status to 'ready' (or 'failed') afterwards.
+-- Existing rows already have their images, so they default to 'ready'.
+ALTER TABLE qr_records ADD COLUMN status TEXT NOT NULL DEFAULT 'ready';
+ALTER TABLE qr_records ADD COLUMN last_error TEXT;
+
+-- Recovery sweep: pending rows left behind by a crashed process
+CREATE INDEX IF NOT EXISTS idx_qr_records_pending
+    ON qr_records (created_at) WHERE status = 'pending';
+
+-- A patient's latest QR (policy listing, "latest wins" when a render finishes)
+CREATE INDEX IF NOT EXISTS idx_qr_records_patient_created
+    ON qr_records (patient_id, created_at);
+DROP INDEX IF EXISTS idx_qr_records_patient;
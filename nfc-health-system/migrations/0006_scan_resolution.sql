@@ -0,0 +1,10 @@
+-- Scan resolution (scan_service.py).
+
+-- Scans arrive with the payload, not the tag id; a payload belonging to a
+-- revoked NFC tag must be refused.
+CREATE INDEX IF NOT EXISTS idx_nfc_records_payload
+    ON nfc_records (encrypted_payload);
+
+-- A merged duplicate keeps its row so cards still encoding its id resolve
+-- to the surviving patient instead of being auto-synced as someone new.
+ALTER TABLE patients ADD COLUMN merged_into TEXT REFERENCES patients(id);
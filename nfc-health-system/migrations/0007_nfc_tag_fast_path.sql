@@ -0,0 +1,5 @@
+-- NFC fast path (scan_service.resolve_tag): a tap is resolved from the raw
+-- tag UID with one probe of this covering index, no table read.
+CREATE INDEX IF NOT EXISTS idx_nfc_records_tag_status_patient
+    ON nfc_records (tag_id, status, patient_id);
+DROP INDEX IF EXISTS idx_nfc_records_tag_status;
@@ -0,0 +1,70 @@
+-- Unified login index (auth_service.find_principal): one primary-key probe
+-- instead of searching hospitals, insurance_companies and admins in turn.
+-- Kept in sync by triggers; `priority` preserves the old search order when
+-- the same identifier exists in more than one table.
+CREATE TABLE IF NOT EXISTS principals (
+    identifier TEXT NOT NULL, -- council_id / license_number / username
+    priority INTEGER NOT NULL, -- 1 hospital, 2 insurance, 3 admin
+    role TEXT NOT NULL,
+    principal_id TEXT NOT NULL,
+    name TEXT,
+    password_hash TEXT NOT NULL,
+    PRIMARY KEY (identifier, priority)
+) WITHOUT ROWID;
+
+-- hospitals
+INSERT OR REPLACE INTO principals (identifier, priority, role, principal_id, name, password_hash)
+    SELECT council_id, 1, 'hospital', id, name, password_hash FROM hospitals;
+
+CREATE TRIGGER IF NOT EXISTS principals_hospitals_insert AFTER INSERT ON hospitals BEGIN
+    INSERT OR REPLACE INTO principals (identifier, priority, role, principal_id, name, password_hash)
+    VALUES (NEW.council_id, 1, 'hospital', NEW.id, NEW.name, NEW.password_hash);
+END;
+
+CREATE TRIGGER IF NOT EXISTS principals_hospitals_update AFTER UPDATE OF id, council_id, name, password_hash ON hospitals BEGIN
+    DELETE FROM principals WHERE identifier = OLD.council_id AND priority = 1;
+    INSERT OR REPLACE INTO principals (identifier, priority, role, principal_id, name, password_hash)
+    VALUES (NEW.council_id, 1, 'hospital', NEW.id, NEW.name, NEW.password_hash);
+END;
+
+CREATE TRIGGER IF NOT EXISTS principals_hospitals_delete AFTER DELETE ON hospitals BEGIN
+    DELETE FROM principals WHERE identifier = OLD.council_id AND priority = 1;
+END;
+
+-- insurance_companies
+INSERT OR REPLACE INTO principals (identifier, priority, role, principal_id, name, password_hash)
+    SELECT license_number, 2, 'insurance', id, name, password_hash FROM insurance_companies;
+
+CREATE TRIGGER IF NOT EXISTS principals_insurance_companies_insert AFTER INSERT ON insurance_companies BEGIN
+    INSERT OR REPLACE INTO principals (identifier, priority, role, principal_id, name, password_hash)
+    VALUES (NEW.license_number, 2, 'insurance', NEW.id, NEW.name, NEW.password_hash);
+END;
+
+CREATE TRIGGER IF NOT EXISTS principals_insurance_companies_update AFTER UPDATE OF id, license_number, name, password_hash ON insurance_companies BEGIN
+    DELETE FROM principals WHERE identifier = OLD.license_number AND priority = 2;
+    INSERT OR REPLACE INTO principals (identifier, priority, role, principal_id, name, password_hash)
+    VALUES (NEW.license_number, 2, 'insurance', NEW.id, NEW.name, NEW.password_hash);
+END;
+
+CREATE TRIGGER IF NOT EXISTS principals_insurance_companies_delete AFTER DELETE ON insurance_companies BEGIN
+    DELETE FROM principals WHERE identifier = OLD.license_number AND priority = 2;
+END;
+
+-- admins
+INSERT OR REPLACE INTO principals (identifier, priority, role, principal_id, name, password_hash)
+    SELECT username, 3, 'admin', id, username, password_hash FROM admins;
+
+CREATE TRIGGER IF NOT EXISTS principals_admins_insert AFTER INSERT ON admins BEGIN
+    INSERT OR REPLACE INTO principals (identifier, priority, role, principal_id, name, password_hash)
+    VALUES (NEW.username, 3, 'admin', NEW.id, NEW.username, NEW.password_hash);
+END;
+
+CREATE TRIGGER IF NOT EXISTS principals_admins_update AFTER UPDATE OF id, username, password_hash ON admins BEGIN
+    DELETE FROM principals WHERE identifier = OLD.username AND priority = 3;
+    INSERT OR REPLACE INTO principals (identifier, priority, role, principal_id, name, password_hash)
+    VALUES (NEW.username, 3, 'admin', NEW.id, NEW.username, NEW.password_hash);
+END;
+
+CREATE TRIGGER IF NOT EXISTS principals_admins_delete AFTER DELETE ON admins BEGIN
+    DELETE FROM principals WHERE identifier = OLD.username AND priority = 3;
+END;
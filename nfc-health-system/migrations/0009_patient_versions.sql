@@ -0,0 +1,45 @@
+-- Per-patient data version for the read cache (patient_cache.py).
+-- Every write that changes what a patient view or record listing shows
+-- replaces the patient's version in the same transaction, so cache entries
+-- keyed by (patient, version) can never be served stale. Triggers rather
+-- than call sites, so bulk import, merges and admin entry are covered too.
+-- Versions are random rather than incrementing: the cache only compares them
+-- for equality, and a rebuilt database can't reuse a shared cache's keys.
+CREATE TABLE IF NOT EXISTS patient_versions (
+    patient_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+INSERT OR IGNORE INTO patient_versions (patient_id, version) SELECT id, abs(random()) FROM patients;
+
+CREATE TRIGGER IF NOT EXISTS patient_versions_patient_insert AFTER INSERT ON patients BEGIN
+    INSERT INTO patient_versions (patient_id, version) VALUES (NEW.id, abs(random()))
+        ON CONFLICT (patient_id) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS patient_versions_records_insert AFTER INSERT ON medical_records BEGIN
+    INSERT INTO patient_versions (patient_id, version) VALUES (NEW.patient_id, abs(random()))
+        ON CONFLICT (patient_id) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS patient_versions_records_update AFTER UPDATE ON medical_records BEGIN
+    INSERT INTO patient_versions (patient_id, version) VALUES (OLD.patient_id, abs(random()))
+        ON CONFLICT (patient_id) DO UPDATE SET version = excluded.version;
+    INSERT INTO patient_versions (patient_id, version) VALUES (NEW.patient_id, abs(random()))
+        ON CONFLICT (patient_id) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS patient_versions_records_delete AFTER DELETE ON medical_records BEGIN
+    INSERT INTO patient_versions (patient_id, version) VALUES (OLD.patient_id, abs(random()))
+        ON CONFLICT (patient_id) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS patient_versions_patient_update AFTER UPDATE ON patients BEGIN
+    INSERT INTO patient_versions (patient_id, version) VALUES (NEW.id, abs(random()))
+        ON CONFLICT (patient_id) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS patient_versions_patient_delete AFTER DELETE ON patients BEGIN
+    INSERT INTO patient_versions (patient_id, version) VALUES (OLD.id, abs(random()))
+        ON CONFLICT (patient_id) DO UPDATE SET version = excluded.version;
+END;
@@ -0,0 +1,100 @@
+-- Per-patient facts for the patient view, policy list and policy creation
+-- (patient_summary.py): one primary-key read instead of counting
+-- medical_records / policies / pending requests on every request.
+-- Maintained incrementally by triggers in the writing transaction, so bulk
+-- import, merges and admin entry stay in sync; `python patient_summary.py
+-- --verify` / `--rebuild` checks or recomputes it from the base tables.
+CREATE TABLE IF NOT EXISTS patient_summary (
+    patient_id TEXT PRIMARY KEY,
+    record_count INTEGER NOT NULL DEFAULT 0,
+    latest_record_id TEXT,
+    latest_record_at TIMESTAMP,
+    active_policy_count INTEGER NOT NULL DEFAULT 0,
+    pending_request_count INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+INSERT OR REPLACE INTO patient_summary
+    (patient_id, record_count, latest_record_id, latest_record_at, active_policy_count, pending_request_count)
+SELECT p.id,
+       (SELECT COUNT(*) FROM medical_records WHERE patient_id = p.id),
+       (SELECT id FROM medical_records WHERE patient_id = p.id ORDER BY created_at DESC, id DESC LIMIT 1),
+       (SELECT created_at FROM medical_records WHERE patient_id = p.id ORDER BY created_at DESC, id DESC LIMIT 1),
+       (SELECT COUNT(*) FROM policies WHERE patient_id = p.id AND status = 'active'),
+       (SELECT COUNT(*) FROM pending_medical_data_requests WHERE patient_id = p.id AND status = 'pending')
+FROM patients p;
+
+-- patients
+CREATE TRIGGER IF NOT EXISTS patient_summary_patient_insert AFTER INSERT ON patients BEGIN
+    INSERT OR IGNORE INTO patient_summary (patient_id) VALUES (NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS patient_summary_patient_delete AFTER DELETE ON patients BEGIN
+    DELETE FROM patient_summary WHERE patient_id = OLD.id;
+END;
+
+-- medical_records: counts move incrementally; the latest record is compared on
+-- insert and re-read through idx_medical_records_patient_created only when it may have left
+CREATE TRIGGER IF NOT EXISTS patient_summary_records_insert AFTER INSERT ON medical_records BEGIN
+    INSERT INTO patient_summary (patient_id, record_count, latest_record_id, latest_record_at)
+        VALUES (NEW.patient_id, 1, NEW.id, NEW.created_at)
+        ON CONFLICT (patient_id) DO UPDATE SET
+            record_count = record_count + 1,
+            latest_record_id = CASE WHEN latest_record_at IS NULL
+                OR (excluded.latest_record_at, excluded.latest_record_id) > (latest_record_at, latest_record_id)
+                THEN excluded.latest_record_id ELSE latest_record_id END,
+            latest_record_at = CASE WHEN latest_record_at IS NULL
+                OR (excluded.latest_record_at, excluded.latest_record_id) > (latest_record_at, latest_record_id)
+                THEN excluded.latest_record_at ELSE latest_record_at END;
+END;
+
+CREATE TRIGGER IF NOT EXISTS patient_summary_records_update AFTER UPDATE OF id, patient_id, created_at ON medical_records BEGIN
+    UPDATE patient_summary SET record_count = record_count - 1 WHERE patient_id = OLD.patient_id;
+    INSERT INTO patient_summary (patient_id, record_count) VALUES (NEW.patient_id, 1)
+        ON CONFLICT (patient_id) DO UPDATE SET record_count = record_count + 1;
+    UPDATE patient_summary SET (latest_record_id, latest_record_at) = (
+        SELECT id, created_at FROM medical_records WHERE patient_id = patient_summary.patient_id
+        ORDER BY created_at DESC, id DESC LIMIT 1)
+    WHERE patient_id IN (OLD.patient_id, NEW.patient_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS patient_summary_records_delete AFTER DELETE ON medical_records BEGIN
+    UPDATE patient_summary SET record_count = record_count - 1 WHERE patient_id = OLD.patient_id;
+    UPDATE patient_summary SET (latest_record_id, latest_record_at) = (
+        SELECT id, created_at FROM medical_records WHERE patient_id = OLD.patient_id
+        ORDER BY created_at DESC, id DESC LIMIT 1)
+    WHERE patient_id = OLD.patient_id AND latest_record_id = OLD.id;
+END;
+
+-- policies
+CREATE TRIGGER IF NOT EXISTS patient_summary_policies_insert AFTER INSERT ON policies WHEN NEW.status = 'active' BEGIN
+    INSERT INTO patient_summary (patient_id, active_policy_count) VALUES (NEW.patient_id, 1)
+        ON CONFLICT (patient_id) DO UPDATE SET active_policy_count = active_policy_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS patient_summary_policies_update AFTER UPDATE OF patient_id, status ON policies BEGIN
+    UPDATE patient_summary SET active_policy_count = active_policy_count - 1
+        WHERE patient_id = OLD.patient_id AND OLD.status = 'active';
+    INSERT INTO patient_summary (patient_id, active_policy_count) VALUES (NEW.patient_id, NEW.status = 'active')
+        ON CONFLICT (patient_id) DO UPDATE SET active_policy_count = active_policy_count + excluded.active_policy_count;
+END;
+
+CREATE TRIGGER IF NOT EXISTS patient_summary_policies_delete AFTER DELETE ON policies WHEN OLD.status = 'active' BEGIN
+    UPDATE patient_summary SET active_policy_count = active_policy_count - 1 WHERE patient_id = OLD.patient_id;
+END;
+
+-- pending_medical_data_requests
+CREATE TRIGGER IF NOT EXISTS patient_summary_requests_insert AFTER INSERT ON pending_medical_data_requests WHEN NEW.status = 'pending' BEGIN
+    INSERT INTO patient_summary (patient_id, pending_request_count) VALUES (NEW.patient_id, 1)
+        ON CONFLICT (patient_id) DO UPDATE SET pending_request_count = pending_request_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS patient_summary_requests_update AFTER UPDATE OF patient_id, status ON pending_medical_data_requests BEGIN
+    UPDATE patient_summary SET pending_request_count = pending_request_count - 1
+        WHERE patient_id = OLD.patient_id AND OLD.status = 'pending';
+    INSERT INTO patient_summary (patient_id, pending_request_count) VALUES (NEW.patient_id, NEW.status = 'pending')
+        ON CONFLICT (patient_id) DO UPDATE SET pending_request_count = pending_request_count + excluded.pending_request_count;
+END;
+
+CREATE TRIGGER IF NOT EXISTS patient_summary_requests_delete AFTER DELETE ON pending_medical_data_requests WHEN OLD.status = 'pending' BEGIN
+    UPDATE patient_summary SET pending_request_count = pending_request_count - 1 WHERE patient_id = OLD.patient_id;
+END;
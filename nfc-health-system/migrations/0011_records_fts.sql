@@ -0,0 +1,29 @@
+-- Full-text index over medical_records.title/description (search_service.py).
+-- External content: the index stores only tokens and reads the text back from
+-- medical_records by rowid, so record text is not duplicated on disk.
+-- medical_records has no INTEGER PRIMARY KEY, so VACUUM may renumber its
+-- rowids; run `python search_service.py --rebuild` after a VACUUM.
+CREATE VIRTUAL TABLE IF NOT EXISTS medical_records_fts USING fts5(
+    title,
+    description,
+    content='medical_records',
+    content_rowid='rowid',
+    tokenize='porter unicode61 remove_diacritics 2'
+);
+
+INSERT INTO medical_records_fts (medical_records_fts) VALUES ('rebuild');
+
+CREATE TRIGGER IF NOT EXISTS medical_records_fts_insert AFTER INSERT ON medical_records BEGIN
+    INSERT INTO medical_records_fts (rowid, title, description) VALUES (NEW.rowid, NEW.title, NEW.description);
+END;
+
+CREATE TRIGGER IF NOT EXISTS medical_records_fts_update AFTER UPDATE OF title, description ON medical_records BEGIN
+    INSERT INTO medical_records_fts (medical_records_fts, rowid, title, description)
+        VALUES ('delete', OLD.rowid, OLD.title, OLD.description);
+    INSERT INTO medical_records_fts (rowid, title, description) VALUES (NEW.rowid, NEW.title, NEW.description);
+END;
+
+CREATE TRIGGER IF NOT EXISTS medical_records_fts_delete AFTER DELETE ON medical_records BEGIN
+    INSERT INTO medical_records_fts (medical_records_fts, rowid, title, description)
+        VALUES ('delete', OLD.rowid, OLD.title, OLD.description);
+END;
@@ -0,0 +1,18 @@
+-- Admin pending-data queue with claim leases (admin_queue.py).
+-- A pending request is free when it has no lease or its lease has expired;
+-- claiming sets claimed_by/lease_expires_at so concurrent admins get
+-- different requests. Expired leases simply become claimable again.
+ALTER TABLE pending_medical_data_requests ADD COLUMN claimed_by TEXT;
+ALTER TABLE pending_medical_data_requests ADD COLUMN lease_expires_at REAL; -- Unix time
+ALTER TABLE pending_medical_data_requests ADD COLUMN completed_by TEXT;
+ALTER TABLE pending_medical_data_requests ADD COLUMN completed_at TIMESTAMP;
+
+-- Queue order (status, created_at, id) with the lease columns included, so
+-- claiming, paging and queue depth never read the base table
+DROP INDEX IF EXISTS idx_pending_requests_status_created;
+CREATE INDEX IF NOT EXISTS idx_pending_requests_status_created
+    ON pending_medical_data_requests (status, created_at, id, lease_expires_at, claimed_by, patient_id, policy_id);
+
+-- Throughput: completions per time window
+CREATE INDEX IF NOT EXISTS idx_pending_requests_completed
+    ON pending_medical_data_requests (completed_at) WHERE completed_at IS NOT NULL;
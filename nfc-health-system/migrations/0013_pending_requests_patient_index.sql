@@ -0,0 +1,6 @@
+-- Per-patient pending-request lookups: the patient_summary backfill and
+-- `patient_summary.py --verify/--rebuild` count each patient's pending
+-- requests, and deleting a patient cascades to their requests. Without a
+-- patient_id-leading index each of those walks every pending request.
+CREATE INDEX IF NOT EXISTS idx_pending_requests_patient_status
+    ON pending_medical_data_requests (patient_id, status);
@@ -0,0 +1,20 @@
+-- Encryption key rotation (utils.py key ring, rekey.py).
+
+-- Re-keying rewrites nfc_records.encrypted_payload, but the tag in the field
+-- still carries the ciphertext it was issued with. Keep that here so a scan
+-- of the physical tag is still refused once the tag is revoked or replaced.
+ALTER TABLE nfc_records ADD COLUMN issued_payload TEXT;
+CREATE INDEX IF NOT EXISTS idx_nfc_records_issued_payload
+    ON nfc_records (issued_payload) WHERE issued_payload IS NOT NULL;
+
+-- Resumable re-key runs: one row per target column, keyed to the primary key
+-- being rotated to. last_rowid is the committed high-water mark.
+CREATE TABLE IF NOT EXISTS rekey_progress (
+    target TEXT PRIMARY KEY,          -- 'table.column'
+    key_id TEXT NOT NULL,             -- utils.key_id() of the key being rotated to
+    last_rowid INTEGER NOT NULL DEFAULT 0,
+    rotated INTEGER NOT NULL DEFAULT 0,
+    unreadable INTEGER NOT NULL DEFAULT 0,
+    completed_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,9 @@
+-- Dead-letter state for the Supabase outbox (sync_outbox.py).
+-- A row Supabase rejects outright (4xx on its own), or one still failing
+-- after MAX_ATTEMPTS tries, is parked as 'dead' with its last error instead
+-- of being retried forever. Dead rows are kept for inspection and replay.
+ALTER TABLE sync_outbox ADD COLUMN status TEXT NOT NULL DEFAULT 'pending'; -- 'pending' or 'dead'
+
+DROP INDEX IF EXISTS idx_sync_outbox_due;
+CREATE INDEX IF NOT EXISTS idx_sync_outbox_due
+    ON sync_outbox (status, next_attempt_at, id);
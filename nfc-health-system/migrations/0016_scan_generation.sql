@@ -0,0 +1,32 @@
+-- Cross-process invalidation for the scan cache (scan_service.ScanCache).
+-- Each worker process caches payload -> patient resolutions; revoking or
+-- replacing a tag, or merging a patient, only drops entries in the process
+-- that did it. Those writes also replace this single-row generation (in the
+-- same transaction, via triggers, so admin tools and bulk edits count too),
+-- and every process compares it before serving from its cache.
+-- Random rather than incrementing, as in patient_versions: only compared for
+-- equality, and a rebuilt database can't reuse a process's last-seen value.
+CREATE TABLE IF NOT EXISTS scan_generation (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    generation INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO scan_generation (id, generation) VALUES (1, abs(random()));
+
+CREATE TRIGGER IF NOT EXISTS scan_generation_tag_status AFTER UPDATE OF status ON nfc_records
+WHEN NEW.status IS NOT OLD.status BEGIN
+    UPDATE scan_generation SET generation = abs(random()) WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS scan_generation_tag_delete AFTER DELETE ON nfc_records BEGIN
+    UPDATE scan_generation SET generation = abs(random()) WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS scan_generation_patient_merge AFTER UPDATE OF merged_into ON patients
+WHEN NEW.merged_into IS NOT OLD.merged_into BEGIN
+    UPDATE scan_generation SET generation = abs(random()) WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS scan_generation_patient_delete AFTER DELETE ON patients BEGIN
+    UPDATE scan_generation SET generation = abs(random()) WHERE id = 1;
+END;
@@ -0,0 +1,30 @@
+-- One active NFC record per tag UID.
+-- The tap fast path (scan_service.resolve_tag) picks the patient by tag_id
+-- alone, and the tag's MAC covers only the UID, so two active records that
+-- share a (32-bit, random) tag_id would let a tap open either patient.
+--
+-- Existing duplicates are reported in nfc_tag_conflicts (`python
+-- migrations.py` prints them) and all but the first-issued record of each
+-- UID are set to 'conflict': scans of them are refused until the patient is
+-- issued a new tag. Then the unique index keeps it from happening again.
+CREATE TABLE IF NOT EXISTS nfc_tag_conflicts (
+    nfc_record_id TEXT PRIMARY KEY,
+    tag_id TEXT NOT NULL,
+    patient_id TEXT NOT NULL,
+    kept INTEGER NOT NULL,            -- 1 for the record left active
+    detected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT OR IGNORE INTO nfc_tag_conflicts (nfc_record_id, tag_id, patient_id, kept)
+SELECT n.id, n.tag_id, n.patient_id,
+       n.rowid = (SELECT MIN(rowid) FROM nfc_records WHERE tag_id = n.tag_id AND status = 'active')
+FROM nfc_records n
+WHERE n.status = 'active'
+  AND n.tag_id IN (SELECT tag_id FROM nfc_records WHERE status = 'active' AND tag_id IS NOT NULL
+                   GROUP BY tag_id HAVING COUNT(*) > 1);
+
+UPDATE nfc_records SET status = 'conflict'
+WHERE id IN (SELECT nfc_record_id FROM nfc_tag_conflicts WHERE kept = 0);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_nfc_records_active_tag
+    ON nfc_records (tag_id) WHERE status = 'active';
@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from database import query_db
+
+CACHE_BACKEND = 'memory'         # 'memory' (per process), 'sqlite' (shared by workers on a host) or 'none'
+CACHE_SIZE = 2000                # Entries kept before the oldest are evicted
+CACHE_MEMORY_BYTES = 64 * 1024 * 1024  # memory backend: approximate (JSON) size of values kept
+CACHE_PATH = 'patient_cache.db'  # File for the sqlite backend (separate from the main database)
+EVICT_EVERY = 100                # sqlite backend: puts between eviction sweeps
+
+
+class MemoryBackend:
+    """
+    In-process LRU, bounded by entry count and by the values' approximate
+    size (their JSON length), so a few full record histories of chronic
+    patients can't grow it without limit. A value over the whole byte budget
+    isn't kept at all.
+    """
+
+    def __init__(self, max_entries=CACHE_SIZE, max_bytes=CACHE_MEMORY_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (value, size)
+        self._size = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        size = len(json.dumps(value))
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self._size += size
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, (_, dropped) = self._entries.popitem(last=False)
+                self._size -= dropped
+
+    def size_bytes(self):
+        with self._lock:
+            return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+class SQLiteBackend:
+    """
+    Cache shared by every worker process on the host: JSON values in a small
+    WAL-mode SQLite file of its own, so cache writes never contend with the
+    main database's write lock. Evicts oldest-stored entries past `max_entries`.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._puts = 0
+        with self._conn() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    stored_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_stored ON entries (stored_at)")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1.0)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = OFF")  # A lost cache entry is only a miss
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key):
+        try:
+            row = self._conn().execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"Patient Cache Read Error: {e}")
+            return None
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, value):
+        try:
+            with self._conn() as conn:
+                conn.execute("INSERT OR REPLACE INTO entries (key, value, stored_at) VALUES (?, ?, ?)",
+                             (key, json.dumps(value), time.time()))
+                self._puts += 1
+                if self._puts % EVICT_EVERY == 0:
+                    self._evict(conn)
+        except sqlite3.Error as e:
+            print(f"Patient Cache Write Error: {e}")
+
+    def _evict(self, conn):
+        excess = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute("DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY stored_at LIMIT ?)",
+                         (excess,))
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def clear(self):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM entries")
+
+
+def get_version(patient_id):
+    """Current version of a patient's data; replaced by triggers on every relevant write (0 = no such patient)."""
+    row = query_db("SELECT version FROM patient_versions WHERE patient_id = ?", (patient_id,), one=True)
+    return row['version'] if row else 0
+
+
+class PatientCache:
+    """
+    Read-through cache keyed by (kind, patient id, version, variant). Writes
+    never touch the cache: they bump the patient's version, so entries for
+    older versions simply stop being asked for and age out of the backend.
+    """
+
+    def __init__(self, backend, namespace=''):
+        self.backend = backend
+        self.namespace = namespace   # Database path, so a shared backend can serve several databases
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get_or_load(self, kind, patient_id, variant, loader):
+        # Version first: data loaded after it can only be as new or newer,
+        # so an entry is never stored under a version newer than its data.
+        version = get_version(patient_id)
+        key = json.dumps([self.namespace, kind, patient_id, version, variant])
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if value is None:
+            value = loader()
+            self.backend.put(key, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.backend),
+                    'backend': type(self.backend).__name__}
+
+
+class NullCache:
+    """PATIENT_CACHE_BACKEND = 'none': always load."""
+
+    def get_or_load(self, kind, patient_id, variant, loader):
+        return loader()
+
+    def stats(self):
+        return {'backend': None}
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_patient_cache(app):
+    """This process's cache for the app's PATIENT_CACHE_* settings."""
+    backend = app.config.get('PATIENT_CACHE_BACKEND', CACHE_BACKEND)
+    size = app.config.get('PATIENT_CACHE_SIZE', CACHE_SIZE)
+    memory_bytes = app.config.get('PATIENT_CACHE_MEMORY_BYTES', CACHE_MEMORY_BYTES)
+    path = app.config.get('PATIENT_CACHE_PATH', CACHE_PATH)
+    key = (app.config['DATABASE'], backend, size, memory_bytes, path, os.getpid())
+    cache = _caches.get(key)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(key)
+            if cache is None:
+                if backend == 'none':
+                    cache = NullCache()
+                elif backend == 'sqlite':
+                    cache = PatientCache(SQLiteBackend(path, size), app.config['DATABASE'])
+                elif backend == 'memory':
+                    cache = PatientCache(MemoryBackend(size, memory_bytes), app.config['DATABASE'])
+                else:
+                    raise ValueError(f"Unknown PATIENT_CACHE_BACKEND '{backend}'")
+                _caches[key] = cache
+    return cache
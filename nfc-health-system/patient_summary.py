@@ -0,0 +1,113 @@
+import os
+import sys
+import sqlite3
+import argparse
+from database import query_db, query_in
+
+# Kept up to date by the triggers in migrations/0010_patient_summary.sql.
+# This query recomputes the same facts from the base tables for --verify/--rebuild.
+SUMMARY_COLUMNS = ('patient_id', 'record_count', 'latest_record_id', 'latest_record_at',
+                   'active_policy_count', 'pending_request_count')
+
+EXPECTED_SQL = """
+    SELECT p.id AS patient_id,
+           (SELECT COUNT(*) FROM medical_records WHERE patient_id = p.id) AS record_count,
+           (SELECT id FROM medical_records WHERE patient_id = p.id
+            ORDER BY created_at DESC, id DESC LIMIT 1) AS latest_record_id,
+           (SELECT created_at FROM medical_records WHERE patient_id = p.id
+            ORDER BY created_at DESC, id DESC LIMIT 1) AS latest_record_at,
+           (SELECT COUNT(*) FROM policies WHERE patient_id = p.id AND status = 'active') AS active_policy_count,
+           (SELECT COUNT(*) FROM pending_medical_data_requests
+            WHERE patient_id = p.id AND status = 'pending') AS pending_request_count
+    FROM patients p
+"""
+
+EMPTY_SUMMARY = {'record_count': 0, 'latest_record_id': None, 'latest_record_at': None,
+                 'active_policy_count': 0, 'pending_request_count': 0}
+
+
+def get_summary(patient_id, conn=None):
+    """Summary dict for one patient (zeros if unknown). Pass `conn` to read inside a transaction."""
+    sql = "SELECT * FROM patient_summary WHERE patient_id = ?"
+    row = conn.execute(sql, (patient_id,)).fetchone() if conn else query_db(sql, (patient_id,), one=True)
+    if row is None:
+        return dict(EMPTY_SUMMARY, patient_id=patient_id)
+    return dict(row)
+
+
+def has_medical_data(conn, patient_id):
+    row = conn.execute("SELECT record_count FROM patient_summary WHERE patient_id = ?", (patient_id,)).fetchone()
+    return bool(row and row['record_count'])
+
+
+def patients_with_medical_data(patient_ids, conn=None):
+    return {r['patient_id'] for r in query_in(
+        "SELECT patient_id FROM patient_summary WHERE patient_id IN {in} AND record_count > 0",
+        patient_ids, conn=conn)}
+
+
+def verify(conn):
+    """
+    Compare patient_summary with the base tables.
+    Returns [(patient_id, stored_row_or_None, expected_row_or_None)] for mismatches.
+    """
+    columns = ', '.join(SUMMARY_COLUMNS)
+    stored = f"SELECT {columns} FROM patient_summary"
+    diff_ids = [r[0] for r in conn.execute(f"""
+        SELECT patient_id FROM ({EXPECTED_SQL} EXCEPT {stored})
+        UNION
+        SELECT patient_id FROM ({stored} EXCEPT {EXPECTED_SQL})
+        ORDER BY patient_id
+    """).fetchall()]
+
+    mismatches = []
+    for pid in diff_ids:
+        have = conn.execute(f"{stored} WHERE patient_id = ?", (pid,)).fetchone()
+        want = conn.execute(f"SELECT * FROM ({EXPECTED_SQL}) WHERE patient_id = ?", (pid,)).fetchone()
+        mismatches.append((pid, tuple(have) if have else None, tuple(want) if want else None))
+    return mismatches
+
+
+def rebuild(conn):
+    """Recompute the whole table in one write transaction. Returns the row count."""
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM patient_summary")
+        conn.execute(f"INSERT INTO patient_summary ({', '.join(SUMMARY_COLUMNS)}) {EXPECTED_SQL}")
+        count = conn.execute("SELECT COUNT(*) FROM patient_summary").fetchone()[0]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verify or rebuild the patient_summary table.")
+    parser.add_argument('--db', default=os.environ.get('DATABASE', 'health_system.db'))
+    parser.add_argument('--rebuild', action='store_true', help="Recompute every row from the base tables")
+    parser.add_argument('--verify', action='store_true', help="Report rows that differ from the base tables")
+    parser.add_argument('--show', type=int, default=20, help="Mismatches to print with --verify")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.rebuild:
+            print(f"{args.db}: rebuilt patient_summary ({rebuild(conn)} patients)")
+        if args.verify or not args.rebuild:
+            mismatches = verify(conn)
+            for pid, have, want in mismatches[:args.show]:
+                print(f"MISMATCH {pid}: stored {have} expected {want}")
+            if mismatches:
+                print(f"{len(mismatches)} patient(s) out of sync; run with --rebuild")
+                return 1
+            print(f"{args.db}: patient_summary is in sync")
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
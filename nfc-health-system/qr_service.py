@@ -0,0 +1,362 @@
+import os
+import io
+import hashlib
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import qrcode
+import qrcode.image.svg
+from database import get_pool, begin_immediate
+
+RENDER_WORKERS = 2     # Processes rendering images; 0 renders inline right after commit
+STALE_AFTER = 30.0     # Seconds a row may stay pending before a status request renders it itself
+
+# On-demand rendering (/qr/<qr_id>)
+CACHE_DIR = 'qr_cache'
+CACHE_MEMORY_BYTES = 32 * 1024 * 1024
+CACHE_DISK_FILES = 5000
+FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+DEFAULT_BOX_SIZE = 10
+MAX_BOX_SIZE = 40
+DEFAULT_BORDER = 4
+MAX_BORDER = 10
+RENDER_VERSION = 1     # Bump if rendering output changes, so cached images and ETags turn over
+
+
+def render_qr_bytes(payload, fmt='png', box_size=DEFAULT_BOX_SIZE, border=DEFAULT_BORDER):
+    """Render `payload` as a QR image and return the encoded bytes (module-level so process pools can run it)."""
+    qr = qrcode.QRCode(version=1, box_size=box_size, border=border,
+                       image_factory=qrcode.image.svg.SvgPathImage if fmt == 'svg' else None)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    if fmt == 'svg':
+        img = qr.make_image()
+    else:
+        img = qr.make_image(fill_color="black", back_color="white")
+    buf = io.BytesIO()
+    img.save(buf)
+    return buf.getvalue()
+
+
+def cache_key(payload, fmt='png', box_size=DEFAULT_BOX_SIZE, border=DEFAULT_BORDER):
+    """Content hash of everything that determines the image; also used as its strong ETag."""
+    return hashlib.sha256(f"{RENDER_VERSION}:{fmt}:{box_size}:{border}:{payload}".encode()).hexdigest()
+
+
+def image_path(qr_id):
+    """Stored in qr_records.image_path and patients.qr_code for on-demand images."""
+    return f"/qr/{qr_id}"
+
+
+def image_src(path):
+    """Template helper: stored QR path -> URL (data: URIs, /qr/<id>, or a legacy static/qrcodes path)."""
+    from flask import url_for
+    if not path or path.startswith(('data:', '/')):
+        return path
+    return url_for('static', filename=path)
+
+
+class QRCache:
+    """
+    Bounded two-level LRU of rendered images keyed by cache_key(): bytes in
+    memory up to `memory_bytes`, backed by up to `disk_files` files in
+    `directory` so restarts and other worker processes don't re-render.
+    """
+
+    def __init__(self, directory=CACHE_DIR, memory_bytes=CACHE_MEMORY_BYTES, disk_files=CACHE_DISK_FILES):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_files = disk_files
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk = None          # key -> None, oldest first; loaded lazily from the directory
+        self.hits = self.disk_hits = self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _load_disk_index(self):
+        if self._disk is None:
+            os.makedirs(self.directory, exist_ok=True)
+            entries = [e for e in os.scandir(self.directory) if e.is_file() and '.' not in e.name]
+            entries.sort(key=lambda e: e.stat().st_mtime)
+            self._disk = OrderedDict((e.name, None) for e in entries)
+
+    def _remember(self, key, data):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_bytes and len(self._memory) > 1:
+            _, old = self._memory.popitem(last=False)
+            self._memory_size -= len(old)
+
+    def get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return data
+            self._load_disk_index()
+            if key in self._disk:
+                try:
+                    with open(self._path(key), 'rb') as f:
+                        data = f.read()
+                except OSError:
+                    self._disk.pop(key, None)    # Evicted by another process
+                else:
+                    self._disk.move_to_end(key)
+                    self._remember(key, data)
+                    self.disk_hits += 1
+                    return data
+            self.misses += 1
+            return None
+
+    def put(self, key, data):
+        with self._lock:
+            self._remember(key, data)
+            self._load_disk_index()
+            if key in self._disk:
+                self._disk.move_to_end(key)
+                return
+            tmp = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp, self._path(key))  # Atomic: readers never see a partial file
+            except OSError as e:
+                print(f"QR Cache Write Error: {e}")
+                return
+            self._disk[key] = None
+            while len(self._disk) > self.disk_files:
+                old, _ = self._disk.popitem(last=False)
+                try:
+                    os.remove(self._path(old))
+                except OSError:
+                    pass
+
+    def get_or_render(self, payload, fmt='png', box_size=DEFAULT_BOX_SIZE, border=DEFAULT_BORDER):
+        """(bytes, etag) for the image, rendering and caching it on a miss."""
+        key = cache_key(payload, fmt, box_size, border)
+        data = self.get(key)
+        if data is None:
+            data = render_qr_bytes(payload, fmt, box_size, border)
+            self.put(key, data)
+        return data, key
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                    'memory_entries': len(self._memory), 'memory_bytes': self._memory_size,
+                    'disk_files': len(self._disk or ())}
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(app):
+    """Process-wide cache for the app's QR_CACHE_* settings."""
+    directory = app.config.get('QR_CACHE_DIR', CACHE_DIR)
+    cache = _caches.get(directory)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(directory)
+            if cache is None:
+                cache = _caches[directory] = QRCache(
+                    directory,
+                    app.config.get('QR_CACHE_MEMORY_BYTES', CACHE_MEMORY_BYTES),
+                    app.config.get('QR_CACHE_DISK_FILES', CACHE_DISK_FILES))
+    return cache
+
+
+def parse_image_params(args):
+    """Request args -> (fmt, box_size, border); raises ValueError on bad input."""
+    fmt = (args.get('format') or 'png').lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(FORMATS)}")
+    try:
+        box_size = int(args.get('size', DEFAULT_BOX_SIZE))
+        border = int(args.get('border', DEFAULT_BORDER))
+    except ValueError:
+        raise ValueError("size and border must be integers")
+    if not 1 <= box_size <= MAX_BOX_SIZE or not 0 <= border <= MAX_BORDER:
+        raise ValueError(f"size must be 1-{MAX_BOX_SIZE} and border 0-{MAX_BORDER}")
+    return fmt, box_size, border
+
+
+def mark_rendered(conn, qr_ids, error=None):
+    """
+    Record the outcome of rendering `qr_ids`. On success the image path is
+    filled in, and patients.qr_code follows it only if this is still the
+    patient's latest QR, so renders finishing out of order can't regress it.
+    """
+    with begin_immediate(conn):
+        if error is not None:
+            conn.executemany("UPDATE qr_records SET status = 'failed', last_error = ? WHERE id = ?",
+                             [(str(error)[:500], qr_id) for qr_id in qr_ids])
+            return
+        conn.executemany("""
+            UPDATE qr_records SET status = 'ready', image_path = ?, last_error = NULL WHERE id = ?
+        """, [(image_path(qr_id), qr_id) for qr_id in qr_ids])
+        conn.executemany("""
+            UPDATE patients SET qr_code = ?
+            WHERE id = (SELECT patient_id FROM qr_records WHERE id = ?)
+              AND ? = (SELECT q.id FROM qr_records q WHERE q.patient_id = patients.id
+                       ORDER BY q.created_at DESC, q.rowid DESC LIMIT 1)
+        """, [(image_path(qr_id), qr_id, qr_id) for qr_id in qr_ids])
+
+
+def get_status(conn, qr_id):
+    rows = conn.execute("""
+        SELECT id, patient_id, encrypted_payload, image_path, status, last_error,
+               (julianday('now') - julianday(created_at)) * 86400 AS age_seconds
+        FROM qr_records WHERE id = ?
+    """, (qr_id,)).fetchall()  # Exhaust the cursor so no read snapshot stays open
+    return rows[0] if rows else None
+
+
+class QRRenderer:
+    """
+    Renders new QR images off the request path, in a process pool, into the
+    QRCache (so the first /qr/<id> fetch is a hit) and records the result in
+    qr_records. One per (process, database).
+    """
+
+    def __init__(self, db_path, cache, workers=RENDER_WORKERS):
+        self.db_path = db_path
+        self.cache = cache
+        self.workers = workers
+        self.pid = os.getpid()
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = set()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: never fork a (threaded) web server process
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def in_flight(self, qr_id):
+        return qr_id in self._in_flight
+
+    def submit(self, qr_id, payload):
+        """Queue a render. Call only after the qr_records row has committed."""
+        with self._lock:
+            if qr_id in self._in_flight:
+                return
+            self._in_flight.add(qr_id)
+        if self.workers == 0:
+            self._render_here(qr_id, payload)
+            return
+        try:
+            future = self._pool().submit(render_qr_bytes, payload)
+        except Exception as e:
+            self._finish(qr_id, e)
+            return
+        future.add_done_callback(lambda f: self._rendered(qr_id, payload, f))
+
+    def _rendered(self, qr_id, payload, future):
+        error = future.exception()
+        if error is None:
+            self.cache.put(cache_key(payload), future.result())
+        self._finish(qr_id, error)
+
+    def render_now(self, qr_id, payload):
+        """
+        Render in the calling thread (first request for a stale or failed
+        image). False if it failed or another render of `qr_id` is in flight.
+        """
+        with self._lock:
+            if qr_id in self._in_flight:
+                return False
+            self._in_flight.add(qr_id)
+        return self._render_here(qr_id, payload)
+
+    def _render_here(self, qr_id, payload):
+        try:
+            self.cache.get_or_render(payload)
+        except Exception as e:
+            self._finish(qr_id, e)
+            return False
+        self._finish(qr_id, None)
+        return True
+
+    def _finish(self, qr_id, error):
+        try:
+            with get_pool(self.db_path).connection() as conn:
+                mark_rendered(conn, [qr_id], error)
+        except Exception as e:
+            print(f"QR Render Error: {e}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(qr_id)
+
+    def recover(self, older_than=STALE_AFTER):
+        """Resubmit rows left pending by a process that died before rendering them."""
+        with get_pool(self.db_path).connection() as conn:
+            rows = conn.execute("""
+                SELECT id, encrypted_payload FROM qr_records
+                WHERE status = 'pending' AND created_at <= datetime('now', ?)
+            """, (f'-{int(older_than)} seconds',)).fetchall()
+        for r in rows:
+            self.submit(r['id'], r['encrypted_payload'])
+        return len(rows)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+_renderers = {}
+_renderers_lock = threading.Lock()
+
+
+def get_renderer(app):
+    """This process's renderer for the app's database (created, and swept for leftovers, on first use)."""
+    db_path = app.config['DATABASE']
+    key = (db_path, os.getpid())
+    renderer = _renderers.get(key)
+    if renderer is None:
+        with _renderers_lock:
+            renderer = _renderers.get(key)
+            if renderer is None:
+                renderer = QRRenderer(db_path, get_cache(app), app.config.get('QR_RENDER_WORKERS', RENDER_WORKERS))
+                try:
+                    renderer.recover()
+                except Exception as e:
+                    print(f"QR Recovery Error: {e}")
+                _renderers[key] = renderer
+    return renderer
+
+
+def shutdown_renderers(wait=True):
+    with _renderers_lock:
+        renderers = list(_renderers.values())
+        _renderers.clear()
+    for renderer in renderers:
+        renderer.shutdown(wait)
+
+
+def ensure_rendered(app, conn, qr_id):
+    """
+    Status row for `qr_id`, rendering it in this request if it failed or has
+    been pending longer than STALE_AFTER without a render in flight here.
+    """
+    row = get_status(conn, qr_id)
+    if row is None or row['status'] == 'ready':
+        return row
+    renderer = get_renderer(app)
+    if not renderer.in_flight(qr_id) and (row['status'] == 'failed' or row['age_seconds'] >= STALE_AFTER):
+        renderer.render_now(qr_id, row['encrypted_payload'])
+        row = get_status(conn, qr_id)
+    return row
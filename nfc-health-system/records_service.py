@@ -0,0 +1,102 @@
+import json
+from database import get_read_db
+from utils import encode_cursor, decode_cursor
+
+# API field name -> SQL expression. The UI can ask for a subset via ?fields=
+RECORD_FIELDS = {
+    'id': 'm.id',
+    'record_type': 'm.record_type',
+    'data_payload': 'm.description',
+    'summary': 'm.title',
+    'created_at': 'm.created_at',
+    'hospital_name': 'h.name',
+}
+
+# medical_records.record_type CHECK constraint
+RECORD_TYPES = ('text', 'image', 'pdf', 'scan', 'lab_result', 'prescription')
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+FETCH_BATCH = 200
+
+
+def parse_fields(fields_param):
+    """Comma-separated field list -> list of API field names (all fields if empty)."""
+    if not fields_param:
+        return list(RECORD_FIELDS)
+    fields = [f.strip() for f in fields_param.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in RECORD_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+    return fields
+
+
+def _format(row, fields):
+    rec = {}
+    for f in fields:
+        rec[f] = row[f]
+    if 'hospital_name' in rec:
+        rec['hospital_name'] = rec['hospital_name'] or 'Unknown/Admin'
+    return rec
+
+
+def _build_query(fields, cursor, limit):
+    # created_at/id are always selected (as keyset columns) even if not requested
+    columns = [f"{RECORD_FIELDS[f]} AS {f}" for f in fields]
+    columns += ["m.created_at AS _k_created_at", "m.id AS _k_id"]
+    sql = f"SELECT {', '.join(columns)} FROM medical_records m"
+    if 'hospital_name' in fields:
+        sql += " LEFT JOIN hospitals h ON m.hospital_id = h.id"
+    sql += " WHERE m.patient_id = ?"
+    if cursor:
+        # Keyset: strictly older than the last row of the previous page
+        sql += " AND (m.created_at, m.id) < (?, ?)"
+    sql += " ORDER BY m.created_at DESC, m.id DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+    return sql
+
+
+def iter_records(patient_id, fields=None, cursor=None, limit=None):
+    """
+    Yield (record_dict, created_at, id) newest first, reading the SQLite cursor
+    in batches so the full history is never materialized.
+    """
+    fields = fields or list(RECORD_FIELDS)
+    args = [patient_id]
+    if cursor:
+        args.extend(decode_cursor(cursor))
+    if limit is not None:
+        args.append(limit)
+
+    cur = get_read_db().execute(_build_query(fields, cursor, limit), args)
+    try:
+        while True:
+            rows = cur.fetchmany(FETCH_BATCH)
+            if not rows:
+                break
+            for row in rows:
+                yield _format(row, fields), row['_k_created_at'], row['_k_id']
+    finally:
+        cur.close()
+
+
+def get_records_page(patient_id, fields=None, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """One page of records plus the cursor for the next page (None at the end)."""
+    records, last = [], None
+    for rec, created_at, record_id in iter_records(patient_id, fields, cursor, limit + 1):
+        if len(records) == limit:
+            return records, encode_cursor(*last)
+        records.append(rec)
+        last = (created_at, record_id)
+    return records, None
+
+
+def stream_records_json(patient_id, fields=None, cursor=None, limit=None):
+    """Generator of JSON text chunks forming one array, for streamed responses."""
+    yield '['
+    first = True
+    for rec, _, _ in iter_records(patient_id, fields, cursor, limit):
+        yield ('' if first else ',') + json.dumps(rec)
+        first = False
+    yield ']'
@@ -0,0 +1,202 @@
+import os
+import sys
+import time
+import argparse
+import sqlite3
+
+from cryptography.fernet import Fernet, InvalidToken
+
+import migrations
+import utils
+from database import begin_immediate
+
+# Re-encrypts stored payloads under the current primary key after a rotation:
+#
+#   python rekey.py --add-key   new key in front of secret.key; restart the app
+#   python rekey.py             re-encrypt; safe to interrupt and run again
+#
+# Older keys stay in the ring after a run, decrypt-only (only the first key
+# encrypts). Printed QR cards and written NFC tags carry the ciphertext they
+# were issued with for as long as they're in use, so a key may only be removed
+# once every card and tag issued under it has been reissued, revoked or
+# replaced; until then, keep it. QR payloads aren't rotated at all: the stored
+# payload is what /qr/<id> renders, and a new one would change the image and
+# ETag of cards already printed. Tag payloads are, so tags written from now on
+# use the new key; issued_payload keeps the tag's own ciphertext for revocation.
+#
+# Rows are read in rowid order, rotated in a thread pool and written back in
+# one short BEGIN IMMEDIATE transaction per chunk, so request writers only
+# ever wait for a chunk. Progress commits with each chunk (rekey_progress),
+# and rows already under the primary key are skipped with an HMAC check.
+
+CHUNK_SIZE = 2000   # Rows per read + write transaction
+PAUSE = 0.0         # Seconds to sleep between chunks, to leave room for request writers
+
+# target -> (table, column, row filter). Revoked/replaced tags are only ever
+# matched by the ciphertext they were issued with, so they keep it.
+TARGETS = {
+    'nfc_records.encrypted_payload': ('nfc_records', 'encrypted_payload', "AND status = 'active'"),
+    'patients.generated_nfc_id': ('patients', 'generated_nfc_id', ''),
+}
+
+UNREADABLE = object()
+
+
+def _rotate(token):
+    try:
+        return utils.rotate_token(token)
+    except InvalidToken:
+        return UNREADABLE
+
+
+def _progress_row(conn, target, key, restart):
+    row = conn.execute("SELECT key_id, last_rowid, rotated, unreadable, completed_at FROM rekey_progress WHERE target = ?",
+                       (target,)).fetchone()
+    if row is None or row[0] != key or restart:
+        with begin_immediate(conn):
+            conn.execute("""
+                INSERT INTO rekey_progress (target, key_id, last_rowid, rotated, unreadable, completed_at, updated_at)
+                VALUES (?, ?, 0, 0, 0, NULL, CURRENT_TIMESTAMP)
+                ON CONFLICT(target) DO UPDATE SET key_id = excluded.key_id, last_rowid = 0, rotated = 0,
+                    unreadable = 0, completed_at = NULL, updated_at = CURRENT_TIMESTAMP
+            """, (target, key))
+        return 0, 0, 0, None
+    return row[1], row[2], row[3], row[4]
+
+
+def _write_chunk(conn, table, column, changes):
+    """Compare-and-set: a row the app rewrote since it was read is left alone."""
+    if table == 'nfc_records':
+        conn.executemany("""
+            UPDATE nfc_records SET encrypted_payload = ?, issued_payload = COALESCE(issued_payload, encrypted_payload)
+            WHERE rowid = ? AND encrypted_payload = ?
+        """, changes)
+        # The patient's copy of the active tag payload follows the tag
+        conn.executemany("UPDATE patients SET generated_nfc_id = ? WHERE generated_nfc_id = ?",
+                         [(new, old) for new, _, old in changes])
+    else:
+        conn.executemany(f"UPDATE {table} SET {column} = ? WHERE rowid = ? AND {column} = ?", changes)
+
+
+def rekey_target(conn, target, chunk_size=CHUNK_SIZE, workers=None, pause=PAUSE, restart=False, log=print):
+    """Rotate one target to the primary key. Returns {'rotated', 'unreadable', 'done'}."""
+    table, column, where = TARGETS[target]
+    key = utils.key_id()
+    last_rowid, rotated, unreadable, completed_at = _progress_row(conn, target, key, restart)
+    if completed_at is not None:
+        log(f"{target}: already done for key {key} ({rotated} rotated)")
+        return {'rotated': rotated, 'unreadable': unreadable, 'done': True}
+
+    select = f"""
+        SELECT rowid, {column} FROM {table}
+        WHERE rowid > ? AND {column} IS NOT NULL {where}
+        ORDER BY rowid LIMIT ?
+    """
+    started = time.time()
+    while True:
+        rows = conn.execute(select, (last_rowid, chunk_size)).fetchall()
+        if not rows:
+            break
+        results = utils.parallel_map(_rotate, [r[1] for r in rows], workers)
+        changes = [(new, r[0], r[1]) for r, new in zip(rows, results) if new is not None and new is not UNREADABLE]
+        bad = sum(1 for new in results if new is UNREADABLE)
+        last_rowid = rows[-1][0]
+        with begin_immediate(conn):
+            _write_chunk(conn, table, column, changes)
+            conn.execute("""
+                UPDATE rekey_progress SET last_rowid = ?, rotated = rotated + ?, unreadable = unreadable + ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE target = ?
+            """, (last_rowid, len(changes), bad, target))
+        rotated += len(changes)
+        unreadable += bad
+        log(f"  {target}: rowid {last_rowid}, {rotated} rotated ({rotated / max(time.time() - started, 1e-9):,.0f}/s)")
+        if pause:
+            time.sleep(pause)
+
+    with begin_immediate(conn):
+        conn.execute("UPDATE rekey_progress SET completed_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP WHERE target = ?",
+                     (target,))
+    if unreadable:
+        log(f"{target}: {unreadable} value(s) no key in the ring could read were left as they are")
+    return {'rotated': rotated, 'unreadable': unreadable, 'done': True}
+
+
+def rekey(conn, targets=None, chunk_size=CHUNK_SIZE, workers=None, pause=PAUSE, restart=False, log=print):
+    """Rotate every target (default: all) in turn. Returns {target: result}."""
+    return {target: rekey_target(conn, target, chunk_size, workers, pause, restart, log)
+            for target in (targets or TARGETS)}
+
+
+def progress(conn):
+    """rekey_progress rows, with whether each was for the current primary key."""
+    cur = conn.cursor()
+    cur.row_factory = sqlite3.Row
+    rows = [dict(r) for r in cur.execute("SELECT * FROM rekey_progress ORDER BY target")]
+    for r in rows:
+        r['current_key'] = r['key_id'] == utils.key_id()
+    return rows
+
+
+def add_key(path=utils.KEY_FILE):
+    """Generate a key, put it first in the key file and in this process's ring. Returns it."""
+    key = Fernet.generate_key()
+    keys = [key] + list(utils.KEYS)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(b'\n'.join(keys) + b'\n')
+    os.replace(tmp, path)
+    utils.set_keys(keys)
+    return key
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-encrypt stored payloads under the current primary key.")
+    parser.add_argument('--db', default=os.environ.get('DATABASE', 'health_system.db'))
+    parser.add_argument('--target', action='append', choices=sorted(TARGETS), help="Only these (repeatable; default all)")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=utils.CRYPTO_WORKERS)
+    parser.add_argument('--pause', type=float, default=PAUSE, help="Seconds between chunks")
+    parser.add_argument('--restart', action='store_true', help="Start over instead of resuming")
+    parser.add_argument('--status', action='store_true', help="Show progress and exit")
+    parser.add_argument('--add-key', action='store_true',
+                        help=f"Put a new primary key in front of {utils.KEY_FILE} and exit")
+    args = parser.parse_args(argv)
+
+    if args.add_key:
+        if not utils.TAG_MAC_SECRET:
+            # The app refuses to start with several keys and no TAG_MAC_SECRET
+            print("Set TAG_MAC_SECRET first: tag MACs must not change when the key ring does. "
+                  f"Set it to the original key (key id {utils.key_id(utils.KEYS[-1])}) to keep issued NFC tags valid.")
+            return 1
+        if os.environ.get('ENCRYPTION_KEY'):
+            key = Fernet.generate_key()
+            print("ENCRYPTION_KEY is set; put this key first in it:")
+            print(','.join(k.decode() for k in [key] + utils.KEYS))
+            return 0
+        add_key()
+        print(f"New primary key {utils.key_id()} added to {utils.KEY_FILE}; restart the app, then run rekey.py. "
+              "Keep the older keys: cards and tags issued under them still need them to scan.")
+        return 0
+
+    conn = sqlite3.connect(args.db, timeout=30)
+    try:
+        conn.execute("PRAGMA busy_timeout = 30000")
+        migrations.migrate(conn)
+        if args.status:
+            for r in progress(conn):
+                state = 'done' if r['completed_at'] else f"at rowid {r['last_rowid']}"
+                stale = '' if r['current_key'] else ' (older key: will restart)'
+                print(f"{r['target']}: {state}, {r['rotated']} rotated, {r['unreadable']} unreadable{stale}")
+            return 0
+        print(f"Rotating to key {utils.key_id()} ({len(utils.KEYS)} key(s) in the ring)")
+        results = rekey(conn, args.target, args.chunk_size, args.workers, args.pause, args.restart)
+    finally:
+        conn.close()
+    for target, r in results.items():
+        print(f"{target}: {r['rotated']} rotated, {r['unreadable']} unreadable")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,381 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from database import query_db, query_in, transaction
+from utils import decrypt_data, encrypt_data, generate_uuid, normalize_tag_id, tag_mac, verify_tag_mac
+
+CACHE_SIZE = 10000     # Resolved payloads kept per process
+CACHE_TTL = 60.0       # Seconds; revocations in other processes are seen via scan_generation, not the TTL
+MAX_BATCH = 200        # Payloads per /api/patient/scan/batch request
+PARSE_WORKERS = 8      # Threads decrypting a batch's cache misses
+
+# Tables whose rows move to the surviving patient on merge
+PATIENT_TABLES = ('policies', 'medical_records', 'qr_records', 'nfc_records', 'pending_medical_data_requests')
+
+
+class ScanError(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# Non-active nfc_records.status -> refusal
+TAG_STATUS_ERRORS = {
+    'revoked': ('This tag has been revoked', 403),
+    'replaced': ('This tag has been replaced by a newer one', 410),
+    'conflict': ("This tag shares its ID with another patient's tag; issue a new one", 409),
+}
+
+
+def _tag_status_error(status):
+    return _scan_error(*TAG_STATUS_ERRORS.get(status, TAG_STATUS_ERRORS['revoked']))
+
+
+def payload_digest(payload):
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ScanCache:
+    """
+    Bounded LRU+TTL map of payload digest -> resolved scan result, indexed
+    by patient so a revoked tag or merged patient can be dropped at once.
+    Revocations made by other processes arrive through sync() with the
+    database's scan_generation, which empties the cache when it moves.
+    """
+
+    def __init__(self, max_size=CACHE_SIZE, ttl=CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # digest -> (expires_at, patient_id, result)
+        self._by_patient = {}           # patient_id -> set of digests
+        self.generation = 0             # Bumped by every invalidation
+        self.db_generation = None       # Last scan_generation seen in the database
+        self.hits = self.misses = self.expired = self.invalidations = self.resyncs = 0
+
+    def sync(self, db_generation):
+        """Clear the cache if the database's scan_generation moved since the last call."""
+        with self._lock:
+            if db_generation == self.db_generation:
+                return
+            if self.db_generation is not None:
+                self.resyncs += 1
+            self.db_generation = db_generation
+            self.generation += 1
+            self._entries.clear()
+            self._by_patient.clear()
+
+    def get(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] <= time.monotonic():
+                self._drop(digest)
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, digest, patient_id, result, generation=None):
+        """Cache `result`, unless an invalidation ran since `generation` was read (it may be stale)."""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return False
+            self._drop(digest)
+            self._entries[digest] = (time.monotonic() + self.ttl, patient_id, result)
+            self._by_patient.setdefault(patient_id, set()).add(digest)
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))
+            return True
+
+    def _drop(self, digest):
+        entry = self._entries.pop(digest, None)
+        if entry is not None:
+            digests = self._by_patient.get(entry[1])
+            if digests is not None:
+                digests.discard(digest)
+                if not digests:
+                    del self._by_patient[entry[1]]
+
+    def invalidate(self, digest):
+        with self._lock:
+            self.generation += 1
+            self.invalidations += 1
+            self._drop(digest)
+
+    def invalidate_patient(self, patient_id):
+        with self._lock:
+            self.generation += 1
+            self.invalidations += 1
+            for digest in list(self._by_patient.get(patient_id, ())):
+                self._drop(digest)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._by_patient.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'expired': self.expired,
+                    'invalidations': self.invalidations, 'resyncs': self.resyncs, 'size': len(self._entries),
+                    'max_size': self.max_size, 'ttl': self.ttl,
+                    'hit_ratio': self.hits / lookups if lookups else None}
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_scan_cache(app):
+    """Process-wide cache for the app's database."""
+    db_path = app.config['DATABASE']
+    cache = _caches.get(db_path)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(db_path)
+            if cache is None:
+                cache = _caches[db_path] = ScanCache(app.config.get('SCAN_CACHE_SIZE', CACHE_SIZE),
+                                                     app.config.get('SCAN_CACHE_TTL', CACHE_TTL))
+    return cache
+
+
+def db_generation():
+    """The database's scan_generation, replaced by every revoke, replace and merge (migration 0016)."""
+    row = query_db("SELECT generation FROM scan_generation WHERE id = 1", one=True)
+    return row['generation'] if row else None
+
+
+def parse_scan_payload(payload):
+    """
+    Encrypted (NFC/QR) or raw JSON/ID payload -> (patient_id, name, dob).
+    This is the Fernet decrypt + JSON work the cache exists to skip.
+    """
+    decrypted = decrypt_data(payload)
+    data = decrypted if decrypted else payload
+    if isinstance(data, str):
+        try:
+            data = json.loads(data)
+        except ValueError:
+            pass
+    if isinstance(data, dict):
+        patient_id = data.get('patient_id') or data.get('id') or data.get('pid')
+        name = data.get('name') or data.get('full_name') or "New Patient"
+        dob = data.get('dob') or "2000-01-01"
+    else:
+        # Not JSON, treat as raw ID
+        patient_id, name, dob = data, "New Patient", "2000-01-01"
+    return (str(patient_id) if patient_id else None), name, dob
+
+
+def resolve_scan(app, payload):
+    """
+    Scanned payload -> {'patient_id', 'redirect'}. Repeat scans of the same
+    card or wristband are served from the ScanCache without decrypting, at
+    the cost of one primary-key read of scan_generation. Raises ScanError
+    for invalid, revoked or unknown payloads.
+    """
+    result = resolve_scans(app, [payload], workers=1)[0]
+    if 'error' in result:
+        raise ScanError(result['error'], result['status'])
+    return result
+
+
+def _scan_error(message, status_code):
+    return {'error': message, 'status': status_code}
+
+
+def resolve_scans(app, payloads, workers=None):
+    """
+    Batch form of resolve_scan: one result per payload, in input order, each
+    either {'patient_id', 'redirect'} or {'error', 'status'}. Cache misses are
+    decrypted in parallel, checked and resolved with one IN query each, and
+    unknown patients are auto-synced in a single transaction.
+    """
+    cache = get_scan_cache(app)
+    cache.sync(db_generation())
+    generation = cache.generation
+    digests = [payload_digest(p) if isinstance(p, str) and p else None for p in payloads]
+    results = {None: _scan_error('No data provided', 400)}
+    misses = {}   # digest -> payload (duplicates in the batch resolve once)
+    for payload, digest in zip(payloads, digests):
+        if digest in results or digest in misses:
+            continue
+        hit = cache.get(digest)
+        if hit is not None:
+            results[digest] = hit
+        else:
+            misses[digest] = payload
+
+    if misses:
+        # 1. Decrypt + parse (cryptography releases the GIL)
+        workers = workers or min(len(misses), os.cpu_count() or 1, PARSE_WORKERS)
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                parsed = dict(zip(misses, ex.map(parse_scan_payload, misses.values())))
+        else:
+            parsed = {d: parse_scan_payload(p) for d, p in misses.items()}
+
+        # 2. Revoked/replaced tags, by current payload or the one issued before a re-key
+        inactive = {}
+        for column in ('encrypted_payload', 'issued_payload'):
+            inactive.update((r['payload'], r['status']) for r in query_in(
+                f"SELECT {column} AS payload, status FROM nfc_records WHERE {column} IN {{in}} AND status != 'active'",
+                list(misses.values())))
+
+        pending = {}
+        for digest, (patient_id, _, _) in parsed.items():
+            if not patient_id:
+                results[digest] = _scan_error('Invalid payload: No patient ID found', 400)
+            elif misses[digest] in inactive:
+                results[digest] = _tag_status_error(inactive[misses[digest]])
+            else:
+                pending[digest] = patient_id
+
+        # 3. Patients in one query (following merges to the surviving record)
+        ids = set(pending.values())
+        found = {r['id']: r['resolved_id'] for r in query_in(
+            "SELECT id, COALESCE(merged_into, id) AS resolved_id FROM patients WHERE id IN {in}", ids)}
+
+        # 4. Auto-Sync: add unknown patients from the trusted system in one transaction
+        unknown = {}
+        for digest, patient_id in pending.items():
+            if patient_id not in found and patient_id not in unknown:
+                _, name, dob = parsed[digest]
+                unknown[patient_id] = (patient_id, name, dob, f"sync_{patient_id[:8]}@example.com")
+        if unknown:
+            print(f"Auto-syncing {len(unknown)} patient(s)")
+            try:
+                with transaction() as conn:
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO patients (id, full_name, dob, email) VALUES (?, ?, ?, ?)",
+                        list(unknown.values()))
+                    for r in query_in("SELECT id, COALESCE(merged_into, id) AS resolved_id FROM patients WHERE id IN {in}",
+                                      list(unknown), conn=conn):
+                        found[r['id']] = r['resolved_id']
+            except Exception as e:
+                print(f"Auto-sync error: {e}")
+
+        for digest, patient_id in pending.items():
+            resolved_id = found.get(patient_id)
+            if resolved_id is None:
+                results[digest] = _scan_error('Patient not found and could not be synced', 404)
+                continue
+            results[digest] = {'patient_id': resolved_id, 'redirect': f'/patient/{resolved_id}/view'}
+            cache.put(digest, resolved_id, results[digest], generation)
+
+    return [dict(results[d]) for d in digests]
+
+
+def resolve_tag(tag_id, mac):
+    """
+    NFC fast path: raw tag UID + the HMAC written on the tag -> {'patient_id',
+    'redirect'}. A constant-time HMAC check replaces the Fernet decrypt, and
+    an active tag costs one covering-index probe (revocation is seen at once).
+    """
+    tag_id = normalize_tag_id(tag_id)
+    if not tag_id or not verify_tag_mac(tag_id, mac):
+        raise ScanError('Invalid tag signature', 403)
+
+    row = query_db("SELECT patient_id FROM nfc_records WHERE tag_id = ? AND status = 'active' LIMIT 1",
+                   (tag_id,), one=True)
+    if row is None:
+        # Failure path only: tell revoked/replaced apart from unknown
+        row = query_db("SELECT status FROM nfc_records WHERE tag_id = ? LIMIT 1", (tag_id,), one=True)
+        if row is None:
+            raise ScanError('Unknown tag', 404)
+        error = _tag_status_error(row['status'])
+        raise ScanError(error['error'], error['status'])
+    return {'patient_id': row['patient_id'], 'redirect': f'/patient/{row["patient_id"]}/view'}
+
+
+def tag_provisioning(tag_id, payload):
+    """What gets written onto a physical tag: its UID, the UID's MAC and the encrypted payload."""
+    return {'tag_id': tag_id, 'mac': tag_mac(tag_id), 'payload': payload}
+
+
+def get_tag_provisioning(tag_id):
+    row = query_db("SELECT tag_id, encrypted_payload FROM nfc_records WHERE tag_id = ? AND status = 'active' LIMIT 1",
+                   (normalize_tag_id(tag_id),), one=True)
+    return tag_provisioning(row['tag_id'], row['encrypted_payload']) if row else None
+
+
+def replace_tag(app, tag_id):
+    """
+    Issue a new tag for a lost/damaged one: the old record becomes 'replaced'
+    (scans of it are refused) and the patient's nfc_id moves to the new UID.
+    Returns the new tag's provisioning data, or None if `tag_id` isn't active.
+    """
+    from insurance_service import unused_tag_ids
+    tag_id = normalize_tag_id(tag_id)
+    with transaction() as conn:
+        old = conn.execute("SELECT id, patient_id, encrypted_payload, issued_payload FROM nfc_records WHERE tag_id = ? AND status = 'active'",
+                           (tag_id,)).fetchone()
+        if old is None:
+            return None
+        new_tag = unused_tag_ids(conn, 1)[0]
+        payload = encrypt_data({"pid": old['patient_id'], "type": "nfc_access"})
+        conn.execute("UPDATE nfc_records SET status = 'replaced' WHERE id = ?", (old['id'],))
+        conn.execute("INSERT INTO nfc_records (id, patient_id, tag_id, encrypted_payload) VALUES (?, ?, ?, ?)",
+                     (generate_uuid(), old['patient_id'], new_tag, payload))
+        conn.execute("UPDATE patients SET nfc_id = ?, generated_nfc_id = ? WHERE id = ?",
+                     (new_tag, payload, old['patient_id']))
+    cache = get_scan_cache(app)
+    for p in (old['encrypted_payload'], old['issued_payload']):
+        if p:
+            cache.invalidate(payload_digest(p))
+    return tag_provisioning(new_tag, payload)
+
+
+def revoke_tag(app, tag_id):
+    """
+    Mark an NFC tag revoked and drop its cached resolutions (other processes
+    drop theirs on seeing the new scan_generation). Returns the number of
+    records revoked.
+    """
+    tag_id = normalize_tag_id(tag_id)
+    with transaction() as conn:
+        rows = conn.execute("SELECT encrypted_payload, issued_payload FROM nfc_records WHERE tag_id = ? AND status = 'active'",
+                            (tag_id,)).fetchall()
+        conn.execute("UPDATE nfc_records SET status = 'revoked' WHERE tag_id = ? AND status = 'active'", (tag_id,))
+    cache = get_scan_cache(app)
+    for r in rows:
+        for p in (r['encrypted_payload'], r['issued_payload']):
+            if p:
+                cache.invalidate(payload_digest(p))
+    return len(rows)
+
+
+def merge_patients(app, source_id, target_id):
+    """
+    Fold duplicate patient `source_id` into `target_id`: policies, records
+    and artifacts move over and the source is marked merged_into the target,
+    so its old cards resolve to the survivor. Cached scans of either are dropped.
+    """
+    if source_id == target_id:
+        raise ValueError("Cannot merge a patient into itself")
+    with transaction() as conn:
+        found = {r['id']: r['merged_into'] for r in conn.execute(
+            "SELECT id, merged_into FROM patients WHERE id IN (?, ?)", (source_id, target_id))}
+        if len(found) != 2:
+            raise ValueError("Both patients must exist")
+        if found[source_id] or found[target_id]:
+            raise ValueError("Patient has already been merged")
+        for table in PATIENT_TABLES:
+            conn.execute(f"UPDATE {table} SET patient_id = ? WHERE patient_id = ?", (target_id, source_id))
+        # Earlier merges into the source now point straight at the survivor
+        conn.execute("UPDATE patients SET merged_into = ? WHERE id = ? OR merged_into = ?",
+                     (target_id, source_id, source_id))
+    cache = get_scan_cache(app)
+    cache.invalidate_patient(source_id)
+    cache.invalidate_patient(target_id)
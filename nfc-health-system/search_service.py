@@ -0,0 +1,195 @@
+import os
+import re
+import sys
+import html
+import sqlite3
+import argparse
+import datetime
+from database import query_db, query_in
+from utils import encode_cursor, decode_cursor, parse_limit
+from records_service import RECORD_TYPES
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+MAX_QUERY_LENGTH = 200
+TITLE_WEIGHT = 10.0          # bm25 weight of a title hit relative to a description hit
+SNIPPET_TOKENS = 16
+
+# snippet()/highlight() wrap matches in these, so the text can be HTML-escaped
+# before the markers become <mark> tags
+_OPEN, _CLOSE = '\x02', '\x03'
+
+
+def build_match(q):
+    """
+    Free text -> FTS5 MATCH expression. Every word must match (implicit AND);
+    "quoted words" match as a phrase and a trailing * matches a prefix.
+    Operators and column filters in user input are never passed through.
+    """
+    if not q or not q.strip():
+        raise ValueError("Search query is required")
+    if len(q) > MAX_QUERY_LENGTH:
+        raise ValueError(f"Search query must be at most {MAX_QUERY_LENGTH} characters")
+
+    terms = []
+    for m in re.finditer(r'"([^"]*)"?|(\S+)', q):
+        text = m.group(1) if m.group(1) is not None else m.group(2)
+        words = re.findall(r'\w+', text)
+        if not words:
+            continue
+        term = '"' + ' '.join(words) + '"'
+        if m.group(2) is not None and text.endswith('*'):
+            term += '*'
+        terms.append(term)
+    if not terms:
+        raise ValueError("Search query has no searchable words")
+    return ' '.join(terms)
+
+
+def _parse_date(value, name):
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f"{name} must be a date (YYYY-MM-DD)")
+
+
+def parse_search_args(args):
+    """Request args -> kwargs for search_records (raises ValueError on bad input)."""
+    record_type = args.get('record_type') or None
+    if record_type and record_type not in RECORD_TYPES:
+        raise ValueError(f"record_type must be one of: {', '.join(RECORD_TYPES)}")
+    cursor = args.get('cursor') or None
+    if cursor:
+        _decode_search_cursor(cursor)
+    return {
+        'match': build_match(args.get('q')),
+        'patient_id': args.get('patient_id') or None,
+        'record_type': record_type,
+        'date_from': _parse_date(args.get('from'), 'from'),
+        'date_to': _parse_date(args.get('to'), 'to'),
+        'limit': parse_limit(args.get('limit'), DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE),
+        'cursor': cursor,
+    }
+
+
+def _decode_search_cursor(cursor):
+    score, rowid = decode_cursor(cursor)
+    try:
+        return float(score), int(rowid)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+
+
+def _marked(text):
+    if text is None:
+        return None
+    return html.escape(text).replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>')
+
+
+def search_records(match, patient_id=None, record_type=None, date_from=None, date_to=None,
+                   provider_id=None, limit=DEFAULT_PAGE_SIZE, cursor=None):
+    """
+    One page of records matching `match` (from build_match), best first,
+    plus the cursor for the next page. `provider_id` limits results to that
+    insurer's policyholders. Snippets are HTML-escaped with <mark> around hits.
+    """
+    sql = f"""
+        SELECT m.id, m.patient_id, m.record_type, m.title AS summary, m.created_at,
+               h.name AS hospital_name, f.rowid AS _rowid,
+               bm25(medical_records_fts, {TITLE_WEIGHT}, 1.0) AS _score
+        FROM medical_records_fts f
+        JOIN medical_records m ON m.rowid = f.rowid
+        LEFT JOIN hospitals h ON m.hospital_id = h.id
+        WHERE medical_records_fts MATCH ?
+    """
+    args = [match]
+    if patient_id:
+        sql += " AND m.patient_id = ?"
+        args.append(patient_id)
+    if provider_id:
+        sql += " AND m.patient_id IN (SELECT patient_id FROM policies WHERE provider_id = ?)"
+        args.append(provider_id)
+    if record_type:
+        sql += " AND m.record_type = ?"
+        args.append(record_type)
+    if date_from:
+        sql += " AND m.created_at >= ?"
+        args.append(date_from)
+    if date_to:
+        sql += " AND m.created_at < date(?, '+1 day')"
+        args.append(date_to)
+    if cursor:
+        # Keyset on (score, rowid): bm25 is lower-is-better
+        sql += f" AND (bm25(medical_records_fts, {TITLE_WEIGHT}, 1.0), f.rowid) > (?, ?)"
+        args.extend(_decode_search_cursor(cursor))
+    sql += " ORDER BY _score, f.rowid LIMIT ?"
+    args.append(limit + 1)
+
+    rows = query_db(sql, args)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['_score'], rows[-1]['_rowid'])
+
+    # Highlighting only for the rows on this page, not every match
+    marks = {r['rowid']: r for r in query_in(f"""
+        SELECT rowid,
+               highlight(medical_records_fts, 0, '{_OPEN}', '{_CLOSE}') AS title,
+               snippet(medical_records_fts, 1, '{_OPEN}', '{_CLOSE}', '...', {SNIPPET_TOKENS}) AS snippet
+        FROM medical_records_fts WHERE medical_records_fts MATCH ? AND rowid IN {{in}}
+    """, [r['_rowid'] for r in rows], args=(match,))}
+
+    results = []
+    for r in rows:
+        rec = {k: r[k] for k in ('id', 'patient_id', 'record_type', 'summary', 'created_at')}
+        rec['hospital_name'] = r['hospital_name'] or 'Unknown/Admin'
+        rec['score'] = round(-r['_score'], 4)
+        mark = marks.get(r['_rowid'])
+        rec['summary_highlight'] = _marked(mark['title']) if mark else None
+        rec['snippet'] = _marked(mark['snippet']) if mark else None
+        results.append(rec)
+    return results, next_cursor
+
+
+def rebuild_index(conn):
+    """Re-read every record into the index (after a VACUUM or bulk load with triggers off)."""
+    conn.execute("INSERT INTO medical_records_fts (medical_records_fts) VALUES ('rebuild')")
+    conn.commit()
+
+
+def check_index(conn):
+    """Raises sqlite3.DatabaseError if the index doesn't match medical_records."""
+    conn.execute("INSERT INTO medical_records_fts (medical_records_fts, rank) VALUES ('integrity-check', 1)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the medical records full-text index.")
+    parser.add_argument('--db', default=os.environ.get('DATABASE', 'health_system.db'))
+    parser.add_argument('--rebuild', action='store_true', help="Rebuild the index from medical_records")
+    parser.add_argument('--optimize', action='store_true', help="Merge index segments (after large imports)")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.rebuild:
+            rebuild_index(conn)
+            print(f"{args.db}: search index rebuilt")
+        if args.optimize:
+            conn.execute("INSERT INTO medical_records_fts (medical_records_fts) VALUES ('optimize')")
+            conn.commit()
+            print(f"{args.db}: search index optimized")
+        try:
+            check_index(conn)
+        except sqlite3.DatabaseError as e:
+            print(f"FAIL search index out of sync ({e}); run with --rebuild")
+            return 1
+        print(f"{args.db}: search index is in sync")
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
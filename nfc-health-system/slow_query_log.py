@@ -0,0 +1,154 @@
+import sys
+import json
+import time
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from flask import has_request_context, request
+
+import metrics
+
+# Structured log of statements slower than a threshold, one JSON object per
+# line. Entries carry the normalized SQL, the shape of each bound parameter
+# (type and length, never the value -- these are medical records), duration,
+# rows and the EXPLAIN QUERY PLAN output captured on the same connection.
+# Each statement fingerprint is logged at most once per LOG_INTERVAL; the
+# next entry reports how many were suppressed in between.
+
+THRESHOLD_MS = 100       # Statements at or above this are logged; negative disables
+LOG_INTERVAL = 60.0      # Seconds between entries for the same statement fingerprint
+LOG_PATH = None          # Append JSON lines here; None = stderr
+MAX_PARAM_SHAPES = 20    # Longer parameter lists are run-length collapsed, then truncated
+
+EXPLAINABLE = {'SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE'}
+
+threshold = THRESHOLD_MS / 1000.0   # Seconds; compared on every statement, so kept as a plain float
+interval = LOG_INTERVAL
+path = LOG_PATH
+
+_last = {}    # statement id -> [last logged (monotonic), suppressed since]
+_lock = threading.Lock()
+_write_lock = threading.Lock()
+
+
+def configure(threshold_ms=THRESHOLD_MS, log_interval=LOG_INTERVAL, log_path=LOG_PATH):
+    global threshold, interval, path
+    threshold = threshold_ms / 1000.0 if threshold_ms >= 0 else float('inf')
+    interval = log_interval
+    path = log_path
+    reset()
+
+
+def init_app(app):
+    configure(app.config.get('SLOW_QUERY_MS', THRESHOLD_MS),
+              app.config.get('SLOW_QUERY_LOG_INTERVAL', LOG_INTERVAL),
+              app.config.get('SLOW_QUERY_LOG') or None)
+
+
+def reset():
+    with _lock:
+        _last.clear()
+
+
+def param_shape(value):
+    if value is None:
+        return 'null'
+    if isinstance(value, (str, bytes)):
+        return f'{type(value).__name__}({len(value)})'
+    return type(value).__name__
+
+
+def param_shapes(params):
+    """Shapes of bound parameters; runs of the same shape become 'str(36) x500'."""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {name: param_shape(v) for name, v in params.items()}
+    shapes = []
+    for value in params:
+        shape = param_shape(value)
+        if shapes and shapes[-1][0] == shape:
+            shapes[-1][1] += 1
+        else:
+            shapes.append([shape, 1])
+    out = [shape if n == 1 else f'{shape} x{n}' for shape, n in shapes]
+    if len(out) > MAX_PARAM_SHAPES:
+        out = out[:MAX_PARAM_SHAPES] + [f'... {len(out) - MAX_PARAM_SHAPES} more']
+    return out
+
+
+def query_plan(conn, sql, params):
+    """EXPLAIN QUERY PLAN detail lines, on an unmetered cursor so it is never logged itself."""
+    cur = sqlite3.Cursor(conn)
+    try:
+        return [row[3] for row in cur.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+    finally:
+        cur.close()
+
+
+def _should_log(statement):
+    now = time.monotonic()
+    with _lock:
+        state = _last.get(statement)
+        if state is not None and now - state[0] < interval:
+            state[1] += 1
+            return None
+        suppressed = state[1] if state is not None else 0
+        _last[statement] = [now, 0]
+        return suppressed
+
+
+def record(conn, sql, params, seconds, rows=None, error=None, many=False):
+    """Called for a statement over the threshold. `params` is None when not inspectable."""
+    statement, op, table, normalized = metrics.fingerprint(sql)
+    metrics.SLOW_STATEMENTS.inc(1, statement, op, table)
+    suppressed = _should_log(statement)
+    if suppressed is None:
+        return
+
+    entry = {
+        'ts': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+        'event': 'slow_query',
+        'statement': statement,
+        'op': op,
+        'table': table,
+        'sql': normalized,
+        'params': param_shapes(params),
+        'duration_ms': round(seconds * 1000.0, 3),
+        'rows': rows,
+        'suppressed': suppressed,
+    }
+    if many:
+        entry['executemany'] = True
+    if error is not None:
+        entry['error'] = f'{type(error).__name__}: {error}'
+    route = _route()
+    if route:
+        entry['route'] = route
+
+    if op in EXPLAINABLE and params is not None and error is None:
+        try:
+            entry['plan'] = query_plan(conn, sql, params)
+        except sqlite3.Error as e:
+            entry['plan_error'] = str(e)
+    _write(entry)
+
+
+def _route():
+    if not has_request_context():
+        return None
+    # Route template, not the path: paths carry patient ids
+    return f"{request.method} {request.url_rule.rule if request.url_rule is not None else '<unmatched>'}"
+
+
+def _write(entry):
+    line = json.dumps(entry, default=str)
+    try:
+        with _write_lock:
+            if path:
+                with open(path, 'a') as f:
+                    f.write(line + '\n')
+            else:
+                print(line, file=sys.stderr)
+    except OSError as e:
+        print(f"Slow query log write failed: {e}")
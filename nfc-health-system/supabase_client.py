@@ -1,16 +1,21 @@
 import os
-from supabase import create_client, Client
 from dotenv import load_dotenv
 
 load_dotenv()
 
 url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
+# Server-side writes (sync) bypass RLS with the service role key
+service_role_key: str = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
 
-if not url or not key:
-    raise ValueError("Missing SUPABASE_URL or SUPABASE_KEY environment variables.")
+_supabase = None
 
-supabase: Client = create_client(url, key)
-
-def get_supabase_client() -> Client:
-    return supabase
+def get_supabase_client():
+    """supabase-py client (created on first use so REST-only callers don't need the package)."""
+    global _supabase
+    if _supabase is None:
+        if not url or not key:
+            raise ValueError("Missing SUPABASE_URL or SUPABASE_KEY environment variables.")
+        from supabase import create_client
+        _supabase = create_client(url, key)
+    return _supabase
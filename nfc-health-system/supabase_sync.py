@@ -0,0 +1,144 @@
+import os
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+import supabase_client
+
+MAX_BATCH = 500             # Rows per POST (PostgREST accepts a JSON array insert)
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10.0
+POOL_SIZE = 10              # Keep-alive connections held open to Supabase
+
+
+class SupabaseSyncError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class SyncMetrics:
+    """Running totals for pushes to Supabase (batch sizes, latency, failures)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.failures = 0
+            self.rows = 0
+            self.latency_total = 0.0
+            self.latency_max = 0.0
+            self.batch_max = 0
+            self.last_error = None
+
+    def record(self, batch_size, latency, error=None):
+        with self._lock:
+            self.requests += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            self.batch_max = max(self.batch_max, batch_size)
+            if error is None:
+                self.rows += batch_size
+            else:
+                self.failures += 1
+                self.last_error = str(error)[:200]
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'failures': self.failures,
+                'rows': self.rows,
+                'avg_batch_size': self.rows / max(self.requests - self.failures, 1),
+                'max_batch_size': self.batch_max,
+                'avg_latency_ms': 1000 * self.latency_total / max(self.requests, 1),
+                'max_latency_ms': 1000 * self.latency_max,
+                'last_error': self.last_error,
+            }
+
+
+class SupabaseRestClient:
+    """
+    Shared client for pushing rows to Supabase's REST API (/rest/v1/<table>).
+    One requests.Session with a keep-alive connection pool, so syncs reuse
+    TCP/TLS connections, and bulk array inserts of up to `max_batch` rows.
+    """
+
+    def __init__(self, url=None, service_key=None, max_batch=MAX_BATCH, pool_size=POOL_SIZE,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)):
+        self.url = (url or supabase_client.url or '').rstrip('/')
+        self.service_key = service_key or supabase_client.service_role_key
+        if not self.url or not self.service_key:
+            raise ValueError("Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY for Supabase sync.")
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.metrics = SyncMetrics()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            "apikey": self.service_key,
+            "Authorization": f"Bearer {self.service_key}",
+            "Content-Type": "application/json",
+        })
+
+    def _post(self, table, rows, prefer, params):
+        start = time.perf_counter()
+        try:
+            resp = self.session.post(f"{self.url}/rest/v1/{table}", json=rows, params=params,
+                                     headers={"Prefer": prefer}, timeout=self.timeout)
+            if not resp.ok:
+                raise SupabaseSyncError(f"Supabase {resp.status_code}: {resp.text[:200]}", resp.status_code)
+        except Exception as e:
+            self.metrics.record(len(rows), time.perf_counter() - start, error=e)
+            metrics.observe_sync(table, time.perf_counter() - start, len(rows), error=e)
+            if isinstance(e, SupabaseSyncError):
+                raise
+            raise SupabaseSyncError(f"Supabase request failed: {e}") from e
+        latency = time.perf_counter() - start
+        self.metrics.record(len(rows), latency)
+        metrics.observe_sync(table, latency, len(rows))
+
+    def insert(self, table, rows, upsert=False, on_conflict=None):
+        """
+        Insert `rows` (list of dicts with the same keys) in as few requests as
+        possible. Raises SupabaseSyncError on the first failed chunk; earlier
+        chunks stay written, so use upsert=True when retrying.
+        """
+        prefer = "return=minimal"
+        if upsert:
+            prefer += ",resolution=merge-duplicates"
+        params = {'on_conflict': on_conflict} if on_conflict else None
+
+        for i in range(0, len(rows), self.max_batch):
+            self._post(table, rows[i:i + self.max_batch], prefer, params)
+        return len(rows)
+
+    def upsert(self, table, rows, on_conflict=None):
+        return self.insert(table, rows, upsert=True, on_conflict=on_conflict)
+
+    def close(self):
+        self.session.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_sync_client(url=None, service_key=None):
+    """Process-wide client per (url, key); defaults come from supabase_client's environment config."""
+    cache_key = (url or supabase_client.url, service_key or supabase_client.service_role_key, os.getpid())
+    client = _clients.get(cache_key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(cache_key)
+            if client is None:
+                client = _clients[cache_key] = SupabaseRestClient(url, service_key)
+    return client
@@ -0,0 +1,248 @@
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import threading
+from database import get_pool, begin_immediate
+from supabase_sync import get_sync_client
+
+BATCH_SIZE = 100
+POLL_INTERVAL = 5.0      # Seconds between drains when idle
+CLAIM_TIMEOUT = 60.0     # A claimed batch is retried if its worker dies before finishing
+BACKOFF_BASE = 2.0       # Seconds; doubled per failed attempt
+BACKOFF_MAX = 900.0      # Seconds; longest wait between retries
+MAX_ATTEMPTS = 20        # Then the row is parked as 'dead' (about 4 hours of retries at the cap)
+
+# Statuses that condemn the rows sent: constraint violations, bad columns or values
+REJECTION_STATUSES = (400, 409, 422)
+# Statuses that say nothing about the rows (bad or rotated service key, wrong URL or table):
+# retried with backoff however long it takes to fix the configuration, never dead-lettered
+CONFIG_ERROR_STATUSES = (401, 403, 404)
+
+
+def enqueue(conn, target_table, row):
+    """
+    Queue `row` for Supabase. Call with the same connection (and inside the
+    same transaction) as the local insert so both commit or neither does.
+    """
+    conn.execute(
+        "INSERT INTO sync_outbox (target_table, row_id, payload) VALUES (?, ?, ?)",
+        (target_table, str(row.get('id')), json.dumps(row)))
+
+
+def backoff(attempts):
+    delay = min(BACKOFF_BASE * (2 ** max(attempts - 1, 0)), BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)  # Jitter so workers don't retry in lockstep
+
+
+def claim_batch(conn, batch_size=BATCH_SIZE, now=None):
+    """Atomically lease the next due rows so concurrent workers don't send them twice."""
+    now = now if now is not None else time.time()
+    with begin_immediate(conn):
+        rows = conn.execute("""
+            SELECT id, target_table, payload, attempts FROM sync_outbox
+            WHERE status = 'pending' AND next_attempt_at <= ?
+            ORDER BY next_attempt_at, id
+            LIMIT ?
+        """, (now, batch_size)).fetchall()
+        if rows:
+            conn.executemany("UPDATE sync_outbox SET next_attempt_at = ? WHERE id = ?",
+                             [(now + CLAIM_TIMEOUT, r['id']) for r in rows])
+    return rows
+
+
+def is_rejection(error):
+    """Supabase refused the rows themselves (FK violation, bad column or value), so retrying won't help."""
+    return getattr(error, 'status_code', None) in REJECTION_STATUSES
+
+
+def is_config_error(error):
+    return getattr(error, 'status_code', None) in CONFIG_ERROR_STATUSES
+
+
+def send_isolating(send, target_table, group):
+    """
+    Send `group`; if Supabase rejects it, bisect so the good rows still go
+    through. Returns (sent rows, [(row, error), ...] for rows that failed).
+    Transient failures (5xx, network) fail the whole group without splitting.
+    """
+    try:
+        send(target_table, [json.loads(r['payload']) for r in group])
+    except Exception as e:
+        if len(group) == 1 or not is_rejection(e):
+            return [], [(r, e) for r in group]
+        mid = len(group) // 2
+        sent_left, failed_left = send_isolating(send, target_table, group[:mid])
+        sent_right, failed_right = send_isolating(send, target_table, group[mid:])
+        return sent_left + sent_right, failed_left + failed_right
+    return group, []
+
+
+def drain_once(conn, send, batch_size=BATCH_SIZE, now=None):
+    """
+    Send one claimed batch, grouped by target table.
+    `send(target_table, rows)` raises on failure.
+    Returns (sent, failed) row counts; rows parked as dead count as failed.
+    """
+    rows = claim_batch(conn, batch_size, now)
+    groups = {}
+    for r in rows:
+        groups.setdefault(r['target_table'], []).append(r)
+
+    sent = failed = 0
+    for target_table, group in groups.items():
+        ok, failures = send_isolating(send, target_table, group)
+        retry_at = now if now is not None else time.time()
+        retries, dead = [], []
+        for r, e in failures:
+            if is_rejection(e) or (r['attempts'] + 1 >= MAX_ATTEMPTS and not is_config_error(e)):
+                dead.append((str(e)[:500], r['id']))
+            else:
+                retries.append((retry_at + backoff(r['attempts'] + 1), str(e)[:500], r['id']))
+        with begin_immediate(conn):
+            conn.executemany("DELETE FROM sync_outbox WHERE id = ?", [(r['id'],) for r in ok])
+            conn.executemany("""
+                UPDATE sync_outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ?
+                WHERE id = ?
+            """, retries)
+            conn.executemany("""
+                UPDATE sync_outbox SET attempts = attempts + 1, status = 'dead', last_error = ?
+                WHERE id = ?
+            """, dead)
+        if dead:
+            print(f"Supabase sync: {len(dead)} {target_table} row(s) moved to dead letter: {dead[0][0]}")
+        sent += len(ok)
+        failed += len(failures)
+    return sent, failed
+
+
+def pending_count(conn):
+    return conn.execute("SELECT COUNT(*) FROM sync_outbox WHERE status = 'pending'").fetchone()[0]
+
+
+def dead_count(conn):
+    return conn.execute("SELECT COUNT(*) FROM sync_outbox WHERE status = 'dead'").fetchone()[0]
+
+
+def requeue_dead(conn, ids=None, target_table=None):
+    """
+    Put dead rows (default: all; or these ids / this table) back in the queue
+    with a fresh attempt count, e.g. once the Supabase schema has been fixed.
+    Returns the number requeued.
+    """
+    sql = "UPDATE sync_outbox SET status = 'pending', attempts = 0, next_attempt_at = 0 WHERE status = 'dead'"
+    args = []
+    if ids:
+        sql += f" AND id IN ({', '.join('?' * len(ids))})"
+        args.extend(ids)
+    if target_table:
+        sql += " AND target_table = ?"
+        args.append(target_table)
+    with begin_immediate(conn):
+        return conn.execute(sql, args).rowcount
+
+
+class SyncWorker(threading.Thread):
+    """Background thread that drains the outbox to Supabase with retry/backoff."""
+
+    def __init__(self, db_path, client, batch_size=BATCH_SIZE, interval=POLL_INTERVAL):
+        super().__init__(name='supabase-sync', daemon=True)
+        self.db_path = db_path
+        self.client = client
+        self.batch_size = batch_size
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+
+    def send(self, target_table, rows):
+        # Upsert so a batch retried after a partial failure doesn't conflict
+        self.client.upsert(target_table, rows)
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wake.set()
+        self.join(timeout)
+
+    def run(self):
+        pool = get_pool(self.db_path)
+        while not self._stopping.is_set():
+            try:
+                with pool.connection() as conn:
+                    while not self._stopping.is_set():
+                        sent, failed = drain_once(conn, self.send, self.batch_size)
+                        # Keep going while full batches succeed; back off on failure
+                        if failed or sent < self.batch_size:
+                            break
+            except Exception as e:
+                print(f"Supabase Sync Worker Error: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def sync_enabled(app):
+    return bool(app.config.get('SUPABASE_URL') and app.config.get('SUPABASE_SERVICE_ROLE_KEY'))
+
+
+def ensure_worker(app):
+    """Start this process's sync worker (once, lazily so forked workers each get one)."""
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return _worker
+    if app.testing or not app.config.get('SYNC_WORKER_ENABLED') or not sync_enabled(app):
+        return None
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            with app.app_context():
+                db_path = app.config['DATABASE']
+                get_pool(db_path)  # Create the pool with the app's settings
+            client = get_sync_client(app.config['SUPABASE_URL'], app.config['SUPABASE_SERVICE_ROLE_KEY'])
+            _worker = SyncWorker(db_path, client,
+                                 batch_size=app.config.get('SYNC_BATCH_SIZE', BATCH_SIZE),
+                                 interval=app.config.get('SYNC_INTERVAL', POLL_INTERVAL))
+            _worker.start()
+    return _worker
+
+
+def notify():
+    """Wake the worker after a commit that enqueued rows."""
+    if _worker is not None:
+        _worker.wake()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect the Supabase outbox and replay dead-lettered rows.")
+    parser.add_argument('--db', default=os.environ.get('DATABASE', 'health_system.db'))
+    parser.add_argument('--requeue', action='store_true', help="Put dead rows back in the queue")
+    parser.add_argument('--id', type=int, action='append', help="Only these outbox ids (repeatable)")
+    parser.add_argument('--table', help="Only rows for this Supabase table")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        if args.requeue:
+            print(f"{requeue_dead(conn, args.id, args.table)} dead row(s) requeued")
+            return 0
+        print(f"{pending_count(conn)} pending, {dead_count(conn)} dead")
+        for r in conn.execute("""
+            SELECT id, target_table, row_id, attempts, last_error FROM sync_outbox
+            WHERE status = 'dead' ORDER BY id
+        """):
+            print(f"  dead #{r['id']} {r['target_table']}/{r['row_id']} after {r['attempts']} attempt(s): {r['last_error']}")
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
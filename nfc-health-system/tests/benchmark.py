@@ -0,0 +1,399 @@
+"""
+Load test / micro-benchmark for the Flask app (not collected by pytest).
+
+Seeds databases of several sizes (generate_data.py), then drives login, scan, record listing,
+add_record (syncing to a local Supabase stand-in) and generate_policy through
+the app at each concurrency level, reporting p50/p95/p99 latency and
+throughput and comparing them with a stored baseline.
+
+    python -m tests.benchmark                                   # small db, concurrency 1 and 8
+    python -m tests.benchmark --sizes small,medium --concurrency 1,4,16 --requests 400
+    python -m tests.benchmark --scenarios scan,records --json results.json
+    python -m tests.benchmark --save-baseline                   # record this machine's numbers
+
+Run from nfc-health-system/. Seeded databases are cached in --data-dir and
+copied before each run, so every run starts from the same data. The exit
+status is 1 if a result regressed past --tolerance against the baseline.
+"""
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import itertools
+import shutil
+import sqlite3
+import argparse
+import datetime
+import platform
+import tempfile
+import threading
+import contextlib
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import generate_data
+import migrations
+import qr_service
+import sync_outbox
+from app import app
+from supabase_sync import SupabaseRestClient
+from utils import tag_mac, SECRET_KEY
+from tests.supabase_stub import SupabaseStub
+
+# generate_data.generate() counts per size; record histories are skewed as in production
+SIZES = {
+    'tiny': {'hospitals': 3, 'insurers': 2, 'patients': 50, 'records': 150, 'policies': 60, 'pending': 10},
+    'small': generate_data.PRESETS['small'],
+    'medium': generate_data.PRESETS['medium'],
+    'large': generate_data.PRESETS['large'],
+}
+PASSWORD = 'bench-password'
+SCENARIOS = ('login', 'scan', 'scan_tag', 'records', 'add_record', 'generate_policy')
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+DATA_DIR = os.path.join(tempfile.gettempdir(), 'nfc-health-bench')
+TOLERANCE = 0.25          # Allowed fractional change vs baseline before a result counts as a regression
+WARMUP = 10               # Unmeasured requests per scenario (caches, pools, renderer processes)
+SYNC_DRAIN_TIMEOUT = 30.0
+
+TITLES = ('Blood pressure check', 'Annual physical', 'Chest X-ray', 'Lipid panel')
+
+
+# --- Seeding ---
+
+def seeded_database(size, data_dir=DATA_DIR):
+    """Path of the cached seed database for `size`, building it on first use."""
+    os.makedirs(data_dir, exist_ok=True)
+    # Payloads are encrypted with this machine's key and the schema moves with migrations
+    key_id = uuid.uuid5(uuid.NAMESPACE_OID, SECRET_KEY.decode() if isinstance(SECRET_KEY, bytes) else SECRET_KEY).hex[:8]
+    path = os.path.join(data_dir, f'{size}-v{migrations.latest_version()}-{key_id}.db')
+    if not os.path.exists(path):
+        print(f"Seeding {size} database ({SIZES[size]['patients']:,} patients, {SIZES[size]['records']:,} records)...")
+        start = time.perf_counter()
+        tmp_path = path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        generate_data.generate(tmp_path, password=PASSWORD, hash_method=app.config.get('PASSWORD_HASH_METHOD'),
+                               log=lambda *args: None, **SIZES[size])
+        os.replace(tmp_path, path)
+        print(f"  seeded in {time.perf_counter() - start:.1f}s")
+    return path
+
+
+def copy_database(src, dst):
+    source, target = sqlite3.connect(src), sqlite3.connect(dst)
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+        target.close()
+
+
+def load_context(path):
+    """Ids and payloads the scenarios pick from."""
+    conn = sqlite3.connect(path)
+    try:
+        return {
+            'patients': [r[0] for r in conn.execute("SELECT id FROM patients ORDER BY rowid")],
+            'qr_payloads': [r[0] for r in conn.execute("SELECT encrypted_payload FROM qr_records ORDER BY rowid")],
+            'tags': [r[0] for r in conn.execute("SELECT tag_id FROM nfc_records WHERE status = 'active' ORDER BY rowid")],
+            'hospitals': [r[0] for r in conn.execute("SELECT council_id FROM hospitals ORDER BY rowid")],
+            'hospital_id': conn.execute("SELECT id FROM hospitals ORDER BY rowid LIMIT 1").fetchone()[0],
+            'insurer_id': conn.execute("SELECT id FROM insurance_companies ORDER BY rowid LIMIT 1").fetchone()[0],
+        }
+    finally:
+        conn.close()
+
+
+# --- Scenarios: (role to log the client in as, request function) ---
+
+def _login(client, ctx, rng, n):
+    return client.post('/api/auth/login', json={'council_id': rng.choice(ctx['hospitals']), 'password': PASSWORD})
+
+
+def _scan(client, ctx, rng, n):
+    return client.post('/api/patient/scan', json={'data': rng.choice(ctx['qr_payloads'])})
+
+
+def _scan_tag(client, ctx, rng, n):
+    tag = rng.choice(ctx['tags'])
+    return client.post('/api/patient/scan', json={'tag_id': tag, 'mac': tag_mac(tag)})
+
+
+def _records(client, ctx, rng, n):
+    return client.get(f"/api/patient/{rng.choice(ctx['patients'])}/records?limit=20")
+
+
+def _add_record(client, ctx, rng, n):
+    return client.post(f"/api/patient/{rng.choice(ctx['patients'])}/add",
+                       json={'summary': rng.choice(TITLES), 'data_payload': 'Benchmark vitals: BP 120/80'})
+
+
+def _generate_policy(client, ctx, rng, n):
+    # Alternate existing patients with new ones (auto-registered, placeholder record + pending request)
+    if n % 2:
+        patient = rng.choice(ctx['patients'])
+    else:
+        patient = f"new-{ctx['run_id']}-{n}@bench.test"
+    return client.post('/insurance/policies/create', data={
+        'patient_email': patient, 'policy_number': f"BENCH-{ctx['run_id']}-{n}",
+        'coverage_amount': '50000', 'valid_until': '2030-12-31'})
+
+
+SCENARIO_FUNCS = {
+    'login': (None, _login),
+    'scan': ('hospital', _scan),
+    'scan_tag': ('hospital', _scan_tag),
+    'records': ('hospital', _records),
+    'add_record': ('hospital', _add_record),
+    'generate_policy': ('insurance', _generate_policy),
+}
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def _client(role, ctx):
+    client = app.test_client()
+    if role:
+        with client.session_transaction() as sess:
+            sess['user_id'] = ctx['hospital_id'] if role == 'hospital' else ctx['insurer_id']
+            sess['role'] = role
+    return client
+
+
+def run_scenario(name, ctx, concurrency, requests, warmup=WARMUP, seed=0):
+    """
+    `requests` calls spread over `concurrency` threads, each with its own
+    client. Returns latency percentiles (ms), throughput and the error count.
+    """
+    role, func = SCENARIO_FUNCS[name]
+    next_n = ctx['counter'].__next__   # Shared across runs so generated policy numbers never repeat
+    warm = _client(role, ctx)
+    warm_rng = random.Random(seed - 1)
+    for _ in range(warmup):
+        func(warm, ctx, warm_rng, next_n())
+
+    per_thread = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    barrier = threading.Barrier(concurrency + 1)
+
+    def worker(i):
+        client, rng = _client(role, ctx), random.Random(seed * 1000 + i)
+        barrier.wait()
+        for _ in range(per_thread[i]):
+            n = next_n()
+            start = time.perf_counter()
+            resp = func(client, ctx, rng, n)
+            latencies[i].append(time.perf_counter() - start)
+            if resp.status_code >= 400:
+                errors[i] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    values = sorted(v for lat in latencies for v in lat)
+    return {
+        'requests': len(values),
+        'errors': sum(errors),
+        'seconds': round(elapsed, 3),
+        'rps': round(len(values) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(values, 50) * 1000, 2),
+        'p95_ms': round(percentile(values, 95) * 1000, 2),
+        'p99_ms': round(percentile(values, 99) * 1000, 2),
+    }
+
+
+@contextlib.contextmanager
+def _app_config(**settings):
+    saved = {k: app.config.get(k) for k in settings}
+    app.config.update(settings)
+    try:
+        yield
+    finally:
+        app.config.update(saved)
+
+
+def _wait_for_sync(db_path, timeout=SYNC_DRAIN_TIMEOUT):
+    """Seconds until the outbox emptied, or None if it didn't within `timeout`."""
+    start = time.perf_counter()
+    with database.get_pool(db_path).connection() as conn:
+        while time.perf_counter() - start < timeout:
+            if sync_outbox.pending_count(conn) == 0:
+                return round(time.perf_counter() - start, 3)
+            time.sleep(0.05)
+    return None
+
+
+def run_size(size, scenarios, concurrency_levels, requests, data_dir=DATA_DIR, warmup=WARMUP,
+             supabase_delay=0.0, qr_workers=None):
+    """Run every scenario at every concurrency level against a fresh copy of the `size` database."""
+    seed_path = seeded_database(size, data_dir)
+    work_dir = tempfile.mkdtemp(prefix=f'bench-{size}-')
+    db_path = os.path.join(work_dir, 'bench.db')
+    copy_database(seed_path, db_path)
+    ctx = load_context(db_path)
+    ctx['run_id'] = uuid.uuid4().hex[:8]
+    ctx['counter'] = itertools.count()
+
+    stub = SupabaseStub(delay=supabase_delay).start()
+    settings = {
+        'TESTING': True,
+        'DATABASE': db_path,
+        'SUPABASE_URL': stub.url,
+        'SUPABASE_SERVICE_ROLE_KEY': 'bench-key',
+        'QR_CACHE_DIR': os.path.join(work_dir, 'qr_cache'),
+        'PATIENT_CACHE_PATH': os.path.join(work_dir, 'patient_cache.db'),
+    }
+    if qr_workers is not None:
+        settings['QR_RENDER_WORKERS'] = qr_workers
+    worker = None
+    results = []
+    try:
+        with _app_config(**settings):
+            worker = sync_outbox.SyncWorker(db_path, SupabaseRestClient(stub.url, 'bench-key'), interval=0.05)
+            worker.start()
+            for name in scenarios:
+                for concurrency in concurrency_levels:
+                    result = run_scenario(name, ctx, concurrency, requests, warmup)
+                    result.update(size=size, scenario=name, concurrency=concurrency)
+                    if name == 'add_record':
+                        result['sync_drain_seconds'] = _wait_for_sync(db_path)
+                    results.append(result)
+                    print(format_result(result))
+    finally:
+        if worker is not None:
+            worker.stop(timeout=5)
+        stub.stop()
+        qr_service.shutdown_renderers()
+        database.close_pools()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+# --- Reporting and baseline comparison ---
+
+def result_key(result):
+    return f"{result['size']}/{result['scenario']}/c{result['concurrency']}"
+
+
+HEADER = f"{'size':<8} {'scenario':<16} {'conc':>4} {'reqs':>6} {'err':>4} {'req/s':>9} " \
+         f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+
+
+def format_result(result):
+    return (f"{result['size']:<8} {result['scenario']:<16} {result['concurrency']:>4} {result['requests']:>6} "
+            f"{result['errors']:>4} {result['rps']:>9} {result['p50_ms']:>8} {result['p95_ms']:>8} "
+            f"{result['p99_ms']:>8}")
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Results worse than the baseline by more than `tolerance`: throughput below
+    (1 - tolerance) x baseline or p95 above (1 + tolerance) x baseline.
+    Returns [(key, message)]; results with no baseline entry are skipped.
+    """
+    regressions = []
+    for result in results:
+        base = baseline.get(result_key(result))
+        if not base:
+            continue
+        if base.get('rps') and result['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append((result_key(result), f"throughput {result['rps']} req/s < baseline {base['rps']}"))
+        if base.get('p95_ms') and result['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append((result_key(result), f"p95 {result['p95_ms']} ms > baseline {base['p95_ms']}"))
+        if result['errors'] > base.get('errors', 0):
+            regressions.append((result_key(result), f"{result['errors']} errors (baseline {base.get('errors', 0)})"))
+    return regressions
+
+
+def load_baseline(path=BASELINE_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f).get('results', {})
+
+
+def save_baseline(results, path=BASELINE_FILE):
+    """Merge `results` into the baseline file (other sizes/scenarios are kept)."""
+    data = {'results': {}}
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            data = json.load(f)
+    data['recorded'] = {'date': datetime.date.today().isoformat(), 'python': platform.python_version(),
+                        'machine': f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs"}
+    for result in results:
+        data['results'][result_key(result)] = {k: result[k] for k in ('rps', 'p50_ms', 'p95_ms', 'p99_ms', 'errors')}
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def _csv(value):
+    return [v.strip() for v in value.split(',') if v.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the app and compare with a stored baseline.")
+    parser.add_argument('--sizes', type=_csv, default=['small'], help=f"Comma-separated: {', '.join(SIZES)}")
+    parser.add_argument('--scenarios', type=_csv, default=list(SCENARIOS), help=f"Comma-separated: {', '.join(SCENARIOS)}")
+    parser.add_argument('--concurrency', type=_csv, default=['1', '8'], help="Comma-separated thread counts")
+    parser.add_argument('--requests', type=int, default=200, help="Measured requests per scenario and concurrency level")
+    parser.add_argument('--warmup', type=int, default=WARMUP)
+    parser.add_argument('--data-dir', default=DATA_DIR, help="Where seeded databases are cached")
+    parser.add_argument('--supabase-delay', type=float, default=0.0, help="Seconds of latency added by the Supabase stub")
+    parser.add_argument('--qr-workers', type=int, default=None, help="QR render processes (default: app setting)")
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--no-baseline', action='store_true', help="Don't compare against the baseline")
+    parser.add_argument('--save-baseline', action='store_true', help="Write these results into the baseline file")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--json', help="Also write the raw results to this file")
+    args = parser.parse_args(argv)
+
+    unknown = [s for s in args.sizes if s not in SIZES] + [s for s in args.scenarios if s not in SCENARIO_FUNCS]
+    if unknown:
+        parser.error(f"unknown size/scenario: {', '.join(unknown)}")
+    concurrency_levels = [int(c) for c in args.concurrency]
+
+    print(HEADER)
+    results = []
+    for size in args.sizes:
+        results.extend(run_size(size, args.scenarios, concurrency_levels, args.requests, args.data_dir,
+                                args.warmup, args.supabase_delay, args.qr_workers))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    if args.no_baseline:
+        return 0
+
+    regressions = compare(results, load_baseline(args.baseline), args.tolerance)
+    for key, message in regressions:
+        print(f"REGRESSION {key}: {message}")
+    if regressions:
+        return 1
+    print("No regressions against baseline" if load_baseline(args.baseline) else "No baseline to compare against")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class SupabaseStub:
+    """
+    Local stand-in for Supabase's REST endpoint (/rest/v1/<table>).
+    Records every accepted row; `fail_next` requests answer `fail_status`
+    (503, or e.g. 401 for a bad service key),
+    a batch holding any row matching `reject_if` answers 409 (like a
+    PostgREST constraint violation) and `delay` adds latency to each request.
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.fail_next = 0
+        self.fail_status = 503
+        self.reject_if = None
+        self.rows = {}        # table -> [row, ...]
+        self.requests = []    # (table, batch size, headers)
+        self.client_ports = set()  # One per TCP connection the client opened
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                stub.client_ports.add(self.client_address[1])
+                if stub.delay:
+                    time.sleep(stub.delay)
+                table = self.path.split('/rest/v1/', 1)[-1].split('?')[0]
+                with stub._lock:
+                    failing = stub.fail_next > 0
+                    if failing:
+                        stub.fail_next -= 1
+                if failing:
+                    self._reply(stub.fail_status, b'{"message": "unavailable"}')
+                    return
+                rows = json.loads(body)
+                rows = rows if isinstance(rows, list) else [rows]
+                if stub.reject_if and any(stub.reject_if(r) for r in rows):
+                    self._reply(409, b'{"code": "23503", "message": "violates foreign key constraint"}')
+                    return
+                with stub._lock:
+                    stub.rows.setdefault(table, []).extend(rows)
+                    stub.requests.append((table, len(rows), dict(self.headers)))
+                self._reply(201, b'')
+
+            def _reply(self, status, body):
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
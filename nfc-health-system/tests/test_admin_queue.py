@@ -0,0 +1,263 @@
+import unittest
+import io
+import os
+import re
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+import threading
+from unittest import mock
+
+# Add parent directory to path to import app correctly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import admin_queue
+from app import app
+
+
+class QueueTestBase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        app.config['TESTING'] = True
+        app.config['DATABASE'] = os.path.join(self.tmp_dir, 'test.db')
+
+        conn = sqlite3.connect(app.config['DATABASE'])
+        with open('schema.sql', 'r') as f:
+            conn.executescript(f.read())
+        conn.execute("INSERT INTO insurance_companies (id, name, license_number, email, password_hash) VALUES ('ins1', 'INS1', 'LIC-1', 'ins1@test.com', 'x')")
+        for i in range(30):
+            conn.execute("INSERT INTO patients (id, full_name, dob) VALUES (?, ?, '1980-01-01')", (f'p{i:02d}', f'Patient {i}'))
+            conn.execute("INSERT INTO policies (id, patient_id, provider_id, policy_number, coverage_amount) VALUES (?, ?, 'ins1', ?, 5)",
+                         (f'pol{i:02d}', f'p{i:02d}', f'N-{i}'))
+            conn.execute("INSERT INTO pending_medical_data_requests (id, policy_id, patient_id, created_at) VALUES (?, ?, ?, ?)",
+                         (f'r{i:02d}', f'pol{i:02d}', f'p{i:02d}', f'2024-01-01 00:{i:02d}:00'))
+        conn.commit()
+        conn.close()
+
+        self.pool = database.get_pool(app.config['DATABASE'])
+        self.client = app.test_client()
+        self.login('a1')
+
+    def tearDown(self):
+        database.close_pools()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def login(self, admin_id):
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = admin_id
+            sess['role'] = 'admin'
+
+
+class AdminQueueTestCase(QueueTestBase):
+
+    def test_concurrent_claims_are_disjoint(self):
+        claimed, errors = {}, []
+
+        def worker(admin_id):
+            try:
+                with self.pool.connection() as conn:
+                    claimed[admin_id] = admin_queue.claim_next(conn, admin_id, 10)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(f'a{i}',)) for i in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        everything = sorted(i for ids in claimed.values() for i in ids)
+        self.assertEqual(everything, [f'r{i:02d}' for i in range(30)])
+
+        with self.pool.connection() as conn:
+            self.assertEqual(admin_queue.claim_next(conn, 'a9', 5), [])
+
+    def test_expired_leases_return_to_the_queue(self):
+        now = time.time()
+        with self.pool.connection() as conn:
+            self.assertEqual(admin_queue.claim_next(conn, 'a1', 2, lease_seconds=60, now=now), ['r00', 'r01'])
+            self.assertEqual(admin_queue.claim_next(conn, 'a2', 1, now=now), ['r02'])
+            # a1 walked away: after the lease runs out a2 picks their requests up first
+            self.assertEqual(admin_queue.claim_next(conn, 'a2', 2, now=now + 61), ['r00', 'r01'])
+
+            # Claiming also clears lapsed leases, so they stop naming the admin who let them go
+            self.assertEqual(admin_queue.claim_next(conn, 'a3', 1, now=now + 10 ** 6), ['r00'])
+            held = conn.execute("SELECT id, claimed_by FROM pending_medical_data_requests WHERE claimed_by IS NOT NULL").fetchall()
+            self.assertEqual([tuple(r) for r in held], [('r00', 'a3')])
+
+    def test_entry_is_leased_and_completed_once(self):
+        resp = self.client.get('/admin/medical-entry/r05')
+        self.assertEqual(resp.status_code, 200)
+
+        self.login('a2')
+        self.assertEqual(self.client.get('/admin/medical-entry/r05').status_code, 409)
+        resp = self.client.post('/api/admin/queue/r05/complete', json={'title': 'T', 'description': 'D'})
+        self.assertEqual(resp.status_code, 409)
+        self.assertIn('claimed by another admin', resp.get_json()['error'])
+
+        self.login('a1')
+        resp = self.client.post('/admin/medical-entry/r05', data={'title': 'Intake', 'description': 'Healthy'})
+        self.assertEqual(resp.status_code, 302)
+        resp = self.client.post('/api/admin/queue/r05/complete', json={'title': 'T', 'description': 'D'})
+        self.assertEqual(resp.status_code, 409)
+        self.assertIn('already completed', resp.get_json()['error'])
+        self.assertEqual(self.client.post('/api/admin/queue/nope/complete', json={'title': 'T', 'description': 'D'}).status_code, 404)
+
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT * FROM pending_medical_data_requests WHERE id = 'r05'").fetchone()
+            self.assertEqual((row['status'], row['completed_by'], row['claimed_by']), ('completed', 'a1', None))
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM medical_records WHERE patient_id = 'p05'").fetchone()[0], 1)
+
+    def test_entry_form_is_validated(self):
+        self.assertEqual(self.client.get('/admin/medical-entry/r05').status_code, 200)
+        for form, error in [({'title': ' ', 'description': 'Healthy'}, b'title and description are required'),
+                            ({'title': 'Intake'}, b'title and description are required'),
+                            ({'title': 'Intake', 'description': 'Healthy', 'record_type': 'xray'}, b'record_type must be one of')]:
+            resp = self.client.post('/admin/medical-entry/r05', data=form)
+            self.assertEqual(resp.status_code, 400, form)
+            self.assertIn(error, resp.data)
+            self.assertIn(f'value="{form["title"]}"'.encode(), resp.data)   # What was typed is kept
+
+        resp = self.client.post('/admin/medical-entry/r05', data={'title': 'Bloods', 'description': 'Normal',
+                                                                  'record_type': 'lab_result'})
+        self.assertEqual(resp.status_code, 302)
+        resp = self.client.post('/api/admin/queue/r06/complete', json={'title': 'T', 'description': 'D', 'record_type': 'xray'})
+        self.assertEqual(resp.status_code, 400)
+        with self.pool.connection() as conn:
+            rows = conn.execute("SELECT patient_id, record_type, title FROM medical_records").fetchall()
+            status = conn.execute("SELECT status FROM pending_medical_data_requests WHERE id = 'r06'").fetchone()[0]
+        self.assertEqual([tuple(r) for r in rows], [('p05', 'lab_result', 'Bloods')])
+        self.assertEqual(status, 'pending')
+
+    def test_api_claim_release_page_and_stats(self):
+        claimed = self.client.post('/api/admin/queue/claim', json={'count': 3}).get_json()['claimed']
+        self.assertEqual(claimed, ['r00', 'r01', 'r02'])
+
+        mine = self.client.get('/api/admin/queue?mine=1').get_json()
+        self.assertEqual([r['id'] for r in mine['requests']], claimed)
+        self.assertEqual({r['lease'] for r in mine['requests']}, {'mine'})
+
+        ids, cursor = [], None
+        while True:
+            page = self.client.get('/api/admin/queue?limit=8' + (f'&cursor={cursor}' if cursor else '')).get_json()
+            ids.extend(r['id'] for r in page['requests'])
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(ids, [f'r{i:02d}' for i in range(30)])
+
+        self.client.post('/api/admin/queue/r00/complete', json={'title': 'T', 'description': 'D'})
+        stats = self.client.get('/api/admin/queue/stats').get_json()
+        self.assertEqual((stats['pending'], stats['leased'], stats['available']), (29, 2, 27))
+        self.assertEqual((stats['completed_last_hour'], stats['completed_last_day']), (1, 1))
+        self.assertEqual(stats['oldest_pending_at'], '2024-01-01 00:01:00')
+
+        self.assertEqual(self.client.post('/api/admin/queue/release', json={}).get_json()['released'], 2)
+        self.assertEqual(self.client.get('/api/admin/queue?mine=1').get_json()['requests'], [])
+
+    def test_dashboard_pages_and_claims(self):
+        resp = self.client.get('/admin/dashboard')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b'Next page', resp.data)
+        self.assertIn(b'Patient 24', resp.data)
+        self.assertNotIn(b'Patient 25', resp.data)
+
+        resp = self.client.post('/admin/queue/claim', data={'count': '2'})
+        self.assertEqual(resp.status_code, 302)
+        resp = self.client.get('/admin/dashboard?mine=1')
+        self.assertIn(b'Claimed by you', resp.data)
+        self.assertEqual(set(re.findall(rb'/admin/medical-entry/(\w+)', resp.data)), {b'r00', b'r01'})
+        self.assertEqual(self.client.get('/admin/dashboard?cursor=bad').status_code, 400)
+
+
+class AdminBulkCompletionTestCase(QueueTestBase):
+
+    def setUp(self):
+        super().setUp()
+        app.config['ADMIN_BULK_CHUNK_SIZE'] = 4
+
+    def tearDown(self):
+        app.config['ADMIN_BULK_CHUNK_SIZE'] = admin_queue.BULK_CHUNK_SIZE
+        super().tearDown()
+
+    def count_records(self):
+        with self.pool.connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM medical_records").fetchone()[0]
+
+    def test_csv_upload_reports_per_row_outcomes(self):
+        with self.pool.connection() as conn:
+            admin_queue.complete(conn, 'r00', 'a1', 'Done', 'Earlier')
+            admin_queue.claim(conn, 'r01', 'a2')
+            admin_queue.claim(conn, 'r02', 'a1')  # Own lease is fine
+        lines = ['request_id,title,description,record_type']
+        lines += [f'r{i:02d},Intake,Imported history {i},' for i in range(2, 22)]
+        lines += ['r03,Intake,Again,',                # duplicate in file
+                  'r00,Intake,Done already,',         # completed
+                  'r01,Intake,Leased to a2,',         # claimed by another admin
+                  'missing,Intake,No such request,',
+                  'r22,Intake,Bad type,xray',
+                  'r23,,No title,']
+        resp = self.client.post('/api/admin/queue/complete', data='\n'.join(lines), content_type='text/csv')
+        self.assertEqual(resp.status_code, 200)
+        report = resp.get_json()
+
+        self.assertEqual((report['total'], report['completed'], report['failed']), (26, 20, 6))
+        self.assertEqual([e['row'] for e in report['errors']], list(range(21, 27)))
+        self.assertIn('Duplicate', report['errors'][0]['error'])
+        self.assertIn('already completed', report['errors'][1]['error'])
+        self.assertIn('claimed by another admin', report['errors'][2]['error'])
+        self.assertEqual(report['errors'][3]['error'], 'Request not found')
+        self.assertIn('record_type', report['errors'][4]['error'])
+        self.assertIn('required', report['errors'][5]['error'])
+
+        self.assertEqual(self.count_records(), 21)
+        stats = self.client.get('/api/admin/queue/stats').get_json()
+        self.assertEqual(stats['pending'], 9)
+        self.assertEqual(stats['completed_last_hour'], 21)
+
+    def test_request_taken_between_validation_and_write(self):
+        real = admin_queue._request_states
+        calls = []
+
+        def racing(conn, ids, admin_id, now):
+            calls.append(len(ids))
+            states = real(conn, ids, admin_id, now)
+            if len(calls) == 1:
+                # Another admin completes r01 right after the up-front check
+                with self.pool.connection() as other:
+                    admin_queue.complete(other, 'r01', 'a2', 'Theirs', 'x')
+            return states
+
+        rows = [{'request_id': f'r{i:02d}', 'title': 'T', 'description': 'D'} for i in range(6)]
+        with mock.patch('admin_queue._request_states', side_effect=racing), self.pool.connection() as conn:
+            report = admin_queue.bulk_complete(conn, 'a1', rows, chunk_size=4)
+        # One up-front query for all rows, then one re-check per chunk
+        self.assertEqual(calls, [6, 4, 2])
+        self.assertEqual((report['completed'], report['failed']), (5, 1))
+        self.assertEqual(report['errors'][0]['request_id'], 'r01')
+        self.assertEqual(self.count_records(), 6)
+
+    def test_jsonl_upload_from_dashboard(self):
+        body = '\n'.join('{"request_id": "r%02d", "title": "T", "description": "D", "record_type": "lab_result"}' % i
+                         for i in range(3)) + '\n{broken'
+        resp = self.client.post('/admin/queue/complete', content_type='multipart/form-data',
+                                data={'file': (io.BytesIO(body.encode()), 'entries.jsonl')})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b'<strong>3</strong> of 4 requests completed', resp.data)
+        self.assertIn(b'Invalid JSON on line 4', resp.data)
+        with self.pool.connection() as conn:
+            types = {r[0] for r in conn.execute("SELECT record_type FROM medical_records")}
+        self.assertEqual(types, {'lab_result'})
+
+        self.login('h1')
+        with self.client.session_transaction() as sess:
+            sess['role'] = 'hospital'
+        self.assertEqual(self.client.post('/api/admin/queue/complete', json=[]).status_code, 401)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,262 @@
+import unittest
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import sqlite3
+import tempfile
+import threading
+
+# Add parent directory to path to import app correctly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asgi
+import database
+import scan_service
+from app import app
+from utils import encrypt_data
+
+
+async def call(application, method, path, body=b'', headers=(), query=b''):
+    """One request through an ASGI app -> (status, headers dict, body, number of body messages)."""
+    if isinstance(body, (dict, list)):
+        body = json.dumps(body).encode()
+        headers = [('content-type', 'application/json'), *headers]
+    scope = {'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http',
+             'path': path, 'root_path': '', 'query_string': query,
+             'headers': [(k.encode('latin-1'), v.encode('latin-1')) for k, v in headers],
+             'server': ('testserver', 80), 'client': ('127.0.0.1', 50000)}
+    sent = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    messages = []
+
+    async def receive():
+        return sent.pop(0) if sent else {'type': 'http.disconnect'}
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    start = messages[0]
+    chunks = [m['body'] for m in messages[1:] if m.get('body')]
+    return start['status'], {k.decode(): v.decode() for k, v in start['headers']}, b''.join(chunks), len(chunks)
+
+
+def slow_app(delay, tracker):
+    """Plain WSGI app that records how many calls overlap."""
+    lock = threading.Lock()
+
+    def application(environ, start_response):
+        with lock:
+            tracker['now'] += 1
+            tracker['max'] = max(tracker['max'], tracker['now'])
+        time.sleep(delay)
+        with lock:
+            tracker['now'] -= 1
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [environ['PATH_INFO'].encode()]
+    return application
+
+
+class AsgiTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        app.config['TESTING'] = True
+        app.config['DATABASE'] = os.path.join(self.tmp_dir, 'test.db')
+
+        self.payload = encrypt_data({'pid': 'p1', 'type': 'nfc_access'})
+        conn = sqlite3.connect(app.config['DATABASE'])
+        with open('schema.sql', 'r') as f:
+            conn.executescript(f.read())
+        conn.execute("INSERT INTO hospitals (id, name, council_id, email, password_hash) VALUES ('h1', 'Apollo', 'C1', 'a@h.com', 'x')")
+        conn.execute("INSERT INTO patients (id, full_name, dob) VALUES ('p1', 'Patient One', '1990-01-01')")
+        conn.execute("INSERT INTO nfc_records (id, patient_id, tag_id, encrypted_payload) VALUES ('n1', 'p1', 'TAG1', ?)",
+                     (self.payload,))
+        for n in range(30):
+            conn.execute("""INSERT INTO medical_records (id, patient_id, hospital_id, record_type, title, created_at)
+                            VALUES (?, 'p1', 'h1', 'text', ?, datetime('2025-01-01', ?))""", (f'r{n:02}', f'Visit {n}', f'+{n} days'))
+        conn.commit()
+        conn.close()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = 'h1'
+            sess['role'] = 'hospital'
+        self.cookie = [('cookie', f"session={self.client.get_cookie('session').value}")]
+        self.application = asgi.AsyncAPI(app, concurrency=8)
+
+    def tearDown(self):
+        scan_service._caches.clear()
+        database.close_pools()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_responses_match_the_sync_app(self):
+        checks = [
+            ('POST', '/api/patient/scan', {'data': self.payload}, b''),
+            ('POST', '/api/patient/scan', {'data': 'nonsense'}, b''),
+            ('GET', '/api/patient/p1/records', b'', b'limit=5&fields=id,title'),
+            ('GET', '/api/patient/p1/summary', b'', b''),
+            ('GET', '/api/patient/nobody/records', b'', b'limit=abc'),
+        ]
+        for method, path, body, query in checks:
+            status, headers, text, _ = asyncio.run(call(self.application, method, path, body, self.cookie, query))
+            expected = self.client.open(path, method=method, json=body or None, query_string=query.decode())
+            self.assertEqual(status, expected.status_code, path)
+            self.assertEqual(json.loads(text), expected.get_json(), path)
+            self.assertEqual(headers['content-type'], expected.content_type)
+
+        status, _, _, _ = asyncio.run(call(self.application, 'GET', '/api/patient/p1/records'))
+        self.assertEqual(status, 401)   # No session cookie
+
+    def test_only_api_routes_are_served(self):
+        for path in ('/hospital/dashboard', '/login', '/apiary', '/qr/q1'):
+            status, _, body, _ = asyncio.run(call(self.application, 'GET', path, headers=self.cookie))
+            self.assertEqual((status, json.loads(body)), (404, {'error': 'Only /api routes are served here'}), path)
+        self.assertEqual(self.application.stats()['admitted'], 0)
+
+    def test_concurrency_defaults_to_the_write_pool_size(self):
+        self.assertEqual(app.config['API_CONCURRENCY'], app.config['DB_POOL_SIZE'])
+        self.assertEqual(asgi.create_app(app).concurrency, app.config['DB_POOL_SIZE'])
+
+    def test_record_write_and_streamed_read(self):
+        status, _, text, _ = asyncio.run(call(self.application, 'POST', '/api/patient/p1/add',
+                                              {'data_payload': 'BP 120/80', 'summary': 'Checkup'}, self.cookie))
+        self.assertEqual((status, json.loads(text)['message']), (201, 'Record saved and synced.'))
+
+        status, _, text, chunks = asyncio.run(call(self.application, 'GET', '/api/patient/p1/records',
+                                                   headers=self.cookie, query=b'stream=1'))
+        self.assertEqual(status, 200)
+        records = json.loads(text)
+        self.assertEqual(len(records), 31)
+        self.assertEqual(records, self.client.get('/api/patient/p1/records').get_json())
+        self.assertGreater(chunks, 1)   # Sent as the view produced it, not buffered whole
+
+    def test_hundreds_of_concurrent_scans(self):
+        async def burst():
+            return await asyncio.gather(*[
+                call(self.application, 'POST', '/api/patient/scan', {'data': self.payload}, self.cookie)
+                for _ in range(300)])
+        results = asyncio.run(burst())
+        self.assertEqual({status for status, _, _, _ in results}, {200})
+        self.assertEqual({json.loads(body)['patient_id'] for _, _, body, _ in results}, {'p1'})
+        stats = self.application.stats()
+        self.assertEqual((stats['admitted'], stats['active'], stats['waiting'], stats['rejected']), (300, 0, 0, 0))
+
+    def test_concurrency_is_bounded_and_queue_times_out(self):
+        tracker = {'now': 0, 'max': 0}
+        bounded = asgi.AsyncAPI(slow_app(0.05, tracker), concurrency=3)
+
+        async def burst(application, n):
+            return await asyncio.gather(*[call(application, 'GET', f'/api/item/{i}') for i in range(n)])
+        results = asyncio.run(burst(bounded, 12))
+        self.assertEqual([body for _, _, body, _ in results], [f'/api/item/{i}'.encode() for i in range(12)])
+        self.assertEqual(tracker['max'], 3)
+
+        impatient = asgi.AsyncAPI(slow_app(0.3, {'now': 0, 'max': 0}), concurrency=1, queue_timeout=0.05)
+        statuses = sorted(status for status, _, _, _ in asyncio.run(burst(impatient, 2)))
+        self.assertEqual(statuses, [200, 503])
+        self.assertEqual(impatient.stats()['rejected'], 1)
+
+    def test_client_disconnect_mid_stream_frees_the_slot(self):
+        produced = []
+
+        def endless(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            for n in range(2000):
+                produced.append(n)
+                yield b'x' * 100
+
+        application = asgi.AsyncAPI(endless, concurrency=1)
+
+        async def hang_up():
+            sent = []
+
+            async def send(message):
+                sent.append(message)
+                if len(sent) == 3:
+                    raise OSError("client went away")
+
+            async def receive():
+                return {'type': 'http.request', 'body': b''}
+
+            with self.assertRaises(OSError):
+                await application({'type': 'http', 'method': 'GET', 'path': '/api/stream'}, receive, send)
+            stopped_at = len(produced)
+            # The slot is free again for the next request
+            return stopped_at, await call(application, 'GET', '/api/stream')
+        stopped_at, (status, _, _, _) = asyncio.run(hang_up())
+        self.assertLess(stopped_at, 2000)   # The view stopped producing once the client was gone
+        self.assertEqual(status, 200)
+        self.assertEqual(application.stats()['active'], 0)
+
+    def test_body_limit_and_early_disconnect(self):
+        seen = []
+
+        def echo(environ, start_response):
+            seen.append((environ.get('CONTENT_LENGTH'), environ['wsgi.input'].read()))
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [b'ok']
+
+        application = asgi.AsyncAPI(echo, concurrency=1, max_body=10)
+
+        async def request(messages, headers=()):
+            sent = []
+
+            async def receive():
+                return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+            await application({'type': 'http', 'method': 'POST', 'path': '/api/echo', 'headers': list(headers)}, receive, send)
+            return sent
+
+        # Declared too large: refused before taking a slot or reading anything
+        sent = asyncio.run(request([], [(b'content-length', b'100')]))
+        self.assertEqual(sent[0]['status'], 413)
+        # Chunked past the limit: refused while reading
+        chunk = {'type': 'http.request', 'body': b'x' * 8, 'more_body': True}
+        sent = asyncio.run(request([chunk, dict(chunk)]))
+        self.assertEqual(sent[0]['status'], 413)
+        # Hung up mid-body: nothing sent, no view run
+        self.assertEqual(asyncio.run(request([chunk])), [])
+        self.assertEqual(seen, [])
+
+        # A chunked body within the limit reaches the view whole, with its length
+        sent = asyncio.run(request([dict(chunk, body=b'abc'), {'type': 'http.request', 'body': b'de'}]))
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertEqual(seen, [('5', b'abcde')])
+        self.assertEqual(application.stats()['active'], 0)
+
+    def test_view_error_mid_stream_ends_the_response(self):
+        def failing(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            yield b'partial'
+            raise RuntimeError("boom")
+
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        with self.assertLogs('asgi', 'ERROR') as logs:
+            asyncio.run(asgi.AsyncAPI(failing)({'type': 'http', 'method': 'GET', 'path': '/api/broken'}, receive, send))
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertEqual(b''.join(m.get('body', b'') for m in sent[1:]), b'partial')
+        self.assertEqual((sent[-1]['type'], sent[-1].get('more_body', False)), ('http.response.body', False))
+        self.assertIn('GET /api/broken', logs.output[0])
+        self.assertIn('RuntimeError: boom', logs.output[0])
+
+        def broken(environ, start_response):
+            raise RuntimeError("before start")
+
+        with self.assertLogs('asgi', 'ERROR'):
+            status, _, body, _ = asyncio.run(call(asgi.AsyncAPI(broken), 'GET', '/api/broken'))
+        self.assertEqual((status, json.loads(body)), (500, {'error': 'Internal Server Error'}))
+
+if __name__ == '__main__':
+    unittest.main()
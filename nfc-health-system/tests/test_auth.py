@@ -0,0 +1,125 @@
+import unittest
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+# Add parent directory to path to import app correctly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import migrations
+import auth_service
+from app import app
+from utils import hash_password
+
+FAST = 'pbkdf2:sha256:1000'     # Cheap hashes keep the suite quick
+UPGRADED = 'pbkdf2:sha256:2000'
+
+
+class AuthTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        app.config['TESTING'] = True
+        app.config['DATABASE'] = os.path.join(self.tmp_dir, 'test.db')
+        app.config['PASSWORD_HASH_METHOD'] = FAST
+
+        conn = sqlite3.connect(app.config['DATABASE'])
+        with open('schema.sql', 'r') as f:
+            conn.executescript(f.read())
+        # Rows that exist before the principals migration are backfilled
+        conn.execute("INSERT INTO hospitals (id, name, council_id, email, password_hash) VALUES ('h1', 'Apollo', 'HOSP001', 'a@h.com', ?)",
+                     (hash_password('pw', FAST),))
+        conn.execute("INSERT INTO admins (id, username, password_hash) VALUES ('a1', 'admin', ?)", (hash_password('pw', FAST),))
+        conn.commit()
+        conn.close()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config['PASSWORD_HASH_METHOD'] = None
+        app.config['LOGIN_CONCURRENCY'] = auth_service.LOGIN_CONCURRENCY
+        app.config['LOGIN_QUEUE_TIMEOUT'] = auth_service.LOGIN_QUEUE_TIMEOUT
+        database.close_pools()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def login(self, identifier, password='pw'):
+        return self.client.post('/api/auth/login', json={'username': identifier, 'password': password})
+
+    def db(self):
+        return database.get_pool(app.config['DATABASE']).connection()
+
+    def test_login_each_role_with_one_lookup(self):
+        with self.db() as conn:
+            conn.execute("INSERT INTO insurance_companies (id, name, license_number, email, password_hash) VALUES ('i1', 'Star', 'INS001', 's@i.com', ?)",
+                         (hash_password('pw', FAST),))
+            conn.commit()
+            plan = migrations.explain(conn, *migrations.HOT_QUERIES['principal_by_identifier'])
+        self.assertEqual(len(plan), 1)
+        self.assertIn('PRIMARY KEY', plan[0])
+
+        for identifier, role, user_id in (('HOSP001', 'hospital', 'h1'), ('INS001', 'insurance', 'i1'), ('admin', 'admin', 'a1')):
+            resp = self.login(identifier)
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.get_json()['role'], role)
+            with self.client.session_transaction() as sess:
+                self.assertEqual(sess['user_id'], user_id)
+        self.assertEqual(self.login('HOSP001', 'wrong').status_code, 401)
+        self.assertEqual(self.login('nobody').status_code, 401)
+
+    def test_triggers_keep_principals_in_sync(self):
+        resp = self.client.post('/api/auth/register', json={'name': 'City', 'council_id': 'HOSP002',
+                                                            'email': 'c@h.com', 'password': 'pw'})
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(self.login('HOSP002').status_code, 200)
+
+        with self.db() as conn:
+            conn.execute("UPDATE hospitals SET council_id = 'HOSP009' WHERE id = 'h1'")
+            conn.execute("DELETE FROM admins WHERE id = 'a1'")
+            conn.commit()
+        self.assertEqual(self.login('HOSP001').status_code, 401)
+        self.assertEqual(self.login('HOSP009').status_code, 200)
+        self.assertEqual(self.login('admin').status_code, 401)
+
+    def test_rehash_on_login_when_parameters_change(self):
+        app.config['PASSWORD_HASH_METHOD'] = UPGRADED
+        self.assertEqual(self.login('HOSP001').status_code, 200)
+        with self.db() as conn:
+            stored = conn.execute("SELECT password_hash FROM hospitals WHERE id = 'h1'").fetchone()[0]
+            indexed = conn.execute("SELECT password_hash FROM principals WHERE identifier = 'HOSP001'").fetchone()[0]
+        self.assertTrue(stored.startswith(UPGRADED + '$'))
+        self.assertEqual(stored, indexed)
+        # Still the same password
+        self.assertEqual(self.login('HOSP001').status_code, 200)
+
+    def test_limiter_turns_away_excess_logins(self):
+        app.config['LOGIN_CONCURRENCY'] = 1
+        app.config['LOGIN_QUEUE_TIMEOUT'] = 0.05
+        limiter = auth_service.get_login_limiter(app)
+
+        held, release = threading.Event(), threading.Event()
+
+        def hold_slot():
+            with limiter.slot():
+                held.set()
+                release.wait(5)
+
+        t = threading.Thread(target=hold_slot)
+        t.start()
+        held.wait(5)
+        try:
+            resp = self.login('HOSP001')
+            self.assertEqual(resp.status_code, 503)
+            self.assertEqual(resp.headers['Retry-After'], '1')
+        finally:
+            release.set()
+            t.join()
+
+        self.assertEqual(self.login('HOSP001').status_code, 200)
+        self.assertEqual(limiter.stats()['rejected'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
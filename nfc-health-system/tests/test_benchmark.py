@@ -0,0 +1,79 @@
+import unittest
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+
+# Add parent directory to path to import app correctly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app
+from tests import benchmark
+
+
+class BenchmarkSmokeTestCase(unittest.TestCase):
+    """Keeps tests/benchmark.py runnable; the real runs are `python -m tests.benchmark`."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.saved_database = app.config['DATABASE']
+
+    def tearDown(self):
+        app.config['DATABASE'] = self.saved_database
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_seeded_database_is_consistent(self):
+        path = benchmark.seeded_database('tiny', self.tmp_dir)
+        conn = sqlite3.connect(path)
+        try:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM patients").fetchone()[0], 50)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM medical_records").fetchone()[0], 150)
+            # Derived tables were filled by the triggers
+            self.assertEqual(conn.execute("SELECT SUM(record_count) FROM patient_summary").fetchone()[0], 150)
+        finally:
+            conn.close()
+        # Cached: a second call doesn't rebuild
+        mtime = os.path.getmtime(path)
+        self.assertEqual(benchmark.seeded_database('tiny', self.tmp_dir), path)
+        self.assertEqual(os.path.getmtime(path), mtime)
+
+    def test_every_scenario_runs_without_errors(self):
+        results = benchmark.run_size('tiny', benchmark.SCENARIOS, [2], requests=4,
+                                     data_dir=self.tmp_dir, warmup=1)
+        self.assertEqual([r['scenario'] for r in results], list(benchmark.SCENARIOS))
+        for r in results:
+            self.assertEqual(r['requests'], 4, r)
+            self.assertEqual(r['errors'], 0, r)
+            self.assertLessEqual(r['p50_ms'], r['p95_ms'])
+            self.assertLessEqual(r['p95_ms'], r['p99_ms'])
+        add = next(r for r in results if r['scenario'] == 'add_record')
+        self.assertIsNotNone(add['sync_drain_seconds'])
+        self.assertEqual(app.config['DATABASE'], self.saved_database)
+
+    def test_compare_flags_regressions(self):
+        result = {'size': 'small', 'scenario': 'scan', 'concurrency': 8,
+                  'rps': 700.0, 'p95_ms': 10.0, 'errors': 0}
+        baseline = {'small/scan/c8': {'rps': 1000.0, 'p95_ms': 5.0, 'errors': 0}}
+        messages = [m for _, m in benchmark.compare([result], baseline, tolerance=0.25)]
+        self.assertEqual(len(messages), 2)
+        self.assertEqual(benchmark.compare([result], baseline, tolerance=1.5), [])
+        self.assertEqual(benchmark.compare([result], {}, tolerance=0.25), [])
+
+    def test_baseline_round_trip(self):
+        path = os.path.join(self.tmp_dir, 'baseline.json')
+        result = {'size': 'tiny', 'scenario': 'login', 'concurrency': 1,
+                  'rps': 5.0, 'p50_ms': 1.0, 'p95_ms': 2.0, 'p99_ms': 3.0, 'errors': 0}
+        benchmark.save_baseline([result], path)
+        self.assertEqual(benchmark.load_baseline(path)['tiny/login/c1']['p95_ms'], 2.0)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(values, 50), 50)
+        self.assertEqual(benchmark.percentile(values, 99), 99)
+        self.assertEqual(benchmark.percentile([7], 95), 7)
+        self.assertIsNone(benchmark.percentile([], 50))
+
+
+if __name__ == '__main__':
+    unittest.main()
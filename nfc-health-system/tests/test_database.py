@@ -0,0 +1,109 @@
+import unittest
+import os
+import sys
+import tempfile
+import threading
+import shutil
+
+# Add parent directory to path to import app correctly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from app import app
+
+
+class DatabaseLayerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        app.config['TESTING'] = True
+        app.config['DATABASE'] = os.path.join(self.tmp_dir, 'test.db')
+
+        with app.app_context():
+            conn = database.get_pool().acquire()
+            with open('schema.sql', 'r') as f:
+                conn.executescript(f.read())
+            database.get_pool().release(conn)
+
+    def tearDown(self):
+        database.close_pools()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_pool_applies_pragmas_once(self):
+        with app.app_context():
+            db = database.get_db()
+            self.assertEqual(db.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+            self.assertEqual(db.execute("PRAGMA foreign_keys").fetchone()[0], 1)
+            self.assertEqual(db.execute("PRAGMA busy_timeout").fetchone()[0], app.config['DB_BUSY_TIMEOUT'])
+            first = id(db)
+
+        # Teardown returns the connection; the next context reuses it
+        with app.app_context():
+            self.assertEqual(id(database.get_db()), first)
+
+    def test_pool_is_bounded(self):
+        pool = database.ConnectionPool(app.config['DATABASE'], size=2, timeout=0.05)
+        a, b = pool.acquire(), pool.acquire()
+        with self.assertRaises(database.sqlite3.OperationalError):
+            pool.acquire()
+        pool.release(a)
+        self.assertIs(pool.acquire(), a)
+        pool.release(a)
+        pool.release(b)
+        pool.close()
+
+    def test_reads_use_query_only_connection(self):
+        with app.app_context():
+            self.assertEqual(database.query_db("SELECT 1 AS x", one=True)['x'], 1)
+            read_db = database.get_read_db()
+            self.assertFalse(read_db.in_transaction)
+            with self.assertRaises(database.sqlite3.OperationalError):
+                read_db.execute("INSERT INTO patients (id, full_name, dob) VALUES ('x', 'X', '2000-01-01')")
+
+    def test_transaction_rolls_back_and_sees_own_writes(self):
+        with app.app_context():
+            with self.assertRaises(ValueError):
+                with database.transaction() as db:
+                    db.execute("INSERT INTO patients (id, full_name, dob) VALUES ('tx1', 'A', '2000-01-01')")
+                    # Reads inside the block go through the write connection
+                    self.assertIsNotNone(database.query_db("SELECT id FROM patients WHERE id = 'tx1'", one=True))
+                    raise ValueError("abort")
+            self.assertIsNone(database.query_db("SELECT id FROM patients WHERE id = 'tx1'", one=True))
+
+            database.execute_db("INSERT INTO patients (id, full_name, dob) VALUES ('tx2', 'B', '2000-01-01')")
+            self.assertIsNotNone(database.query_db("SELECT id FROM patients WHERE id = 'tx2'", one=True))
+
+    def test_concurrent_readers_and_writer(self):
+        errors = []
+
+        def writer():
+            try:
+                for i in range(50):
+                    with app.app_context():
+                        database.execute_db(
+                            "INSERT INTO patients (id, full_name, dob) VALUES (?, ?, ?)",
+                            (f'p{i}', f'Patient {i}', '2000-01-01'))
+            except Exception as e:
+                errors.append(e)
+
+        def reader():
+            try:
+                for _ in range(50):
+                    with app.app_context():
+                        database.query_db("SELECT COUNT(*) FROM patients", one=True)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        with app.app_context():
+            self.assertEqual(database.query_db("SELECT COUNT(*) AS n FROM patients", one=True)['n'], 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -158,10 +158,13 @@ class NFCHealthSystemTestCase(unittest.TestCase):
             print(f"EXCEPTION in Admin Post: {e}")
             raise e
         
-        if resp.status_code != 200:
+        if resp.status_code != 302:
             print(f"Admin Submit Failed: {resp.status_code}")
         
-        self.assertEqual(resp.status_code, 200)
+        # Back to the admin's claimed requests
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(resp.headers['Location'], '/admin/dashboard?mine=1')
+        self.assertEqual(self.app.get(resp.headers['Location']).status_code, 200)
         
         # Verify status updated
         with app.app_context():
@@ -0,0 +1,96 @@
+import unittest
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+
+# Add parent directory to path to import app correctly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import migrations
+import generate_data
+import patient_summary
+import search_service
+
+NOW = 1760000000.0
+SIZES = {'hospitals': 5, 'insurers': 3, 'patients': 200, 'records': 3000, 'policies': 250, 'pending': 80}
+
+
+class GenerateDataTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'gen.db')
+        self.counts = generate_data.generate(self.path, now=NOW, log=lambda *args: None, **SIZES)
+        self.conn = sqlite3.connect(self.path)
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def scalar(self, sql, args=()):
+        return self.conn.execute(sql, args).fetchone()[0]
+
+    def test_counts_and_schema(self):
+        self.assertEqual(self.counts['medical_records'], 3000)
+        self.assertEqual(self.counts['qr_records'], 200)
+        self.assertEqual(self.counts['nfc_records'], 200)
+        self.assertEqual(self.counts['pending_medical_data_requests'], 80)
+        for table, count in self.counts.items():
+            self.assertEqual(self.scalar(f"SELECT COUNT(*) FROM {table}"), count, table)
+        self.assertEqual(migrations.current_version(self.conn), migrations.latest_version())
+        self.assertEqual(self.scalar("PRAGMA journal_mode"), 'wal')
+        self.assertEqual(self.conn.execute("PRAGMA foreign_key_check").fetchall(), [])
+
+    def test_derived_tables_are_built(self):
+        self.conn.row_factory = sqlite3.Row
+        self.assertEqual(patient_summary.verify(self.conn), [])
+        search_service.check_index(self.conn)
+        self.assertEqual(self.scalar("SELECT COUNT(*) FROM principals"), 3 + 5 + 3)
+        self.assertEqual(self.scalar("SELECT COUNT(*) FROM patient_versions"), 200)
+        self.assertEqual(migrations.check_query_plans(self.conn), {})
+
+    def test_histories_are_skewed(self):
+        counts = [r[0] for r in self.conn.execute("SELECT record_count FROM patient_summary ORDER BY record_count DESC")]
+        mean = sum(counts) / len(counts)
+        self.assertGreater(counts[0], 5 * mean)
+        self.assertLess(counts[len(counts) // 2], mean)
+
+    def test_artifacts_resolve_to_their_patient(self):
+        from utils import decrypt_data
+        payload, patient_id = self.conn.execute("SELECT encrypted_payload, patient_id FROM qr_records LIMIT 1").fetchone()
+        self.assertEqual(decrypt_data(payload), patient_id)
+        tag, pid = self.conn.execute("SELECT tag_id, patient_id FROM nfc_records LIMIT 1").fetchone()
+        self.assertEqual(self.scalar("SELECT nfc_id FROM patients WHERE id = ?", (pid,)), tag)
+
+    def test_same_seed_same_data(self):
+        other = os.path.join(self.tmp_dir, 'other.db')
+        generate_data.generate(other, now=NOW, log=lambda *args: None, **SIZES)
+        conn = sqlite3.connect(other)
+        try:
+            sql = "SELECT id, patient_id, title, created_at FROM medical_records ORDER BY id LIMIT 50"
+            self.assertEqual(conn.execute(sql).fetchall(), self.conn.execute(sql).fetchall())
+        finally:
+            conn.close()
+
+    def test_refuses_existing_database(self):
+        with self.assertRaises(FileExistsError):
+            generate_data.generate(self.path, log=lambda *args: None, **SIZES)
+        self.assertEqual(generate_data.main(['--db', self.path]), 1)
+
+    def test_pending_counts_use_patient_index(self):
+        plan = ' '.join(migrations.explain(self.conn, """
+            SELECT COUNT(*) FROM pending_medical_data_requests WHERE patient_id = ? AND status = 'pending'
+        """, ('p',)))
+        self.assertIn('idx_pending_requests_patient_status', plan)
+
+    def test_skewed_counts_sum_exactly(self):
+        import random
+        counts = generate_data.skewed_counts(1001, 37, random.Random(1))
+        self.assertEqual(sum(counts), 1001)
+        self.assertEqual(len(counts), 37)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import unittest
+import os
+import re
+import sys
+import shutil
+import sqlite3
+import tempfile
+
+# Add parent directory to path to import app correctly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import metrics
+from app import app
+from supabase_sync import SupabaseRestClient, SupabaseSyncError
+from tests.supabase_stub import SupabaseStub
+
+
+def sample(text, name, **labels):
+    """Value of one sample line in Prometheus text output, or None."""
+    for line in text.splitlines():
+        if not line.startswith(name + '{'):
+            continue
+        found = dict(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', line.split('}', 1)[0]))
+        if all(found.get(k) == v for k, v in labels.items()):
+            return float(line.rsplit(' ', 1)[1])
+    return None
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        app.config['TESTING'] = True
+        app.config['DATABASE'] = os.path.join(self.tmp_dir, 'test.db')
+
+        conn = sqlite3.connect(app.config['DATABASE'])
+        with open('schema.sql', 'r') as f:
+            conn.executescript(f.read())
+        conn.execute("INSERT INTO hospitals (id, name, council_id, email, password_hash) VALUES ('h1', 'Apollo', 'C1', 'a@h.com', 'x')")
+        conn.execute("INSERT INTO patients (id, full_name, dob) VALUES ('p1', 'Patient', '1990-01-01')")
+        conn.commit()
+        conn.close()
+
+        metrics.reset()
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = 'h1'
+            sess['role'] = 'hospital'
+
+    def tearDown(self):
+        metrics.enabled = True
+        database.close_pools()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def scrape(self):
+        resp = self.client.get('/metrics')
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith('text/plain; version=0.0.4'))
+        return resp.get_data(as_text=True)
+
+    def test_requests_are_timed_by_route_template(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get('/api/patient/p1/records?limit=5').status_code, 200)
+        self.client.get('/no/such/page')
+        text = self.scrape()
+        self.assertEqual(sample(text, 'http_request_duration_seconds_count', method='GET',
+                                route='/api/patient/<patient_id>/records', status='200'), 3)
+        self.assertEqual(sample(text, 'http_request_duration_seconds_count', route='<unmatched>', status='404'), 1)
+        self.assertEqual(sample(text, 'http_request_duration_seconds_bucket', route='/api/patient/<patient_id>/records',
+                                le='+Inf'), 3)
+
+    def test_statements_are_timed_with_row_counts(self):
+        resp = self.client.post('/api/patient/p1/add', json={'data_payload': 'BP 120/80', 'summary': 'Checkup'})
+        self.assertEqual(resp.status_code, 201)
+        database.close_pools()
+        with app.app_context():
+            rows = database.query_in("SELECT id FROM patients WHERE id IN {in}", ['p1', 'p2', 'p3'])
+        self.assertEqual(len(rows), 1)
+
+        text = self.scrape()
+        statement = metrics.fingerprint("SELECT id FROM patients WHERE id IN (?, ?)")[0]
+        self.assertEqual(sample(text, 'sqlite_statement_rows_count', statement=statement, op='SELECT',
+                                table='patients'), 1)
+        self.assertEqual(sample(text, 'sqlite_statement_rows_sum', statement=statement), 1)
+        self.assertEqual(sample(text, 'sqlite_statement_info', statement=statement,
+                                sql='SELECT id FROM patients WHERE id IN (?...)'), 1)
+        # Writes on raw connections (inside transaction()) are metered too, with rows changed
+        self.assertIsNotNone(sample(text, 'sqlite_statement_rows_sum', op='INSERT', table='medical_records'))
+        self.assertIsNotNone(sample(text, 'sqlite_statement_duration_seconds_count', op='BEGIN'))
+
+    def test_supabase_sync_latency(self):
+        stub = SupabaseStub().start()
+        try:
+            client = SupabaseRestClient(stub.url, 'service-key')
+            client.upsert('medical_records', [{'id': 'r1'}, {'id': 'r2'}])
+            stub.fail_next = 1
+            with self.assertRaises(SupabaseSyncError):
+                client.upsert('medical_records', [{'id': 'r3'}])
+            client.close()
+        finally:
+            stub.stop()
+        text = self.scrape()
+        self.assertEqual(sample(text, 'supabase_sync_rows_total', table='medical_records', outcome='ok'), 2)
+        self.assertEqual(sample(text, 'supabase_sync_rows_total', table='medical_records', outcome='error'), 1)
+        self.assertEqual(sample(text, 'supabase_sync_duration_seconds_count', outcome='ok'), 1)
+
+    def test_normalize_sql(self):
+        self.assertEqual(metrics.normalize_sql("SELECT *\n  FROM t WHERE a = 'x''y' AND b IN (?, ?,?) LIMIT 10;"),
+                         "SELECT * FROM t WHERE a = ? AND b IN (?...) LIMIT ?")
+        # Same statement with a different IN-list length is the same series
+        self.assertEqual(metrics.fingerprint("SELECT 1 FROM t WHERE id IN (?, ?)")[0],
+                         metrics.fingerprint("SELECT 1 FROM t WHERE id IN (?, ?, ?, ?)")[0])
+
+    def test_histogram_buckets_are_cumulative(self):
+        h = metrics.Histogram('demo_seconds', 'Demo.', ('kind',), (0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5.0):
+            h.observe(value, 'a')
+        lines = h.render()
+        self.assertIn('demo_seconds_bucket{kind="a",le="0.1"} 1', lines)
+        self.assertIn('demo_seconds_bucket{kind="a",le="1.0"} 3', lines)
+        self.assertIn('demo_seconds_bucket{kind="a",le="+Inf"} 4', lines)
+        self.assertIn('demo_seconds_count{kind="a"} 4', lines)
+
+    def test_disabled_metrics_record_nothing(self):
+        metrics.enabled = False
+        with app.app_context():
+            database.query_db("SELECT COUNT(*) FROM patients")
+        metrics.enabled = True
+        statement = metrics.fingerprint("SELECT COUNT(*) FROM patients")[0]
+        self.assertIsNone(sample(self.scrape(), 'sqlite_statement_duration_seconds_count', statement=statement))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import os
+import sys
+import sqlite3
+import tempfile
+import shutil
+
+# Add parent directory to path to import app correctly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import migrations
+
+
+class MigrationsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.conn = sqlite3.connect(os.path.join(self.tmp_dir, 'test.db'))
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_fresh_database_reaches_latest(self):
+        applied = migrations.migrate(self.conn)
+        self.assertEqual(applied[0], migrations.BASELINE_VERSION)
+        self.assertEqual(migrations.current_version(self.conn), migrations.latest_version())
+        # Idempotent
+        self.assertEqual(migrations.migrate(self.conn), [])
+
+    def test_upgrades_live_database_in_place(self):
+        # A database created by the old init_db: schema.sql only, user_version 0
+        with open(migrations.SCHEMA_FILE) as f:
+            self.conn.executescript(f.read())
+        self.conn.execute("INSERT INTO patients (id, full_name, dob) VALUES ('p1', 'Kept', '2000-01-01')")
+        self.conn.commit()
+
+        migrations.migrate(self.conn)
+        self.assertEqual(migrations.current_version(self.conn), migrations.latest_version())
+        self.assertEqual(self.conn.execute("SELECT full_name FROM patients WHERE id = 'p1'").fetchone()[0], 'Kept')
+
+    def test_hot_queries_use_indexes(self):
+        migrations.migrate(self.conn)
+        self.assertEqual(migrations.check_query_plans(self.conn), {})
+
+    def test_check_detects_table_scan(self):
+        migrations.migrate(self.conn, target=migrations.BASELINE_VERSION)
+        failures = migrations.check_query_plans(self.conn)
+        self.assertIn('records_by_patient', failures)
+
+
+    def test_duplicate_active_tags_are_reported_and_deactivated(self):
+        migrations.migrate(self.conn, target=16)
+        self.conn.execute("INSERT INTO patients (id, full_name, dob) VALUES ('p1', 'One', '2000-01-01'), ('p2', 'Two', '2000-01-01')")
+        self.conn.executemany("INSERT INTO nfc_records (id, patient_id, tag_id, encrypted_payload, status) VALUES (?, ?, ?, 'x', ?)",
+                              [('n1', 'p1', 'DUP1', 'active'), ('n2', 'p2', 'DUP1', 'active'),
+                               ('n3', 'p2', 'DUP2', 'revoked'), ('n4', 'p1', 'DUP2', 'active')])
+        self.conn.commit()
+
+        migrations.migrate(self.conn)
+        statuses = dict(self.conn.execute("SELECT id, status FROM nfc_records").fetchall())
+        self.assertEqual(statuses, {'n1': 'active', 'n2': 'conflict', 'n3': 'revoked', 'n4': 'active'})
+        self.assertEqual(migrations.tag_conflicts(self.conn), [('DUP1', 'n2', 'p2')])
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.conn.execute("UPDATE nfc_records SET status = 'active' WHERE id = 'n2'")
+
+
+if __name__ == '__main__':
+    unittest.main()
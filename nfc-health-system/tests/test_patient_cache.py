@@ -0,0 +1,134 @@
+import unittest
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+from unittest import mock
+
+# Add parent directory to path to import app correctly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api
+import database
+import patient_cache
+from app import app
+
+
+class PatientCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        app.config['TESTING'] = True
+        app.config['DATABASE'] = os.path.join(self.tmp_dir, 'test.db')
+        app.config['PATIENT_CACHE_PATH'] = os.path.join(self.tmp_dir, 'cache.db')
+
+        conn = sqlite3.connect(app.config['DATABASE'])
+        with open('schema.sql', 'r') as f:
+            conn.executescript(f.read())
+        conn.execute("INSERT INTO hospitals (id, name, council_id, email, password_hash) VALUES ('h1', 'Apollo', 'C1', 'a@h.com', 'x')")
+        conn.execute("INSERT INTO patients (id, full_name, dob) VALUES ('11111111-1111-1111-1111-111111111111', 'Chronic', '1960-01-01')")
+        conn.commit()
+        conn.close()
+        self.pid = '11111111-1111-1111-1111-111111111111'
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = 'h1'
+            sess['role'] = 'hospital'
+
+    def tearDown(self):
+        app.config['PATIENT_CACHE_BACKEND'] = patient_cache.CACHE_BACKEND
+        app.config['PATIENT_CACHE_PATH'] = patient_cache.CACHE_PATH
+        patient_cache._caches.clear()
+        database.close_pools()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def add_record(self, summary):
+        resp = self.client.post(f'/api/patient/{self.pid}/add', json={'data_payload': 'x', 'summary': summary})
+        self.assertEqual(resp.status_code, 201)
+
+    def page(self):
+        # Sorted: records added in the same second have no stable keyset order
+        records = self.client.get(f'/api/patient/{self.pid}/records?limit=10&fields=summary').get_json()['records']
+        return sorted(r['summary'] for r in records)
+
+    def check_repeat_views_hit_and_writes_invalidate(self):
+        self.add_record('First')
+        with mock.patch('api.get_records_page', wraps=api.get_records_page) as load:
+            self.assertEqual(self.page(), ['First'])
+            self.assertEqual(self.page(), ['First'])
+            self.assertEqual(load.call_count, 1)
+
+            self.add_record('Second')
+            self.assertEqual(self.page(), ['First', 'Second'])
+            self.assertEqual(load.call_count, 2)
+
+        # Writes outside the API (admin entry, import, merges) bump the version via triggers
+        with database.get_pool(app.config['DATABASE']).connection() as conn:
+            conn.execute("UPDATE medical_records SET title = 'Edited' WHERE title = 'First'")
+            conn.commit()
+        self.assertEqual(self.page(), ['Edited', 'Second'])
+
+        stats = patient_cache.get_patient_cache(app).stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 3))
+
+    def test_memory_backend(self):
+        app.config['PATIENT_CACHE_BACKEND'] = 'memory'
+        self.check_repeat_views_hit_and_writes_invalidate()
+
+    def test_sqlite_backend(self):
+        app.config['PATIENT_CACHE_BACKEND'] = 'sqlite'
+        self.check_repeat_views_hit_and_writes_invalidate()
+
+    def test_sqlite_backend_is_shared(self):
+        path = os.path.join(self.tmp_dir, 'shared.db')
+        loads = []
+        with app.app_context():
+            first = patient_cache.PatientCache(patient_cache.SQLiteBackend(path), 'db')
+            second = patient_cache.PatientCache(patient_cache.SQLiteBackend(path), 'db')
+            first.get_or_load('patient', self.pid, None, lambda: loads.append(1) or {'name': 'x'})
+            self.assertEqual(second.get_or_load('patient', self.pid, None, lambda: loads.append(2)), {'name': 'x'})
+        self.assertEqual(loads, [1])
+
+    def test_patient_view_is_cached(self):
+        with mock.patch('app.load_patient', wraps=__import__('app').load_patient) as load:
+            self.assertIn(b'Chronic', self.client.get(f'/patient/{self.pid}/view').data)
+            self.client.get(f'/patient/{self.pid}/view')
+            self.assertEqual(load.call_count, 1)
+            with database.get_pool(app.config['DATABASE']).connection() as conn:
+                conn.execute("UPDATE patients SET full_name = 'Renamed' WHERE id = ?", (self.pid,))
+                conn.commit()
+            self.assertIn(b'Renamed', self.client.get(f'/patient/{self.pid}/view').data)
+
+    def test_backends_are_bounded(self):
+        memory = patient_cache.MemoryBackend(max_entries=3)
+        for i in range(5):
+            memory.put(f'k{i}', i)
+        self.assertEqual(len(memory), 3)
+        self.assertIsNone(memory.get('k0'))
+
+        # Few large values: the byte budget evicts before the entry count does
+        memory = patient_cache.MemoryBackend(max_entries=100, max_bytes=1000)
+        history = [{'summary': 'x' * 90}] * 3   # ~300 bytes as JSON
+        for i in range(5):
+            memory.put(f'h{i}', history)
+        self.assertEqual(len(memory), 3)
+        self.assertLessEqual(memory.size_bytes(), 1000)
+        self.assertIsNone(memory.get('h1'))
+        self.assertEqual(memory.get('h4'), history)
+        memory.put('huge', [{'summary': 'x' * 2000}])   # Over the whole budget: not kept
+        self.assertIsNone(memory.get('huge'))
+        self.assertEqual(len(memory), 3)
+
+        with mock.patch('patient_cache.EVICT_EVERY', 1):
+            disk = patient_cache.SQLiteBackend(os.path.join(self.tmp_dir, 'bounded.db'), max_entries=3)
+            for i in range(5):
+                disk.put(f'k{i}', i)
+        self.assertEqual(len(disk), 3)
+        self.assertIsNone(disk.get('k0'))
+        self.assertEqual(disk.get('k4'), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import unittest
+import io
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+from contextlib import redirect_stdout
+
+# Add parent directory to path to import app correctly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import qr_service
+import patient_summary
+import insurance_service
+from app import app
+from scan_service import merge_patients
+
+
+class PatientSummaryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        app.config['TESTING'] = True
+        app.config['DATABASE'] = os.path.join(self.tmp_dir, 'test.db')
+        app.config['QR_RENDER_WORKERS'] = 0
+        app.config['QR_CACHE_DIR'] = os.path.join(self.tmp_dir, 'qr_cache')
+
+        conn = sqlite3.connect(app.config['DATABASE'])
+        with open('schema.sql', 'r') as f:
+            conn.executescript(f.read())
+        conn.execute("INSERT INTO hospitals (id, name, council_id, email, password_hash) VALUES ('h1', 'Apollo', 'C1', 'a@h.com', 'x')")
+        conn.execute("INSERT INTO insurance_companies (id, name, license_number, email, password_hash) VALUES ('ins1', 'INS1', 'LIC-1', 'ins1@test.com', 'x')")
+        # Existing data must be backfilled by the migration
+        conn.execute("INSERT INTO patients (id, full_name, dob) VALUES ('p1', 'Known', '1980-01-01')")
+        conn.execute("INSERT INTO medical_records (id, patient_id, record_type, title, created_at) VALUES ('m1', 'p1', 'text', 'Old', '2024-01-01 00:00:00')")
+        conn.commit()
+        conn.close()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = 'h1'
+            sess['role'] = 'hospital'
+
+    def tearDown(self):
+        qr_service.shutdown_renderers()
+        app.config['QR_CACHE_DIR'] = qr_service.CACHE_DIR
+        app.config['QR_RENDER_WORKERS'] = qr_service.RENDER_WORKERS
+        database.close_pools()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def connection(self):
+        return database.get_pool(app.config['DATABASE']).connection()
+
+    def summary(self, patient_id):
+        return self.client.get(f'/api/patient/{patient_id}/summary').get_json()
+
+    def assertInSync(self):
+        with self.connection() as conn:
+            self.assertEqual(patient_summary.verify(conn), [])
+
+    def test_backfill_and_record_writes(self):
+        s = self.summary('p1')
+        self.assertEqual((s['record_count'], s['latest_record_id'], s['active_policy_count']), (1, 'm1', 0))
+
+        self.client.post('/api/patient/p1/add', json={'data_payload': 'BP', 'summary': 'New'})
+        s = self.summary('p1')
+        self.assertEqual(s['record_count'], 2)
+        self.assertNotEqual(s['latest_record_id'], 'm1')
+
+        with self.connection() as conn:
+            conn.execute("DELETE FROM medical_records WHERE id = ?", (s['latest_record_id'],))
+            conn.commit()
+        s = self.summary('p1')
+        self.assertEqual((s['record_count'], s['latest_record_id']), (1, 'm1'))
+        self.assertEqual(self.summary('nobody')['record_count'], 0)
+        self.assertInSync()
+
+    def test_policy_creation_and_admin_completion(self):
+        with app.app_context():
+            insurance_service.generate_policy('ins1', 'new@test.com', 'POL-1', 100, None)
+            insurance_service.generate_policy('ins1', 'p1', 'POL-2', 100, None)
+        with self.connection() as conn:
+            new_id = conn.execute("SELECT id FROM patients WHERE email = 'new@test.com'").fetchone()['id']
+            request_id = conn.execute("SELECT id FROM pending_medical_data_requests").fetchone()['id']
+
+        # Placeholder dataset only for the patient without records
+        s = self.summary(new_id)
+        self.assertEqual((s['record_count'], s['active_policy_count'], s['pending_request_count']), (1, 1, 1))
+        self.assertEqual(self.summary('p1')['record_count'], 1)
+
+        with self.client.session_transaction() as sess:
+            sess['role'] = 'admin'
+        self.client.post(f'/admin/medical-entry/{request_id}', data={'title': 'Intake', 'description': 'x'})
+        s = self.summary(new_id)
+        self.assertEqual((s['record_count'], s['pending_request_count']), (2, 0))
+
+        with self.connection() as conn:
+            conn.execute("UPDATE policies SET status = 'expired' WHERE policy_number = 'POL-2'")
+            conn.commit()
+        self.assertEqual(self.summary('p1')['active_policy_count'], 0)
+        self.assertInSync()
+
+    def test_merge_and_delete(self):
+        with app.app_context():
+            insurance_service.generate_policy('ins1', 'dup@test.com', 'POL-1', 100, None)
+        with self.connection() as conn:
+            dup_id = conn.execute("SELECT id FROM patients WHERE email = 'dup@test.com'").fetchone()['id']
+        with app.app_context():
+            merge_patients(app, dup_id, 'p1')
+
+        s = self.summary('p1')
+        self.assertEqual((s['record_count'], s['active_policy_count'], s['pending_request_count']), (2, 1, 1))
+        self.assertEqual(self.summary(dup_id)['record_count'], 0)
+        self.assertInSync()
+
+        with self.connection() as conn:
+            # Cascades to p1's records/policies; the merged duplicate references p1
+            conn.execute("DELETE FROM patients WHERE id IN (?, 'p1')", (dup_id,))
+            conn.commit()
+            self.assertIsNone(conn.execute("SELECT 1 FROM patient_summary WHERE patient_id = 'p1'").fetchone())
+        self.assertInSync()
+
+    def test_verify_and_rebuild_cli(self):
+        self.summary('p1')  # Apply migrations
+        with self.connection() as conn:
+            conn.execute("UPDATE patient_summary SET record_count = 7")
+            conn.commit()
+
+        out = io.StringIO()
+        with redirect_stdout(out):
+            self.assertEqual(patient_summary.main(['--db', app.config['DATABASE']]), 1)
+            self.assertEqual(patient_summary.main(['--db', app.config['DATABASE'], '--rebuild', '--verify']), 0)
+        self.assertIn('MISMATCH p1', out.getvalue())
+        self.assertEqual(self.summary('p1')['record_count'], 1)
+
+    def test_policy_list_shows_summary(self):
+        with app.app_context():
+            insurance_service.generate_policy('ins1', 'new@test.com', 'POL-1', 100, None)
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = 'ins1'
+            sess['role'] = 'insurance'
+        page = self.client.get('/api/insurance/policies').get_json()
+        self.assertEqual((page['policies'][0]['record_count'], page['policies'][0]['pending_request_count']), (1, 1))
+        self.assertIn(b'Medical data pending', self.client.get('/insurance/policies').data)
+
+
+if __name__ == '__main__':
+    unittest.main()
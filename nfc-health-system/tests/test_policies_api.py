@@ -0,0 +1,208 @@
+import unittest
+import io
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+
+# Add parent directory to path to import app correctly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+from unittest import mock
+
+import database
+import insurance_service
+import qr_service
+from app import app
+
+
+class PoliciesListingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        app.config['TESTING'] = True
+        app.config['DATABASE'] = os.path.join(self.tmp_dir, 'test.db')
+
+        conn = sqlite3.connect(app.config['DATABASE'])
+        with open('schema.sql', 'r') as f:
+            conn.executescript(f.read())
+        for ins in ('ins1', 'ins2'):
+            conn.execute("INSERT INTO insurance_companies (id, name, license_number, email, password_hash) VALUES (?, ?, ?, ?, 'x')",
+                         (ins, ins.upper(), f'LIC-{ins}', f'{ins}@test.com'))
+        conn.execute("INSERT INTO patients (id, full_name, dob) VALUES ('p1', 'Holder', '1980-01-01')")
+        for i in range(30):
+            conn.execute("""
+                INSERT INTO policies (id, patient_id, provider_id, policy_number, coverage_amount, status, valid_until, created_at)
+                VALUES (?, 'p1', 'ins1', ?, 1000, ?, ?, ?)
+            """, (f'pol{i:02d}', f'{"GRP" if i < 10 else "IND"}-{i:03d}', 'expired' if i % 3 == 0 else 'active',
+                  f'20{25 + i % 5}-12-31', f'2024-02-{1 + i // 2:02d} 09:00:00'))
+        conn.execute("""
+            INSERT INTO policies (id, patient_id, provider_id, policy_number, coverage_amount)
+            VALUES ('other', 'p1', 'ins2', 'OTHER-1', 5)
+        """)
+        conn.commit()
+        conn.close()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = 'ins1'
+            sess['role'] = 'insurance'
+
+    def tearDown(self):
+        database.close_pools()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def collect(self, query):
+        ids, cursor = [], None
+        while True:
+            url = f'/api/insurance/policies?limit=4&{query}' + (f'&cursor={cursor}' if cursor else '')
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            page = resp.get_json()
+            ids.extend(p['id'] for p in page['policies'])
+            cursor = page['next_cursor']
+            if not cursor:
+                return ids
+
+    def test_pages_are_provider_scoped_and_ordered(self):
+        ids = self.collect('')
+        self.assertEqual(ids, [f'pol{i:02d}' for i in range(29, -1, -1)])
+
+    def test_filters(self):
+        self.assertEqual(len(self.collect('status=expired')), 10)
+        self.assertEqual(sorted(self.collect('policy_number=GRP')), [f'pol{i:02d}' for i in range(10)])
+        self.assertEqual(sorted(self.collect('policy_number=GRP-00')), [f'pol{i:02d}' for i in range(10)])
+        self.assertEqual(self.collect('policy_number=%F0%9F%A9%BA'), [])   # Astral-plane prefix
+        for prefix in ('%F4%8F%BF%BF', 'GRP%00', 'GRP%0A'):   # U+10FFFF, NUL, newline
+            resp = self.client.get(f'/api/insurance/policies?policy_number={prefix}')
+            self.assertEqual(resp.status_code, 400, prefix)
+            self.assertIn('printable', resp.get_json()['error'])
+        valid = self.collect('valid_until_from=2027-01-01&valid_until_to=2028-12-31')
+        self.assertEqual(len(valid), 12)
+
+    def test_html_page_links_next(self):
+        resp = self.client.get('/insurance/policies?status=active&limit=5')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b'Older', resp.data)
+        self.assertIn(b'status=active', resp.data)
+        self.assertEqual(self.client.get('/insurance/policies?cursor=bad').status_code, 400)
+
+
+class PolicyImportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        app.config['TESTING'] = True
+        app.config['DATABASE'] = os.path.join(self.tmp_dir, 'test.db')
+
+        conn = sqlite3.connect(app.config['DATABASE'])
+        with open('schema.sql', 'r') as f:
+            conn.executescript(f.read())
+        conn.execute("INSERT INTO insurance_companies (id, name, license_number, email, password_hash) VALUES ('ins1', 'INS1', 'LIC-1', 'ins1@test.com', 'x')")
+        conn.execute("INSERT INTO patients (id, full_name, dob, email) VALUES ('p1', 'Known', '1980-01-01', 'known@test.com')")
+        conn.execute("INSERT INTO policies (id, patient_id, provider_id, policy_number, coverage_amount) VALUES ('old', 'p1', 'ins1', 'EXISTING-1', 5)")
+        conn.commit()
+        conn.close()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = 'ins1'
+            sess['role'] = 'insurance'
+
+    def tearDown(self):
+        database.close_pools()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def count(self, table):
+        with database.get_pool(app.config['DATABASE']).connection() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def test_csv_import_reports_per_row_errors(self):
+        lines = ['patient_email,policy_number,coverage_amount,valid_until',
+                 'known@test.com,GRP-000,1000,2027-12-31']
+        lines += [f'member{i}@corp.com,GRP-{i:03d},2500,2027-12-31' for i in range(1, 25)]
+        lines += ['known@test.com,GRP-001,1000,2027-12-31',   # duplicate in file
+                  'known@test.com,EXISTING-1,1000,',          # already in DB
+                  'nobody,GRP-900,1000,',                     # unknown patient id
+                  'known@test.com,GRP-901,lots,']             # bad amount
+        resp = self.client.post('/api/insurance/policies/import', data='\n'.join(lines),
+                                content_type='text/csv')
+        self.assertEqual(resp.status_code, 200)
+        report = resp.get_json()
+
+        self.assertEqual((report['total'], report['created'], report['failed']), (29, 25, 4))
+        self.assertEqual([e['row'] for e in report['errors']], [26, 27, 28, 29])
+        self.assertIn('Duplicate', report['errors'][0]['error'])
+        self.assertIn('already exists', report['errors'][1]['error'])
+        self.assertIn('Patient not found', report['errors'][2]['error'])
+
+        self.assertEqual(self.count('policies'), 26)
+        self.assertEqual(self.count('patients'), 25)
+        self.assertEqual(self.count('qr_records'), 25)
+        self.assertEqual(self.count('nfc_records'), 25)
+        self.assertEqual(self.count('pending_medical_data_requests'), 25)
+        with database.get_pool(app.config['DATABASE']).connection() as conn:
+            qr = conn.execute("SELECT id, status, image_path FROM qr_records LIMIT 1").fetchone()
+        # Nothing written to disk: images render on first fetch
+        self.assertEqual((qr['status'], qr['image_path']), ('ready', f"/qr/{qr['id']}"))
+        self.assertEqual(self.client.get(qr['image_path']).mimetype, 'image/png')
+
+    def test_json_import_in_small_chunks(self):
+        rows = [{'patient_email': 'known@test.com', 'policy_number': f'J-{i}', 'coverage_amount': 10}
+                for i in range(7)]
+        with app.app_context():
+            report = insurance_service.import_policies('ins1', rows, chunk_size=3, workers=1)
+        self.assertEqual((report['created'], report['failed']), (7, 0))
+        # One placeholder record for the existing patient, not one per policy
+        self.assertEqual(self.count('medical_records'), 1)
+
+    def test_new_tags_skip_ids_already_in_use(self):
+        with database.get_pool(app.config['DATABASE']).connection() as conn:
+            conn.execute("INSERT INTO nfc_records (id, patient_id, tag_id, encrypted_payload) VALUES ('n0', 'p1', 'AAAA0001', 'x')")
+            conn.commit()
+            # Two active records can't share a tag ID
+            with self.assertRaises(sqlite3.IntegrityError):
+                conn.execute("INSERT INTO nfc_records (id, patient_id, tag_id, encrypted_payload) VALUES ('n9', 'p1', 'AAAA0001', 'y')")
+            conn.rollback()
+
+        draws = iter(['AAAA0001', 'AAAA0002', 'AAAA0002', 'AAAA0003', 'AAAA0001', 'AAAA0004'])
+        app.config['QR_RENDER_WORKERS'] = 0
+        app.config['QR_CACHE_DIR'] = os.path.join(self.tmp_dir, 'qr_cache')
+        try:
+            with mock.patch('insurance_service.new_tag_id', lambda: next(draws)):
+                with app.app_context():
+                    report = insurance_service.import_policies('ins1', [
+                        {'patient_id': 'p1', 'policy_number': f'T-{i}', 'coverage_amount': 1} for i in range(2)], workers=1)
+                self.assertEqual(report['created'], 2)
+                resp = self.client.post('/insurance/policies/create', data={
+                    'patient_email': 'known@test.com', 'policy_number': 'T-9',
+                    'coverage_amount': '1000', 'valid_until': '2030-01-01'})
+                self.assertEqual(resp.status_code, 302)
+        finally:
+            qr_service.shutdown_renderers()
+            app.config['QR_RENDER_WORKERS'] = qr_service.RENDER_WORKERS
+            app.config['QR_CACHE_DIR'] = qr_service.CACHE_DIR
+
+        with database.get_pool(app.config['DATABASE']).connection() as conn:
+            tags = sorted(r[0] for r in conn.execute("SELECT tag_id FROM nfc_records"))
+        self.assertEqual(tags, ['AAAA0001', 'AAAA0002', 'AAAA0003', 'AAAA0004'])
+
+    def test_multipart_jsonl_upload(self):
+        body = '\n'.join(json.dumps({'patient_id': 'p1', 'policy_number': f'L-{i}', 'coverage_amount': 1})
+                         for i in range(3)) + '\n{not json'
+        resp = self.client.post('/api/insurance/policies/import', content_type='multipart/form-data',
+                                data={'file': (io.BytesIO(body.encode()), 'policies.jsonl')})
+        report = resp.get_json()
+        self.assertEqual((report['created'], report['failed']), (3, 1))
+        self.assertIn('Invalid JSON', report['errors'][0]['error'])
+
+        resp = self.client.post('/insurance/policies/import', content_type='multipart/form-data',
+                                data={'file': (io.BytesIO(b'patient_email,policy_number,coverage_amount\n'), 'empty.csv')})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b'0</strong> of 0', resp.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
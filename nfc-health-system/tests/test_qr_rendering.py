@@ -0,0 +1,191 @@
+import unittest
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+
+# Add parent directory to path to import app correctly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import qr_service
+from app import app
+from utils import encrypt_data
+
+
+class QRRenderingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        app.config['TESTING'] = True
+        app.config['DATABASE'] = os.path.join(self.tmp_dir, 'test.db')
+        app.config['QR_RENDER_WORKERS'] = 1
+        app.config['QR_CACHE_DIR'] = os.path.join(self.tmp_dir, 'qr_cache')
+
+        conn = sqlite3.connect(app.config['DATABASE'])
+        with open('schema.sql', 'r') as f:
+            conn.executescript(f.read())
+        conn.execute("INSERT INTO insurance_companies (id, name, license_number, email, password_hash) VALUES ('ins1', 'INS1', 'LIC-1', 'ins1@test.com', 'x')")
+        conn.execute("INSERT INTO patients (id, full_name, dob, email) VALUES ('p1', 'Known', '1980-01-01', 'known@test.com')")
+        conn.commit()
+        conn.close()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = 'ins1'
+            sess['role'] = 'insurance'
+
+    def tearDown(self):
+        qr_service.shutdown_renderers()
+        app.config['QR_CACHE_DIR'] = qr_service.CACHE_DIR
+        app.config['QR_RENDER_WORKERS'] = qr_service.RENDER_WORKERS
+        database.close_pools()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def qr_row(self):
+        with database.get_pool(app.config['DATABASE']).connection() as conn:
+            return conn.execute("SELECT * FROM qr_records").fetchone()
+
+    def test_policy_commits_before_image_is_rendered(self):
+        resp = self.client.post('/insurance/policies/create', data={
+            'patient_email': 'known@test.com', 'policy_number': 'POL-1',
+            'coverage_amount': '1000', 'valid_until': '2030-01-01'})
+        self.assertEqual(resp.status_code, 302)
+
+        qr_id = self.qr_row()['id']
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            status = self.client.get(f'/api/qr/{qr_id}/status').get_json()
+            if status['status'] == 'ready':
+                break
+            self.assertEqual(status['status'], 'pending')
+            time.sleep(0.1)
+
+        self.assertEqual(status['image_url'], f'/qr/{qr_id}')
+        with database.get_pool(app.config['DATABASE']).connection() as conn:
+            qr_code = conn.execute("SELECT qr_code FROM patients WHERE id = 'p1'").fetchone()[0]
+        self.assertEqual(qr_code, f'/qr/{qr_id}')
+        # Pre-rendered into the cache, so the first fetch is a hit
+        self.client.get(f'/qr/{qr_id}')
+        self.assertEqual(qr_service.get_cache(app).stats()['misses'], 0)
+
+        resp = self.client.get('/insurance/policies')
+        self.assertIn(b'View QR', resp.data)
+
+    def test_stale_pending_row_is_rendered_on_first_request(self):
+        # Left behind by a process that died between commit and render
+        app.config['QR_RENDER_WORKERS'] = 0
+        with database.get_pool(app.config['DATABASE']).connection() as conn:
+            conn.execute("""
+                INSERT INTO qr_records (id, patient_id, encrypted_payload, status, created_at)
+                VALUES ('q1', 'p1', ?, 'pending', datetime('now', '-5 minutes'))
+            """, (encrypt_data('p1'),))
+            conn.commit()
+
+        status = self.client.get('/api/qr/q1/status').get_json()
+        self.assertEqual(status['status'], 'ready')
+        self.assertEqual(self.client.get('/api/qr/missing/status').status_code, 404)
+
+    def test_render_now_skips_an_id_already_in_flight(self):
+        with database.get_pool(app.config['DATABASE']).connection() as conn:
+            conn.execute("INSERT INTO qr_records (id, patient_id, encrypted_payload, status) VALUES ('q1', 'p1', ?, 'pending')",
+                         (encrypt_data('p1'),))
+            conn.commit()
+        renderer = qr_service.get_renderer(app)
+        renderer._in_flight.add('q1')   # As if submit() were rendering it
+        self.assertFalse(renderer.render_now('q1', encrypt_data('p1')))
+        self.assertEqual(self.qr_row()['status'], 'pending')
+        self.assertIn('q1', renderer._in_flight)
+
+        renderer._in_flight.discard('q1')
+        self.assertTrue(renderer.render_now('q1', encrypt_data('p1')))
+        self.assertEqual(self.qr_row()['status'], 'ready')
+        self.assertNotIn('q1', renderer._in_flight)
+
+    def test_out_of_order_render_keeps_latest_qr(self):
+        with database.get_pool(app.config['DATABASE']).connection() as conn:
+            conn.execute("INSERT INTO qr_records (id, patient_id, encrypted_payload, status, created_at) VALUES ('old', 'p1', 'x', 'pending', '2024-01-01 00:00:00')")
+            conn.execute("INSERT INTO qr_records (id, patient_id, encrypted_payload, status, created_at) VALUES ('new', 'p1', 'y', 'pending', '2024-01-02 00:00:00')")
+            conn.commit()
+            qr_service.mark_rendered(conn, ['new'])
+            qr_service.mark_rendered(conn, ['old'])
+            self.assertEqual(conn.execute("SELECT qr_code FROM patients WHERE id = 'p1'").fetchone()[0], '/qr/new')
+
+
+
+class QRImageEndpointTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        app.config['TESTING'] = True
+        app.config['DATABASE'] = os.path.join(self.tmp_dir, 'test.db')
+        app.config['QR_CACHE_DIR'] = os.path.join(self.tmp_dir, 'qr_cache')
+
+        conn = sqlite3.connect(app.config['DATABASE'])
+        with open('schema.sql', 'r') as f:
+            conn.executescript(f.read())
+        conn.execute("INSERT INTO patients (id, full_name, dob) VALUES ('p1', 'Known', '1980-01-01')")
+        conn.execute("INSERT INTO qr_records (id, patient_id, encrypted_payload) VALUES ('q1', 'p1', ?)", (encrypt_data('p1'),))
+        conn.commit()
+        conn.close()
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = 'ins1'
+            sess['role'] = 'insurance'
+
+    def tearDown(self):
+        app.config['QR_CACHE_DIR'] = qr_service.CACHE_DIR
+        database.close_pools()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_png_and_svg_with_etags(self):
+        resp = self.client.get('/qr/q1')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'image/png')
+        self.assertTrue(resp.data.startswith(b'\x89PNG'))
+        self.assertIn('private', resp.headers['Cache-Control'])
+        self.assertNotIn('public', resp.headers['Cache-Control'])
+        etag = resp.headers['ETag']
+        self.assertFalse(etag.startswith('W/'))
+
+        again = self.client.get('/qr/q1', headers={'If-None-Match': etag})
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.data, b'')
+
+        svg = self.client.get('/qr/q1?format=svg&size=4&border=1')
+        self.assertEqual(svg.mimetype, 'image/svg+xml')
+        self.assertIn(b'<svg', svg.data)
+        self.assertNotEqual(svg.headers['ETag'], etag)
+
+        big = self.client.get('/qr/q1?size=20')
+        self.assertGreater(len(big.data), 0)
+        self.assertEqual(self.client.get('/qr/q1?format=gif').status_code, 400)
+        self.assertEqual(self.client.get('/qr/q1?size=999').status_code, 400)
+        self.assertEqual(self.client.get('/qr/nope').status_code, 404)
+
+        self.assertEqual(app.test_client().get('/qr/q1').status_code, 401)   # No session
+
+    def test_cache_is_bounded(self):
+        cache = qr_service.QRCache(os.path.join(self.tmp_dir, 'bounded'), memory_bytes=1500, disk_files=3)
+        images = {f'payload-{i}': cache.get_or_render(f'payload-{i}')[0] for i in range(5)}
+        self.assertEqual(len(os.listdir(cache.directory)), 3)
+        self.assertLessEqual(cache.stats()['memory_bytes'], 1500)
+        self.assertLess(cache.stats()['memory_entries'], 5)
+        self.assertEqual(cache.stats()['misses'], 5)
+
+        # Newest survive in memory/on disk; the oldest was evicted from both and is re-rendered
+        self.assertEqual(cache.get_or_render('payload-4')[0], images['payload-4'])
+        self.assertEqual(cache.get_or_render('payload-0')[0], images['payload-0'])
+        stats = cache.stats()
+        self.assertEqual(stats['misses'], 6)
+        self.assertEqual(stats['hits'] + stats['disk_hits'], 1)
+
+        # A fresh process (new cache object) finds the disk copies
+        other = qr_service.QRCache(cache.directory, disk_files=3)
+        self.assertIsNotNone(other.get(qr_service.cache_key('payload-0')))
+
+
+if __name__ == '__main__':
+    unittest.main()
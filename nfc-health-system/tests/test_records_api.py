@@ -0,0 +1,82 @@
+import unittest
+import os
+import sys
+import json
+import shutil
+import sqlite3
+import tempfile
+
+# Add parent directory to path to import app correctly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from app import app
+
+
+class RecordsApiTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        app.config['TESTING'] = True
+        app.config['DATABASE'] = os.path.join(self.tmp_dir, 'test.db')
+
+        conn = sqlite3.connect(app.config['DATABASE'])
+        with open('schema.sql', 'r') as f:
+            conn.executescript(f.read())
+        conn.execute("INSERT INTO hospitals (id, name, council_id, email, password_hash) VALUES ('h1', 'Apollo', 'C1', 'a@h.com', 'x')")
+        conn.execute("INSERT INTO patients (id, full_name, dob) VALUES ('p1', 'Chronic', '1960-01-01')")
+        # 25 records, several sharing a timestamp so the id tie-breaker matters
+        for i in range(25):
+            conn.execute("""
+                INSERT INTO medical_records (id, patient_id, hospital_id, record_type, title, description, created_at)
+                VALUES (?, 'p1', ?, 'text', ?, ?, ?)
+            """, (f'r{i:02d}', 'h1' if i % 2 else None, f'Visit {i}', 'x' * 100, f'2024-01-{1 + i // 3:02d} 10:00:00'))
+        conn.commit()
+        conn.close()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = 'h1'
+            sess['role'] = 'hospital'
+
+    def tearDown(self):
+        database.close_pools()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_unpaginated_returns_full_array(self):
+        resp = self.client.get('/api/patient/p1/records')
+        self.assertEqual(resp.status_code, 200)
+        records = resp.get_json()
+        self.assertEqual(len(records), 25)
+        self.assertEqual(records[0]['id'], 'r24')
+        self.assertEqual(records[-1]['hospital_name'], 'Unknown/Admin')
+
+    def test_keyset_pages_cover_history_once(self):
+        seen, cursor = [], None
+        while True:
+            url = '/api/patient/p1/records?limit=7' + (f'&cursor={cursor}' if cursor else '')
+            page = self.client.get(url).get_json()
+            self.assertLessEqual(len(page['records']), 7)
+            seen.extend(r['id'] for r in page['records'])
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, [f'r{i:02d}' for i in range(24, -1, -1)])
+
+    def test_field_selection(self):
+        page = self.client.get('/api/patient/p1/records?limit=2&fields=id,summary').get_json()
+        self.assertEqual(set(page['records'][0]), {'id', 'summary'})
+        self.assertEqual(self.client.get('/api/patient/p1/records?fields=bogus').status_code, 400)
+        self.assertEqual(self.client.get('/api/patient/p1/records?cursor=%%%').status_code, 400)
+
+    def test_streamed_response_matches(self):
+        resp = self.client.get('/api/patient/p1/records?stream=1&fields=id,created_at')
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.is_streamed)
+        streamed = json.loads(resp.get_data(as_text=True))
+        plain = self.client.get('/api/patient/p1/records?fields=id,created_at').get_json()
+        self.assertEqual(streamed, plain)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import unittest
+import io
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+from contextlib import redirect_stdout
+
+# Add parent directory to path to import app correctly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import migrations
+import search_service
+from app import app
+
+
+class RecordsSearchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        app.config['TESTING'] = True
+        app.config['DATABASE'] = os.path.join(self.tmp_dir, 'test.db')
+
+        conn = sqlite3.connect(app.config['DATABASE'])
+        with open('schema.sql', 'r') as f:
+            conn.executescript(f.read())
+        conn.execute("INSERT INTO hospitals (id, name, council_id, email, password_hash) VALUES ('h1', 'Apollo', 'C1', 'a@h.com', 'x')")
+        conn.execute("INSERT INTO insurance_companies (id, name, license_number, email, password_hash) VALUES ('ins1', 'INS1', 'LIC-1', 'ins1@test.com', 'x')")
+        for pid in ('p1', 'p2'):
+            conn.execute("INSERT INTO patients (id, full_name, dob) VALUES (?, ?, '1980-01-01')", (pid, pid.upper()))
+        conn.execute("INSERT INTO policies (id, patient_id, provider_id, policy_number, coverage_amount) VALUES ('pol1', 'p2', 'ins1', 'N-1', 5)")
+        # Existing records are indexed by the migration
+        records = [
+            ('m1', 'p1', 'text', 'Penicillin allergy', 'Rash after <b>amoxicillin</b>; avoid all penicillins.', '2024-01-05 10:00:00'),
+            ('m2', 'p1', 'prescription', 'Antibiotics', 'Prescribed azithromycin because of penicillin allergy.', '2024-03-01 10:00:00'),
+            ('m3', 'p1', 'lab_result', 'CBC', 'Normal white cell count.', '2024-06-01 10:00:00'),
+            ('m4', 'p2', 'text', 'Allergies', 'Peanut allergy, carries epinephrine.', '2024-02-01 10:00:00'),
+        ]
+        for r in records:
+            conn.execute("INSERT INTO medical_records (id, patient_id, hospital_id, record_type, title, description, created_at) VALUES (?, ?, 'h1', ?, ?, ?, ?)", r)
+        for i in range(25):
+            conn.execute("INSERT INTO medical_records (id, patient_id, record_type, title, description, created_at) VALUES (?, 'p1', 'text', 'Initial Medical Dataset', 'Placeholder', '2023-01-01 00:00:00')", (f'x{i:02d}',))
+        conn.commit()
+        conn.close()
+
+        self.client = app.test_client()
+        self.login('h1', 'hospital')
+
+    def tearDown(self):
+        database.close_pools()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def login(self, user_id, role):
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = user_id
+            sess['role'] = role
+
+    def search(self, query, status=200):
+        resp = self.client.get('/api/records/search?' + query)
+        self.assertEqual(resp.status_code, status, resp.get_json())
+        return resp.get_json()
+
+    def ids(self, query):
+        return [r['id'] for r in self.search(query)['results']]
+
+    def test_ranked_with_highlighted_snippets(self):
+        page = self.search('q=penicillin allergy')
+        # Title hits outrank description-only hits; stemming matches "allergies"/"penicillins"
+        self.assertEqual([r['id'] for r in page['results']], ['m1', 'm2'])
+        top = page['results'][0]
+        self.assertEqual(top['summary_highlight'], '<mark>Penicillin</mark> <mark>allergy</mark>')
+        self.assertIn('<mark>penicillins</mark>', top['snippet'])
+        # Record text is escaped; only the highlight markers are HTML
+        self.assertIn('&lt;b&gt;amoxicillin&lt;/b&gt;', top['snippet'])
+        self.assertEqual(top['hospital_name'], 'Apollo')
+        self.assertEqual(self.ids('q=allergies'), ['m4', 'm1', 'm2'])
+
+    def test_filters(self):
+        self.assertEqual(self.ids('q=allergy&patient_id=p2'), ['m4'])
+        self.assertEqual(self.ids('q=allergy&record_type=prescription'), ['m2'])
+        self.assertEqual(self.ids('q=allergy&patient_id=p1&from=2024-02-01&to=2024-03-01'), ['m2'])
+        self.assertEqual(self.ids('q="white cell"'), ['m3'])
+        self.assertEqual(self.ids('q="cell white"'), [])
+        self.assertEqual(self.ids('q=azithro*'), ['m2'])
+        # FTS syntax in user input is treated as words, not operators
+        self.assertEqual(self.ids('q=allergy OR NEAR(cbc) title:penicillin'), [])
+
+    def test_insurer_sees_only_policyholders(self):
+        self.login('ins1', 'insurance')
+        self.assertEqual(self.ids('q=allergy'), ['m4'])
+
+    def test_pagination_over_tied_scores(self):
+        seen, cursor = [], None
+        while True:
+            page = self.search('q=initial dataset&limit=7' + (f'&cursor={cursor}' if cursor else ''))
+            seen.extend(r['id'] for r in page['results'])
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, [f'x{i:02d}' for i in range(25)])
+
+    def test_bad_input(self):
+        self.assertIn('required', self.search('q=', 400)['error'])
+        self.search('q=***', 400)
+        self.search('q=x&record_type=xray', 400)
+        self.search('q=x&from=March', 400)
+        self.search('q=x&cursor=bad', 400)
+        self.client.get('/logout')
+        self.assertEqual(self.client.get('/api/records/search?q=x').status_code, 401)
+
+    def test_index_follows_writes(self):
+        self.client.post('/api/patient/p2/add', json={'data_payload': 'Severe latex allergy', 'summary': 'Latex'})
+        self.assertEqual(len(self.ids('q=latex')), 1)
+
+        with database.get_pool(app.config['DATABASE']).connection() as conn:
+            conn.execute("UPDATE medical_records SET description = 'Normal platelets' WHERE id = 'm3'")
+            conn.execute("DELETE FROM medical_records WHERE id = 'm4'")
+            conn.commit()
+            search_service.check_index(conn)
+            # Served by the FTS index and rowid/patient index lookups, never a records scan
+            self.assertEqual(migrations.check_query_plans(conn, {'search': ("""
+                SELECT m.id FROM medical_records_fts f JOIN medical_records m ON m.rowid = f.rowid
+                WHERE medical_records_fts MATCH ? AND m.patient_id = ?
+            """, ('"x"', 'p1'))}), {})
+        self.assertEqual(self.ids('q=platelets'), ['m3'])
+        self.assertEqual(self.ids('q="white cell"'), [])
+        self.assertEqual(self.ids('q=peanut'), [])
+
+        out = io.StringIO()
+        with redirect_stdout(out):
+            self.assertEqual(search_service.main(['--db', app.config['DATABASE'], '--rebuild', '--optimize']), 0)
+        self.assertIn('in sync', out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+import unittest
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import subprocess
+from unittest import mock
+
+# Add parent directory to path to import app correctly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cryptography.fernet import Fernet
+
+import database
+import rekey
+import scan_service
+import utils
+from app import app
+
+
+class Interrupted(Exception):
+    pass
+
+
+class RekeyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        app.config['TESTING'] = True
+        app.config['DATABASE'] = os.path.join(self.tmp_dir, 'test.db')
+        self.saved_keys = list(utils.KEYS)
+        self.old_key = Fernet.generate_key()
+        self.new_key = Fernet.generate_key()
+        utils.set_keys([self.old_key])
+
+        conn = sqlite3.connect(app.config['DATABASE'])
+        with open('schema.sql', 'r') as f:
+            conn.executescript(f.read())
+        self.nfc_payloads = {}
+        self.qr_payloads = {}
+        for n in range(25):
+            pid = f'p{n}'
+            payload = utils.encrypt_data({'pid': pid, 'type': 'nfc_access'})
+            self.nfc_payloads[pid] = payload
+            self.qr_payloads[f'q{n}'] = utils.encrypt_data(pid)
+            conn.execute("INSERT INTO patients (id, full_name, dob, generated_nfc_id) VALUES (?, 'Patient', '1990-01-01', ?)",
+                         (pid, payload))
+            conn.execute("INSERT INTO qr_records (id, patient_id, encrypted_payload) VALUES (?, ?, ?)",
+                         (f'q{n}', pid, self.qr_payloads[f'q{n}']))
+            conn.execute("INSERT INTO nfc_records (id, patient_id, tag_id, encrypted_payload, status) VALUES (?, ?, ?, ?, ?)",
+                         (f'n{n}', pid, f'TAG{n}', payload, 'revoked' if n == 24 else 'active'))
+        conn.execute("INSERT INTO nfc_records (id, patient_id, tag_id, encrypted_payload) VALUES ('bad', 'p0', 'TAGBAD', 'not-a-token')")
+        conn.commit()
+        conn.close()
+
+        self.pool = database.get_pool(app.config['DATABASE'])
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = 'admin1'
+            sess['role'] = 'admin'
+
+    def tearDown(self):
+        utils.set_keys(self.saved_keys)
+        scan_service._caches.clear()
+        database.close_pools()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def run_rekey(self, **kwargs):
+        with self.pool.connection() as conn:
+            return rekey.rekey(conn, chunk_size=7, workers=2, log=lambda *args: None, **kwargs)
+
+    def fetch(self, sql):
+        with self.pool.connection() as conn:
+            return conn.execute(sql).fetchall()
+
+    def test_rotation_rewrites_tag_payloads_under_the_new_key(self):
+        utils.set_keys([self.new_key, self.old_key])
+        results = self.run_rekey()
+        self.assertEqual(sorted(results), ['nfc_records.encrypted_payload', 'patients.generated_nfc_id'])
+        self.assertEqual(results['nfc_records.encrypted_payload'], {'rotated': 24, 'unreadable': 1, 'done': True})
+        # Patients followed their tag; only the revoked tag's patient is left for the patients pass
+        self.assertEqual(results['patients.generated_nfc_id']['rotated'], 1)
+
+        # Tag payloads are readable under the new key alone
+        utils.set_keys([self.new_key])
+        for row in self.fetch("SELECT n.patient_id, n.encrypted_payload, n.issued_payload, p.generated_nfc_id "
+                              "FROM nfc_records n JOIN patients p ON p.id = n.patient_id WHERE n.status = 'active' AND n.id != 'bad'"):
+            self.assertEqual(utils.decrypt_data(row['encrypted_payload'])['pid'], row['patient_id'])
+            self.assertEqual(row['issued_payload'], self.nfc_payloads[row['patient_id']])
+            self.assertEqual(row['generated_nfc_id'], row['encrypted_payload'])
+        # A revoked tag keeps the ciphertext it was issued with
+        revoked = self.fetch("SELECT encrypted_payload, issued_payload FROM nfc_records WHERE id = 'n24'")[0]
+        self.assertEqual(tuple(revoked), (self.nfc_payloads['p24'], None))
+        # QR payloads are what's printed on cards: left as issued, so /qr/<id> and its ETag don't change
+        self.assertEqual({r['id']: r['encrypted_payload'] for r in self.fetch("SELECT id, encrypted_payload FROM qr_records")},
+                         self.qr_payloads)
+        self.assertEqual(self.fetch("SELECT encrypted_payload FROM nfc_records WHERE id = 'bad'")[0][0], 'not-a-token')
+
+    def test_cards_and_tags_issued_before_rotation_still_scan(self):
+        card, tag = self.qr_payloads['q3'], self.nfc_payloads['p3']
+        utils.set_keys([self.new_key, self.old_key])
+        self.run_rekey()
+        # A second rotation: the original key no longer encrypts anything but stays in the ring
+        utils.set_keys([Fernet.generate_key(), self.new_key, self.old_key])
+        self.run_rekey()
+        for payload in (card, tag):
+            resp = self.client.post('/api/patient/scan', json={'data': payload})
+            self.assertEqual(resp.get_json()['patient_id'], 'p3')
+
+        # Removing it outright is what would strand them
+        utils.set_keys([self.new_key])
+        self.assertIsNone(utils.decrypt_data(card))
+
+    def test_interrupted_run_resumes(self):
+        utils.set_keys([self.new_key, self.old_key])
+        calls = []
+
+        def interrupt(message):
+            calls.append(message)
+            if len(calls) == 2:
+                raise Interrupted()
+
+        with self.pool.connection() as conn:
+            with self.assertRaises(Interrupted):
+                rekey.rekey(conn, chunk_size=7, log=interrupt)
+            state = {r['target']: r for r in rekey.progress(conn)}
+        nfc = state['nfc_records.encrypted_payload']
+        self.assertEqual((nfc['rotated'], nfc['completed_at']), (14, None))
+        self.assertTrue(nfc['current_key'])
+
+        results = self.run_rekey()
+        self.assertEqual(results['nfc_records.encrypted_payload']['rotated'], 24)
+        # Done targets are skipped; a new primary key starts them over
+        again = self.run_rekey()
+        self.assertEqual(again['nfc_records.encrypted_payload']['rotated'], 24)
+        utils.set_keys([Fernet.generate_key(), self.new_key, self.old_key])
+        self.assertEqual(self.run_rekey()['nfc_records.encrypted_payload']['rotated'], 24)
+
+    def test_revoked_tag_refused_by_issued_payload(self):
+        utils.set_keys([self.new_key, self.old_key])
+        old_payload = self.nfc_payloads['p3']
+        self.assertEqual(self.client.post('/api/patient/scan', json={'data': old_payload}).status_code, 200)
+        self.run_rekey()
+
+        # The physical tag still carries the old ciphertext
+        self.assertEqual(self.client.post('/api/nfc/TAG3/revoke').status_code, 200)
+        resp = self.client.post('/api/patient/scan', json={'data': old_payload})
+        self.assertEqual(resp.status_code, 403)
+
+    def test_batch_helpers_keep_order(self):
+        values = [f'value-{n}' for n in range(300)]
+        tokens = utils.encrypt_many(values, workers=4)
+        self.assertEqual(utils.decrypt_many(tokens, workers=4), values)
+        self.assertEqual(utils.decrypt_many(['garbage', None]), [None, None])
+
+        self.assertIsNone(utils.rotate_token(tokens[0]))
+        utils.set_keys([self.new_key, self.old_key])
+        rotated = utils.rotate_token(tokens[0])
+        self.assertIsNone(utils.rotate_token(rotated))
+        utils.set_keys([self.new_key])
+        self.assertEqual(utils.decrypt_data(rotated), 'value-0')
+
+    def test_add_key_prepends_to_key_file(self):
+        path = os.path.join(self.tmp_dir, 'secret.key')
+        with open(path, 'wb') as f:
+            f.write(self.old_key)
+        key = rekey.add_key(path)
+        with open(path) as f:
+            self.assertEqual(utils.parse_keys(f.read()), [key, self.old_key])
+        self.assertEqual(utils.KEYS, [key, self.old_key])
+
+
+    def test_several_keys_need_a_pinned_tag_mac_secret(self):
+        env = {k: v for k, v in os.environ.items() if k != 'TAG_MAC_SECRET'}
+        env['ENCRYPTION_KEY'] = f'{self.new_key.decode()},{self.old_key.decode()}'
+        check = [sys.executable, '-c', 'import utils; print(utils.tag_mac("TAG1"))']
+        cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+        failed = subprocess.run(check, env=env, cwd=cwd, capture_output=True, text=True)
+        self.assertNotEqual(failed.returncode, 0)
+        self.assertIn('TAG_MAC_SECRET', failed.stderr)
+
+        # Pinned to the original key, MACs match the ones issued while it was the only key
+        single = subprocess.run(check, env=dict(env, ENCRYPTION_KEY=self.old_key.decode()), cwd=cwd,
+                                capture_output=True, text=True, check=True)
+        pinned = subprocess.run(check, env=dict(env, TAG_MAC_SECRET=self.old_key.decode()), cwd=cwd,
+                                capture_output=True, text=True, check=True)
+        self.assertEqual(pinned.stdout, single.stdout)
+
+        with mock.patch('utils.TAG_MAC_SECRET', b''), mock.patch('rekey.add_key') as add_key:
+            self.assertEqual(rekey.main(['--add-key']), 1)
+            add_key.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
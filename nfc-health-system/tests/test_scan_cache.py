@@ -0,0 +1,190 @@
+import unittest
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+from unittest import mock
+
+# Add parent directory to path to import app correctly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import scan_service
+from app import app
+from utils import encrypt_data, tag_mac
+
+
+class ScanCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        app.config['TESTING'] = True
+        app.config['DATABASE'] = os.path.join(self.tmp_dir, 'test.db')
+
+        self.nfc_payload = encrypt_data({'pid': 'p1', 'type': 'nfc_access'})
+        conn = sqlite3.connect(app.config['DATABASE'])
+        with open('schema.sql', 'r') as f:
+            conn.executescript(f.read())
+        conn.execute("INSERT INTO patients (id, full_name, dob) VALUES ('p1', 'Patient One', '1990-01-01')")
+        conn.execute("INSERT INTO patients (id, full_name, dob) VALUES ('p2', 'Patient Two', '1990-01-01')")
+        conn.execute("INSERT INTO nfc_records (id, patient_id, tag_id, encrypted_payload) VALUES ('n1', 'p1', 'TAG1', ?)",
+                     (self.nfc_payload,))
+        conn.commit()
+        conn.close()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = 'admin1'
+            sess['role'] = 'admin'
+
+    def tearDown(self):
+        scan_service._caches.clear()
+        database.close_pools()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def scan(self, payload):
+        return self.client.post('/api/patient/scan', json={'data': payload})
+
+    def scan_tag(self, tag_id, mac):
+        return self.client.post('/api/patient/scan', json={'tag_id': tag_id, 'mac': mac})
+
+    def stats(self):
+        return self.client.get('/api/patient/scan/stats').get_json()
+
+    def test_repeat_scans_skip_decrypt_and_db(self):
+        with mock.patch('scan_service.decrypt_data', wraps=scan_service.decrypt_data) as decrypt, \
+                mock.patch('scan_service.query_in', wraps=scan_service.query_in) as query:
+            for _ in range(5):
+                resp = self.scan(self.nfc_payload)
+                self.assertEqual(resp.status_code, 200)
+                self.assertEqual(resp.get_json(), {'patient_id': 'p1', 'redirect': '/patient/p1/view'})
+            self.assertEqual(decrypt.call_count, 1)
+            self.assertEqual(query.call_count, 3)   # Revocation checks (current + issued payload) + patient lookup, once
+
+        stats = self.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (4, 1, 1))
+
+    def test_revoked_tag_is_refused_immediately(self):
+        self.assertEqual(self.scan(self.nfc_payload).status_code, 200)
+        resp = self.client.post('/api/nfc/TAG1/revoke')
+        self.assertEqual(resp.get_json()['revoked'], 1)
+
+        resp = self.scan(self.nfc_payload)
+        self.assertEqual(resp.status_code, 403)
+        self.assertEqual(self.stats()['invalidations'], 1)
+        self.assertEqual(self.client.post('/api/nfc/TAG1/revoke').status_code, 404)
+
+    def test_merged_patient_resolves_to_survivor(self):
+        qr_payload = encrypt_data('p2')
+        self.assertEqual(self.scan(qr_payload).get_json()['patient_id'], 'p2')
+
+        resp = self.client.post('/api/admin/patients/merge', json={'source_id': 'p2', 'target_id': 'p1'})
+        self.assertEqual(resp.status_code, 200)
+        # Cached 'p2' entry was dropped; the old card now lands on p1
+        self.assertEqual(self.scan(qr_payload).get_json()['patient_id'], 'p1')
+        self.assertEqual(self.client.post('/api/admin/patients/merge',
+                                          json={'source_id': 'p2', 'target_id': 'p1'}).status_code, 400)
+
+    def test_revocation_in_another_process_is_seen(self):
+        qr_payload = encrypt_data('p2')
+        self.assertEqual(self.scan(self.nfc_payload).status_code, 200)
+        self.assertEqual(self.scan(qr_payload).get_json()['patient_id'], 'p2')
+        self.assertEqual(self.stats()['size'], 2)
+
+        # Another worker revokes the tag and merges p2; this process's cache wasn't told
+        conn = sqlite3.connect(app.config['DATABASE'])
+        conn.execute("UPDATE nfc_records SET status = 'revoked' WHERE tag_id = 'TAG1'")
+        conn.execute("UPDATE patients SET merged_into = 'p1' WHERE id = 'p2'")
+        conn.commit()
+        conn.close()
+
+        self.assertEqual(self.scan(self.nfc_payload).status_code, 403)
+        self.assertEqual(self.scan(qr_payload).get_json()['patient_id'], 'p1')
+        stats = self.stats()
+        self.assertEqual((stats['resyncs'], stats['invalidations']), (1, 0))
+
+        # Unrelated writes leave the generation, and the cache, alone
+        self.assertEqual(self.scan(qr_payload).get_json()['patient_id'], 'p1')
+        with database.get_pool(app.config['DATABASE']).connection() as conn:
+            conn.execute("UPDATE patients SET full_name = 'Renamed' WHERE id = 'p1'")
+            conn.commit()
+        self.scan(qr_payload)
+        stats = self.stats()
+        self.assertEqual((stats['resyncs'], stats['hits']), (1, 2))
+
+    def test_raw_json_and_invalid_payloads(self):
+        resp = self.scan('{"patient_id": "p2", "name": "Two"}')
+        self.assertEqual(resp.get_json()['patient_id'], 'p2')
+        self.assertEqual(self.scan('{"name": "nobody"}').status_code, 400)
+
+    def test_batch_resolves_in_input_order(self):
+        self.scan(self.nfc_payload)   # Warm one entry
+        payloads = [encrypt_data('p2'), self.nfc_payload, encrypt_data({'pid': 'new-1', 'name': 'Walk In'}),
+                    '{"name": "nobody"}', encrypt_data('p2'), encrypt_data('new-2'), 42]
+        with mock.patch('scan_service.query_in', wraps=scan_service.query_in) as query:
+            resp = self.client.post('/api/patient/scan/batch', json={'payloads': payloads})
+            # Revocation checks (current + issued payload), one patient lookup, one re-read after the auto-sync insert
+            self.assertEqual(query.call_count, 4)
+        self.assertEqual(resp.status_code, 200)
+        results = resp.get_json()['results']
+
+        self.assertEqual([r.get('patient_id') for r in results], ['p2', 'p1', 'new-1', None, 'p2', 'new-2', None])
+        self.assertEqual([r.get('status') for r in results], [None, None, None, 400, None, None, 400])
+        with database.get_pool(app.config['DATABASE']).connection() as conn:
+            name = conn.execute("SELECT full_name FROM patients WHERE id = 'new-1'").fetchone()[0]
+        self.assertEqual(name, 'Walk In')
+
+        self.assertEqual(self.client.post('/api/patient/scan/batch', json={'payloads': []}).status_code, 400)
+        too_many = ['x'] * (scan_service.MAX_BATCH + 1)
+        self.assertEqual(self.client.post('/api/patient/scan/batch', json={'payloads': too_many}).status_code, 400)
+
+    def test_tag_fast_path_skips_decryption(self):
+        with mock.patch('scan_service.decrypt_data') as decrypt, \
+                mock.patch('scan_service.query_db', wraps=scan_service.query_db) as query:
+            resp = self.scan_tag('ta:g1', tag_mac('TAG1'))
+            self.assertEqual(resp.get_json(), {'patient_id': 'p1', 'redirect': '/patient/p1/view'})
+            self.assertEqual(query.call_count, 1)
+            decrypt.assert_not_called()
+
+        self.assertEqual(self.scan_tag('TAG1', '0' * 32).status_code, 403)
+        self.assertEqual(self.scan_tag('TAG1', None).status_code, 403)
+        self.assertEqual(self.scan_tag('NOPE', tag_mac('NOPE')).status_code, 404)
+
+        self.client.post('/api/nfc/TAG1/revoke')
+        resp = self.scan_tag('TAG1', tag_mac('TAG1'))
+        self.assertEqual(resp.status_code, 403)
+        self.assertIn('revoked', resp.get_json()['error'])
+
+    def test_replaced_tag(self):
+        self.assertEqual(self.client.get('/api/nfc/TAG1/provision').get_json()['mac'], tag_mac('TAG1'))
+        resp = self.client.post('/api/nfc/TAG1/replace')
+        self.assertEqual(resp.status_code, 201)
+        new_tag = resp.get_json()
+
+        self.assertEqual(self.scan_tag(new_tag['tag_id'], new_tag['mac']).get_json()['patient_id'], 'p1')
+        self.assertEqual(self.scan(new_tag['payload']).get_json()['patient_id'], 'p1')
+        # Both the old UID and the old payload are refused
+        self.assertEqual(self.scan_tag('TAG1', tag_mac('TAG1')).status_code, 410)
+        self.assertEqual(self.scan(self.nfc_payload).status_code, 410)
+        self.assertEqual(self.client.post('/api/nfc/TAG1/replace').status_code, 404)
+
+    def test_lru_and_ttl_bounds(self):
+        cache = scan_service.ScanCache(max_size=2, ttl=0.05)
+        for i in range(3):
+            cache.put(f'd{i}', f'p{i}', {'patient_id': f'p{i}'})
+        self.assertIsNone(cache.get('d0'))
+        self.assertEqual(cache.get('d2'), {'patient_id': 'p2'})
+        time.sleep(0.06)
+        self.assertIsNone(cache.get('d2'))
+        self.assertEqual(cache.stats()['expired'], 1)
+
+        # A result computed before an invalidation is not cached
+        generation = cache.generation
+        cache.invalidate_patient('p9')
+        self.assertFalse(cache.put('d9', 'p9', {}, generation))
+
+
+if __name__ == '__main__':
+    unittest.main()
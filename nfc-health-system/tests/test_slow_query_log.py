@@ -0,0 +1,130 @@
+import unittest
+import os
+import sys
+import json
+import shutil
+import sqlite3
+import tempfile
+
+# Add parent directory to path to import app correctly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import metrics
+import slow_query_log
+from app import app
+
+
+class SlowQueryLogTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        app.config['TESTING'] = True
+        app.config['DATABASE'] = os.path.join(self.tmp_dir, 'test.db')
+        self.log_path = os.path.join(self.tmp_dir, 'slow.log')
+
+        conn = sqlite3.connect(app.config['DATABASE'])
+        with open('schema.sql', 'r') as f:
+            conn.executescript(f.read())
+        conn.execute("INSERT INTO hospitals (id, name, council_id, email, password_hash) VALUES ('h1', 'Apollo', 'C1', 'a@h.com', 'x')")
+        conn.execute("INSERT INTO patients (id, full_name, dob) VALUES ('p1', 'Secret Name', '1990-01-01')")
+        conn.commit()
+        conn.close()
+
+        # Log everything: every statement is "slow" at a 0ms threshold
+        slow_query_log.configure(threshold_ms=0, log_interval=60, log_path=self.log_path)
+        metrics.reset()
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = 'h1'
+            sess['role'] = 'hospital'
+
+    def tearDown(self):
+        slow_query_log.init_app(app)
+        database.close_pools()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def entries(self, sql=None):
+        if not os.path.exists(self.log_path):
+            return []
+        with open(self.log_path) as f:
+            found = [json.loads(line) for line in f]
+        if sql is not None:
+            statement = metrics.fingerprint(sql)[0]
+            found = [e for e in found if e['statement'] == statement]
+        return found
+
+    def test_entry_has_plan_and_param_shapes_but_no_values(self):
+        resp = self.client.post('/api/patient/p1/add', json={'data_payload': 'BP 120/80', 'summary': 'Checkup'})
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(self.client.get('/api/patient/p1/records?limit=5').status_code, 200)
+
+        entries = [e for e in self.entries() if e['op'] == 'SELECT' and e['table'] == 'medical_records'
+                   and e.get('route') == 'GET /api/patient/<patient_id>/records']
+        self.assertTrue(entries)
+        entry = entries[0]
+        self.assertEqual(entry['event'], 'slow_query')
+        self.assertIn('str(2)', entry['params'])
+        self.assertGreaterEqual(entry['duration_ms'], 0)
+        self.assertIsNone(entry['rows'])   # Streamed through a cursor, so the count isn't known
+        self.assertTrue(any('medical_records' in line for line in entry['plan']))
+
+        with open(self.log_path) as f:
+            text = f.read()
+        for value in ('BP 120/80', 'Checkup', 'Secret Name'):
+            self.assertNotIn(value, text)
+
+    def test_rate_limited_per_fingerprint(self):
+        sql = "SELECT id FROM patients WHERE id = ?"
+        with app.app_context():
+            for _ in range(3):
+                database.query_db(sql, ('p1',))
+            # Different literal, same fingerprint
+            database.query_db("SELECT id FROM patients WHERE id = 'p1'")
+        self.assertEqual(len(self.entries(sql)), 1)
+
+        slow_query_log.interval = 0
+        with app.app_context():
+            database.query_db(sql, ('p1',))
+        entries = self.entries(sql)
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[1]['suppressed'], 3)
+        # Every slow execution is counted, logged or not
+        text = metrics.render()
+        self.assertIn(f'sqlite_slow_statements_total{{statement="{entries[0]["statement"]}",op="SELECT",table="patients"}} 5', text)
+
+    def test_in_lists_collapse_to_one_shape(self):
+        with app.app_context():
+            database.query_in("SELECT id FROM patients WHERE id IN {in}", [f'p{i}' for i in range(1, 41)])
+        entry = self.entries("SELECT id FROM patients WHERE id IN (?, ?)")[0]
+        self.assertEqual(entry['sql'], 'SELECT id FROM patients WHERE id IN (?...)')
+        self.assertEqual(entry['params'], ['str(2) x9', 'str(3) x31'])
+
+    def test_failed_statement_is_logged_with_error(self):
+        with app.app_context():
+            with self.assertRaises(sqlite3.OperationalError):
+                database.query_db("SELECT * FROM no_such_table WHERE id = ?", ('x',))
+        entry = self.entries("SELECT * FROM no_such_table WHERE id = ?")[0]
+        self.assertIn('no such table', entry['error'])
+        self.assertNotIn('plan', entry)
+
+    def test_threshold_filters_and_negative_disables(self):
+        slow_query_log.configure(threshold_ms=10000, log_path=self.log_path)
+        with app.app_context():
+            database.query_db("SELECT COUNT(*) FROM patients")
+        self.assertEqual(self.entries(), [])
+
+        slow_query_log.configure(threshold_ms=-1, log_path=self.log_path)
+        with app.app_context():
+            database.query_db("SELECT COUNT(*) FROM patients")
+        self.assertFalse(os.path.exists(self.log_path))
+
+    def test_param_shapes(self):
+        self.assertEqual(slow_query_log.param_shapes(('abc', 3, None, 2.5, b'xy')),
+                         ['str(3)', 'int', 'null', 'float', 'bytes(2)'])
+        self.assertEqual(slow_query_log.param_shapes({'id': 'p1'}), {'id': 'str(2)'})
+        self.assertIsNone(slow_query_log.param_shapes(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
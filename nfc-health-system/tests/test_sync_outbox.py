@@ -0,0 +1,199 @@
+import unittest
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+
+# Add parent directory to path to import app correctly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import sync_outbox
+from app import app
+from supabase_sync import SupabaseRestClient, SupabaseSyncError
+from tests.supabase_stub import SupabaseStub
+
+
+class SyncOutboxTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.stub = SupabaseStub().start()
+        app.config['TESTING'] = True
+        app.config['DATABASE'] = os.path.join(self.tmp_dir, 'test.db')
+        self.saved_config = {k: app.config.get(k) for k in ('SUPABASE_URL', 'SUPABASE_SERVICE_ROLE_KEY')}
+        app.config['SUPABASE_URL'] = self.stub.url
+        app.config['SUPABASE_SERVICE_ROLE_KEY'] = 'service-key'
+
+        conn = sqlite3.connect(app.config['DATABASE'])
+        with open('schema.sql', 'r') as f:
+            conn.executescript(f.read())
+        conn.execute("INSERT INTO hospitals (id, name, council_id, email, password_hash) VALUES ('h1', 'Apollo', 'C1', 'a@h.com', 'x')")
+        conn.execute("INSERT INTO patients (id, full_name, dob) VALUES ('p1', 'Patient', '1990-01-01')")
+        conn.commit()
+        conn.close()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = 'h1'
+            sess['role'] = 'hospital'
+
+    def tearDown(self):
+        app.config.update(self.saved_config)
+        self.stub.stop()
+        database.close_pools()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def add_record(self, summary):
+        resp = self.client.post('/api/patient/p1/add', json={'data_payload': 'BP 120/80', 'summary': summary})
+        self.assertEqual(resp.status_code, 201)
+
+    def outbox_rows(self):
+        with database.get_pool(app.config['DATABASE']).connection() as conn:
+            return conn.execute("SELECT * FROM sync_outbox ORDER BY id").fetchall()
+
+    def test_request_does_not_wait_for_supabase(self):
+        self.stub.delay = 2.0
+        start = time.time()
+        self.add_record('Checkup')
+        self.assertLess(time.time() - start, 1.0)
+        self.assertEqual(self.stub.requests, [])
+        rows = self.outbox_rows()
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['target_table'], 'medical_records')
+
+    def test_failed_batch_is_retried_with_backoff(self):
+        for i in range(3):
+            self.add_record(f'Visit {i}')
+        worker = sync_outbox.SyncWorker(app.config['DATABASE'], SupabaseRestClient(self.stub.url, 'service-key'))
+        pool = database.get_pool(app.config['DATABASE'])
+
+        self.stub.fail_next = 1
+        with pool.connection() as conn:
+            self.assertEqual(sync_outbox.drain_once(conn, worker.send), (0, 3))
+            # Not due yet: backoff pushed next_attempt_at into the future
+            self.assertEqual(sync_outbox.drain_once(conn, worker.send), (0, 0))
+        rows = self.outbox_rows()
+        self.assertEqual([r['attempts'] for r in rows], [1, 1, 1])
+        self.assertIn('503', rows[0]['last_error'])
+
+        with pool.connection() as conn:
+            sent, failed = sync_outbox.drain_once(conn, worker.send, now=time.time() + sync_outbox.BACKOFF_MAX * 2)
+        self.assertEqual((sent, failed), (3, 0))
+        self.assertEqual(self.outbox_rows(), [])
+        # One array insert for the whole batch
+        self.assertEqual([(t, n) for t, n, _ in self.stub.requests], [('medical_records', 3)])
+        self.assertEqual(sorted(r['title'] for r in self.stub.rows['medical_records']), ['Visit 0', 'Visit 1', 'Visit 2'])
+
+    def test_rejected_rows_are_isolated_and_dead_lettered(self):
+        for i in range(7):
+            self.add_record(f'Visit {i}')
+        worker = sync_outbox.SyncWorker(app.config['DATABASE'], SupabaseRestClient(self.stub.url, 'service-key'))
+        self.stub.reject_if = lambda row: row['title'] in ('Visit 2', 'Visit 5')
+
+        with database.get_pool(app.config['DATABASE']).connection() as conn:
+            self.assertEqual(sync_outbox.drain_once(conn, worker.send), (5, 2))
+            self.assertEqual((sync_outbox.pending_count(conn), sync_outbox.dead_count(conn)), (0, 2))
+            # Dead rows are never claimed again
+            self.assertEqual(sync_outbox.drain_once(conn, worker.send, now=time.time() + 10 ** 6), (0, 0))
+        self.assertEqual(sorted(r['title'] for r in self.stub.rows['medical_records']),
+                         ['Visit 0', 'Visit 1', 'Visit 3', 'Visit 4', 'Visit 6'])
+        rows = self.outbox_rows()
+        self.assertEqual([r['status'] for r in rows], ['dead', 'dead'])
+        self.assertIn('409', rows[0]['last_error'])
+
+    def test_rows_failing_past_max_attempts_go_dead(self):
+        self.add_record('Visit')
+        worker = sync_outbox.SyncWorker(app.config['DATABASE'], SupabaseRestClient(self.stub.url, 'service-key'))
+        with database.get_pool(app.config['DATABASE']).connection() as conn:
+            conn.execute("UPDATE sync_outbox SET attempts = ?", (sync_outbox.MAX_ATTEMPTS - 1,))
+            conn.commit()
+            self.stub.fail_next = 1
+            self.assertEqual(sync_outbox.drain_once(conn, worker.send), (0, 1))
+            self.assertEqual(sync_outbox.dead_count(conn), 1)
+        self.assertEqual(self.outbox_rows()[0]['attempts'], sync_outbox.MAX_ATTEMPTS)
+
+    def test_auth_failure_retries_without_dead_lettering(self):
+        for i in range(4):
+            self.add_record(f'Visit {i}')
+        worker = sync_outbox.SyncWorker(app.config['DATABASE'], SupabaseRestClient(self.stub.url, 'rotated-key'))
+        self.stub.fail_status, self.stub.fail_next = 401, 100
+
+        with database.get_pool(app.config['DATABASE']).connection() as conn:
+            conn.execute("UPDATE sync_outbox SET attempts = ?", (sync_outbox.MAX_ATTEMPTS - 1,))
+            conn.commit()
+            self.assertEqual(sync_outbox.drain_once(conn, worker.send), (0, 4))
+            self.assertEqual((sync_outbox.pending_count(conn), sync_outbox.dead_count(conn)), (4, 0))
+        # One request for the batch: a 401 isn't bisected row by row
+        self.assertEqual(self.stub.fail_next, 99)
+        self.assertIn('401', self.outbox_rows()[0]['last_error'])
+
+    def test_dead_rows_can_be_requeued(self):
+        for i in range(3):
+            self.add_record(f'Visit {i}')
+        worker = sync_outbox.SyncWorker(app.config['DATABASE'], SupabaseRestClient(self.stub.url, 'service-key'))
+        self.stub.reject_if = lambda row: True
+        with database.get_pool(app.config['DATABASE']).connection() as conn:
+            self.assertEqual(sync_outbox.drain_once(conn, worker.send), (0, 3))
+            first = self.outbox_rows()[0]['id']
+            self.assertEqual(sync_outbox.requeue_dead(conn, ids=[first]), 1)
+            self.assertEqual(sync_outbox.requeue_dead(conn, target_table='policies'), 0)
+
+            # Supabase fixed: the replayed row goes through, the others stay dead
+            self.stub.reject_if = None
+            self.assertEqual(sync_outbox.drain_once(conn, worker.send), (1, 0))
+            self.assertEqual(sync_outbox.requeue_dead(conn), 2)
+            self.assertEqual(sync_outbox.drain_once(conn, worker.send), (2, 0))
+        self.assertEqual(self.outbox_rows(), [])
+
+    def test_worker_drains_in_background(self):
+        self.add_record('Background')
+        worker = sync_outbox.SyncWorker(app.config['DATABASE'], SupabaseRestClient(self.stub.url, 'service-key'), interval=0.05)
+        worker.start()
+        try:
+            deadline = time.time() + 5
+            while self.outbox_rows() and time.time() < deadline:
+                time.sleep(0.05)
+        finally:
+            worker.stop(timeout=5)
+        self.assertEqual(self.outbox_rows(), [])
+        self.assertEqual(self.stub.rows['medical_records'][0]['title'], 'Background')
+
+
+class SupabaseRestClientTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = SupabaseStub().start()
+        self.client = SupabaseRestClient(self.stub.url, 'service-key', max_batch=500)
+
+    def tearDown(self):
+        self.client.close()
+        self.stub.stop()
+
+    def test_bulk_upsert_chunks_over_one_connection(self):
+        rows = [{'id': f'r{i}', 'title': 't'} for i in range(1200)]
+        self.assertEqual(self.client.upsert('medical_records', rows), 1200)
+
+        self.assertEqual([n for _, n, _ in self.stub.requests], [500, 500, 200])
+        self.assertEqual(len(self.stub.rows['medical_records']), 1200)
+        headers = self.stub.requests[0][2]
+        self.assertEqual(headers['Authorization'], 'Bearer service-key')
+        self.assertIn('resolution=merge-duplicates', headers['Prefer'])
+        # Keep-alive: every chunk reused the same pooled connection
+        self.assertEqual(len(self.stub.client_ports), 1)
+
+        m = self.client.metrics.snapshot()
+        self.assertEqual((m['requests'], m['rows'], m['max_batch_size'], m['failures']), (3, 1200, 500, 0))
+
+    def test_failure_raises_and_is_counted(self):
+        self.stub.fail_next = 1
+        with self.assertRaises(SupabaseSyncError) as ctx:
+            self.client.insert('medical_records', [{'id': 'x'}])
+        self.assertEqual(ctx.exception.status_code, 503)
+        self.assertEqual(self.client.metrics.snapshot()['failures'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,34 +1,86 @@
+import io
+import csv
 import uuid
 import json
+import hmac
+import base64
+import hashlib
+import functools
 from werkzeug.security import generate_password_hash, check_password_hash
-from cryptography.fernet import Fernet
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
 import os
 
-# Load or Generate Key
+# Load or Generate Keys. ENCRYPTION_KEY (comma-separated) or secret.key (one per
+# line) may list several Fernet keys, newest first: new data is encrypted with
+# the first and any of them decrypts, so a new key can be put in front while
+# the older ones stay on, decrypt-only, for cards and tags issued under them.
 KEY_FILE = 'secret.key'
+CRYPTO_WORKERS = min(8, os.cpu_count() or 1)  # Threads for batch encrypt/decrypt (cryptography releases the GIL)
+CRYPTO_PARALLEL_MIN = 64                      # Smaller batches run inline; a pool costs more than it saves
+
+def parse_keys(text):
+    return [k.encode() for k in text.replace(',', ' ').split()]
+
 enc_key = os.environ.get('ENCRYPTION_KEY')
 
 if enc_key:
-    SECRET_KEY = enc_key.encode()
+    KEYS = parse_keys(enc_key)
 elif os.path.exists(KEY_FILE):
-    with open(KEY_FILE, 'rb') as f:
-        SECRET_KEY = f.read()
+    with open(KEY_FILE, 'r') as f:
+        KEYS = parse_keys(f.read())
 else:
-    SECRET_KEY = Fernet.generate_key()
+    KEYS = [Fernet.generate_key()]
     with open(KEY_FILE, 'wb') as f:
-        f.write(SECRET_KEY)
+        f.write(KEYS[0])
+
+SECRET_KEY = KEYS[0]
+_primary = Fernet(SECRET_KEY)
+cipher_suite = MultiFernet([Fernet(k) for k in KEYS])
+
+# Separate key for NFC tag MACs, derived so it never equals a Fernet key. MACs
+# are written onto physical tags, so this must not follow rotation: it comes
+# from the only key while there is one, and from TAG_MAC_SECRET (set to that
+# original key to keep issued tags valid) as soon as the ring has more.
+TAG_MAC_SECRET = os.environ.get('TAG_MAC_SECRET', '').encode()
+if not TAG_MAC_SECRET and len(KEYS) > 1:
+    raise RuntimeError("TAG_MAC_SECRET must be set when more than one encryption key is configured; "
+                       "set it to the original key (the last one) to keep issued NFC tags valid")
+TAG_MAC_KEY = hashlib.sha256(b'nfc-tag-mac:' + (TAG_MAC_SECRET or KEYS[0])).digest()
+TAG_MAC_LENGTH = 32  # Hex chars (128 bits), short enough to write next to the UID on a tag
 
-cipher_suite = Fernet(SECRET_KEY)
+def set_keys(keys):
+    """Swap the key ring (newest first) for this process, e.g. for a re-key run."""
+    global KEYS, SECRET_KEY, _primary, cipher_suite
+    keys = [k.encode() if isinstance(k, str) else k for k in keys]
+    cipher_suite = MultiFernet([Fernet(k) for k in keys])
+    KEYS, SECRET_KEY, _primary = keys, keys[0], Fernet(keys[0])
+
+def key_id(key=None):
+    """Short, non-secret identifier of a key (default: the current primary)."""
+    return hashlib.sha256(key or SECRET_KEY).hexdigest()[:12]
 
 def generate_uuid():
     return str(uuid.uuid4())
 
-def hash_password(password):
+def hash_password(password, method=None):
+    """`method` is a werkzeug hash spec, e.g. 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000' (None = werkzeug's default)."""
+    if method:
+        return generate_password_hash(password, method)
     return generate_password_hash(password)
 
 def verify_password(stored_hash, password):
     return check_password_hash(stored_hash, password)
 
+@functools.lru_cache(maxsize=8)
+def _hash_params(method):
+    # werkzeug expands short specs ('scrypt', 'pbkdf2') to full parameters; read them off a sample hash
+    return hash_password('', method).split('$', 1)[0]
+
+def needs_rehash(stored_hash, method=None):
+    """True if `stored_hash` was made with different algorithm/cost parameters than `method`."""
+    return stored_hash.split('$', 1)[0] != _hash_params(method or None)
+
 def encrypt_data(data):
     if not data: return None
     if isinstance(data, dict) or isinstance(data, list):
@@ -47,3 +99,117 @@ def decrypt_data(encrypted_data):
     except Exception as e:
         print(f"Decryption error: {e}")
         return None
+
+def rotate_token(token):
+    """Re-encrypt `token` under the primary key; None if it already is. Raises InvalidToken if no key reads it."""
+    data = token.encode('utf-8') if isinstance(token, str) else token
+    try:
+        _primary.extract_timestamp(data)  # HMAC check only, no AES
+        return None
+    except InvalidToken:
+        pass
+    return cipher_suite.rotate(data).decode('utf-8')
+
+def parallel_map(fn, values, workers=None):
+    """[fn(v) for v in values], split into one slice per thread for large batches."""
+    values = list(values)
+    workers = min(workers or CRYPTO_WORKERS, len(values))
+    if workers <= 1 or len(values) < CRYPTO_PARALLEL_MIN:
+        return [fn(v) for v in values]
+    size = -(-len(values) // workers)
+    slices = [values[i:i + size] for i in range(0, len(values), size)]
+    with ThreadPoolExecutor(max_workers=len(slices)) as ex:
+        return [out for part in ex.map(lambda vs: [fn(v) for v in vs], slices) for out in part]
+
+def encrypt_many(values, workers=None):
+    """encrypt_data over a batch, in order, using a thread pool for large batches."""
+    return parallel_map(encrypt_data, values, workers)
+
+def decrypt_many(tokens, workers=None):
+    """decrypt_data over a batch, in order (None for anything unreadable)."""
+    return parallel_map(decrypt_data, tokens, workers)
+
+def normalize_tag_id(tag_id):
+    """Reader UIDs arrive as '04:a2:3b:...' or '04A23B...'; store and compare one form."""
+    return ''.join(c for c in str(tag_id or '') if c.isalnum()).upper()
+
+def tag_mac(tag_id):
+    """HMAC written onto an NFC tag alongside its UID; proves the tag was issued by us."""
+    return hmac.new(TAG_MAC_KEY, normalize_tag_id(tag_id).encode('utf-8'), hashlib.sha256).hexdigest()[:TAG_MAC_LENGTH]
+
+def verify_tag_mac(tag_id, mac):
+    return hmac.compare_digest(tag_mac(tag_id), str(mac or '').lower())
+
+def encode_cursor(*values):
+    """Opaque, URL-safe keyset cursor for the given sort-key values."""
+    raw = json.dumps(list(values), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, size=2):
+    """Cursor from encode_cursor -> tuple of `size` string sort-key values."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor")
+    return tuple(str(v) for v in values)
+
+
+def parse_limit(limit_param, default=50, maximum=500):
+    """Validate a ?limit= page size, clamped to `maximum`."""
+    if limit_param in (None, ''):
+        return default
+    try:
+        limit = int(limit_param)
+    except (TypeError, ValueError):
+        raise ValueError("limit must be an integer")
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return min(limit, maximum)
+
+
+def detect_upload_format(filename=None, content_type=None):
+    name = (filename or '').lower()
+    ctype = (content_type or '').lower()
+    if name.endswith(('.jsonl', '.ndjson')) or 'ndjson' in ctype or 'jsonl' in ctype:
+        return 'jsonl'
+    return 'csv'
+
+
+def parse_upload(text, fmt='csv'):
+    """CSV (with header row) or JSONL -> list of row dicts. Bad JSONL lines become {'_error': ...}."""
+    if fmt == 'jsonl':
+        rows = []
+        for line_no, line in enumerate(text.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                rows.append({'_error': f"Invalid JSON on line {line_no}"})
+        return rows
+    return list(csv.DictReader(io.StringIO(text)))
+
+
+def read_upload(req, key):
+    """
+    Rows from a Flask request: multipart `file` (CSV/JSONL), a JSON array
+    (or {key: [...]}), or a raw text/csv / application/x-ndjson body.
+    """
+    upload = req.files.get('file')
+    if upload and upload.filename:
+        text = upload.read().decode('utf-8-sig')
+        return parse_upload(text, detect_upload_format(upload.filename, upload.mimetype))
+    if req.is_json:
+        data = req.get_json()
+        rows = data.get(key) if isinstance(data, dict) else data
+        if not isinstance(rows, list):
+            raise ValueError(f"Expected a JSON array of {key}")
+        return rows
+    text = req.get_data(as_text=True)
+    if not text.strip():
+        raise ValueError(f"No {key} provided")
+    return parse_upload(text, detect_upload_format(content_type=req.mimetype))